@@ -0,0 +1,128 @@
+"""
+Records per second through the JSON formatter, and through the pytf.jlog handler, against the
+implementations they replaced.
+
+    python -m benchmarks.bench_json_formatter [--records 200000] [--batch 64]
+
+The old formatter is copied here as it was. Both formatters are checked to produce the same
+lines before they're timed.
+"""
+import argparse
+import datetime as dt
+import json
+import logging
+import logging.handlers
+import os
+import tempfile
+import time
+
+import pytf.pytf_logging as pytf_logging
+from pytf.pytf_json_formatter import LOG_RECORD_BUILTIN_ATTRS, PytfJSONFormatter
+
+FMT_KEYS = pytf_logging.get_logging_config("")['formatters']['json']['fmt_keys']
+
+
+class OldJSONFormatter(logging.Formatter):
+    def __init__(self, *, fmt_keys: dict[str, str] | None = None):
+        super().__init__()
+        self.fmt_keys = fmt_keys if fmt_keys is not None else {}
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = self._prepare_log_dict(record)
+        return json.dumps(message, default=str)
+
+    def _prepare_log_dict(self, record: logging.LogRecord):
+        always_fields = {
+            "message": record.getMessage(),
+            "timestamp": dt.datetime.fromtimestamp(
+                record.created, tz=dt.timezone.utc
+            ).isoformat(),
+        }
+        if record.exc_info is not None:
+            always_fields["exc_info"] = self.formatException(record.exc_info)
+
+        if record.stack_info is not None:
+            always_fields["stack_info"] = self.formatStack(record.stack_info)
+
+        message = {
+            key: (
+                msg_val
+                if (msg_val := always_fields.pop(val, None)) is not None
+                else getattr(record, val)
+            )
+            for key, val in self.fmt_keys.items()
+        } | always_fields
+        for key, val in record.__dict__.items():
+            if key not in LOG_RECORD_BUILTIN_ATTRS:
+                message[key] = val
+
+        return message
+
+
+def make_records(count: int) -> [logging.LogRecord]:
+    # what the scheduler logs: mostly plain messages, some with arguments or extra fields
+    logger = logging.getLogger("pytf_logger")
+    records = []
+    start = time.time()
+    for i in range(count):
+        if i % 10 == 0:
+            record = logger.makeRecord("pytf_logger", logging.INFO, __file__, 42, "Queuing job %s::%s on queue: %s",
+                                       ("F1", f"J{i}", "default"), None, func="_dispatch_jobs",
+                                       extra={'family': "F1", 'tick': i})
+        else:
+            record = logger.makeRecord("pytf_logger", logging.INFO, __file__, 42,
+                                       f"Job F1::J{i} exited with error code 0 - Success", (), None)
+        # a few dozen records per second, as in a busy tick
+        record.created = start + i / 50
+        records.append(record)
+    return records
+
+
+def time_formatter(formatter: logging.Formatter, records: [logging.LogRecord]) -> float:
+    start = time.perf_counter()
+    for record in records:
+        formatter.format(record)
+    return len(records) / (time.perf_counter() - start)
+
+
+def time_handler(handler: logging.Handler, records: [logging.LogRecord]) -> float:
+    start = time.perf_counter()
+    for record in records:
+        handler.handle(record)
+    handler.close()
+    return len(records) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=200_000)
+    parser.add_argument("--batch", type=int, default=64)
+    args = parser.parse_args()
+
+    records = make_records(args.records)
+    old = OldJSONFormatter(fmt_keys=FMT_KEYS)
+    new = PytfJSONFormatter(fmt_keys=FMT_KEYS)
+    for record in records[:1000]:
+        assert old.format(record) == new.format(record), record.__dict__
+
+    print(f"{'formatter':28} {'records/s':>12}")
+    print(f"{'old':28} {time_formatter(old, records):12,.0f}")
+    print(f"{'new':28} {time_formatter(new, records):12,.0f}")
+
+    with tempfile.TemporaryDirectory() as root:
+        def handler(label, handler_class, formatter, **kwargs):
+            h = handler_class(os.path.join(root, f"{label}.jlog"), maxBytes=10_000_000, backupCount=2, **kwargs)
+            h.setFormatter(formatter)
+            return h
+
+        print(f"\n{'handler':28} {'records/s':>12}")
+        print(f"{'old formatter, rotating':28} "
+              f"{time_handler(handler('old', logging.handlers.RotatingFileHandler, old), records):12,.0f}")
+        print(f"{'new formatter, batch 1':28} "
+              f"{time_handler(handler('one', pytf_logging.BatchingRotatingFileHandler, new), records):12,.0f}")
+        batched = handler('batched', pytf_logging.BatchingRotatingFileHandler, new, batch_size=args.batch)
+        print(f"{f'new formatter, batch {args.batch}':28} {time_handler(batched, records):12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Compare scheduler tick latency with handlers attached directly to root (the old setup)
+against the queued pipeline installed by pytf_logging.setup_logging.
+
+    python -m benchmarks.bench_logging [--families 50] [--ticks 20]
+
+The executor discards every job and undoes its dispatch, so each tick dispatches the same ready
+jobs again and token accounting, the dispatcher and tick_stats log on every tick.
+"""
+import argparse
+import contextlib
+import io
+import logging
+import logging.config
+import os
+import statistics
+import tempfile
+import time
+
+import pytf.dirs as dirs
+import pytf.pytf_logging as pytf_logging
+import pytf.tick_stats as tick_stats
+from pytf.config import Config
+from pytf.main import main_function
+from pytf.mockdatetime import MockDateTime
+from pytf.runner import prepare_required_dirs
+from pytf.tick_profile import DryRunExecutor
+
+
+def make_root(root: str, num_families: int) -> Config:
+    config = Config.from_str("""
+    primary_tz = "America/Denver"
+    tokens.T1 = 2
+    """)
+    config.log_dir = os.path.join(root, "log_dir")
+    config.family_dir = os.path.join(root, "family_dir")
+    dirs.make_dir(config.log_dir)
+    dirs.make_dir(config.family_dir)
+    for i in range(num_families):
+        with open(os.path.join(config.family_dir, f"F{i}"), "w") as f:
+            f.write('start="0000"\n')
+            f.write('J1(tokens=["T1"]) J2(tokens=["T1"]) J3()\n')
+            f.write('J4() J5()\n')
+    return config
+
+
+def direct_logging(log_dir: str):
+    pytf_logging.stop_logging()
+    logging.config.dictConfig(pytf_logging.get_logging_config(log_dir))
+
+
+def time_ticks(config: Config, num_ticks: int) -> [float]:
+    MockDateTime.set_mock(2024, 2, 14, 2, 14, 0, 'America/Denver')
+    prepare_required_dirs(config)
+    todays_family_dir = dirs.dated_dir(os.path.join(config.family_dir, "{YYYY}{MM}{DD}"), MockDateTime.now())
+    dirs.copy_files_from_dir_to_dir(config.family_dir, todays_family_dir)
+    executor = DryRunExecutor(config)
+    timings = []
+    for _ in range(num_ticks):
+        tick_stats.start_tick()
+        start = time.perf_counter()
+        main_function(config, executor)
+        tick_stats.end_tick(10)
+        timings.append(time.perf_counter() - start)
+    MockDateTime.reset_mock_now()
+    return timings
+
+
+def run(label: str, configure, num_families: int, num_ticks: int):
+    with tempfile.TemporaryDirectory() as root, contextlib.redirect_stdout(io.StringIO()):
+        config = make_root(root, num_families)
+        configure(config.log_dir)
+        timings = time_ticks(config, num_ticks)
+        pytf_logging.stop_logging()
+    print(f"{label:8} mean {statistics.mean(timings) * 1000:8.2f} ms"
+          f"   median {statistics.median(timings) * 1000:8.2f} ms"
+          f"   max {max(timings) * 1000:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--families", type=int, default=50)
+    parser.add_argument("--ticks", type=int, default=20)
+    args = parser.parse_args()
+
+    run("direct", direct_logging, args.families, args.ticks)
+    run("queued", pytf_logging.setup_logging, args.families, args.ticks)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,11 @@
 #!/usr/bin/env python3
 
+# Automation runs commands like status, hold and mark thousands of times a day, so only
+# import what every command needs here. The scheduler (and with it Celery) and the
+# simulator are imported by the commands that use them. tests/test_import_time.py
+# keeps it that way.
+
+import datetime
 import json as j
 import os
 import logging.config
@@ -8,6 +14,7 @@ import pathlib
 import time
 
 import click
+import pytz
 
 from pytf.config import Config
 from pytf.exceptions import (PyTaskforestParseException,
@@ -16,15 +23,20 @@ from pytf.exceptions import (PyTaskforestParseException,
                              MSG_CONFIG_MISSING_FAMILY_DIR,
                              MSG_CONFIG_MISSING_JOB_DIR,
                              )
-from pytf.main import main as pytf_main, setup_logging_and_tokens
 from pytf.rerun import rerun as pytf_rerun
 from pytf.mark import mark as pytf_mark
 from pytf.holdAndRelease import hold as pytf_hold
 from pytf.holdAndRelease import remove_hold as pytf_remove_hold
 from pytf.holdAndRelease import release_dependencies as pytf_release_dependencies
 from pytf.status import status as pytf_status
+import pytf.archive as archive
+import pytf.history as history
+import pytf.instructions as instructions
+import pytf.tick_stats as tick_stats
+import pytf.metrics as metrics
 from pytf.mockdatetime import MockDateTime
 from pytf.pytftoken import PyTfToken
+from pytf.runner import prepare_required_dirs, setup_logging_and_tokens
 
 
 @click.group()
@@ -36,6 +48,7 @@ from pytf.pytftoken import PyTfToken
 @click.option('--config_file', help="Config File", type=click.File('r'))
 @click.option('--root', help='Main Directory',
               type=click.Path(file_okay=False, dir_okay=True, exists=True))
+@click.option('--shard', help='Name of the shard this scheduler runs, from the shards list in the config')
 @click.pass_context
 def pytf(context,
          log_dir,
@@ -43,7 +56,8 @@ def pytf(context,
          job_dir,
          instructions_dir,
          config_file,
-         root
+         root,
+         shard
          ):
     if root is None:
         root = "/pytf_root"
@@ -54,20 +68,27 @@ def pytf(context,
     root_instruction_dir = os.path.join(root, "instructions")
     root_config = os.path.join(root, "config")
 
+    config_path = None
     if config_file is None:
         if os.path.exists(root_config):
+            config_path = root_config
             config = Config.from_str(pathlib.Path(root_config).read_text())
         else:
             config = Config.from_str("")
     else:
         toml_str = config_file.read()
         config = Config.from_str(toml_str)
+        if os.path.isfile(config_file.name):
+            config_path = os.path.abspath(config_file.name)
 
     context.obj['config'] = config
+    config.config_file = config_path
     config.log_dir = coalesce(log_dir, config.log_dir, root_log_dir)
     config.family_dir = coalesce(family_dir, config.family_dir, root_family_dir)
     config.job_dir = coalesce(job_dir, config.job_dir, root_job_dir)
     config.instructions_dir = coalesce(instructions_dir, config.instructions_dir, root_instruction_dir)
+    if shard is not None:
+        config.shard = shard
 
     if config.log_dir is None:
         raise PyTaskforestParseException(MSG_CONFIG_MISSING_LOG_DIR)
@@ -90,6 +111,8 @@ def coalesce(d1, d2, root_d):
 @pytf.command()
 @click.pass_context
 def main(context):
+    from pytf.main import main as pytf_main
+
     logger = logging.getLogger('pytf_logger')
     for i in range(10, 0, -1):
         logger.info(f"{i}")
@@ -157,6 +180,235 @@ def status(context, json, collapse):
         print(format_string.format(**rec))
 
 
+@pytf.command()
+@click.option("--date", "yyyymmdd", required=True, help="Day to simulate (YYYYMMDD)")
+@click.option("--json", is_flag=True, show_default=True, default=False, help="Output JSON")
+@click.option("--keep_dir", is_flag=True, show_default=True, default=False, help="Keep the scratch root")
+@click.pass_context
+def simulate(context, yyyymmdd, json, keep_dir):
+    from pytf.simulate import simulate as pytf_simulate
+
+    config = context.obj['config']
+    report = pytf_simulate(config, yyyymmdd, keep_dir)
+
+    if json:
+        print(j.dumps(report))
+        return
+
+    print(f"Simulation of {report['date']}\n")
+    print(f"Makespan:         {report['makespan_seconds']} s")
+    print(f"Jobs completed:   {report['jobs_completed']}")
+    cpu = report['scheduler_cpu_per_tick']
+    print(f"Scheduler CPU:    {cpu['mean_seconds']:.4f} s/tick mean, "
+          f"{cpu['max_seconds']:.4f} s max over {cpu['ticks']} ticks")
+    for queue_name, waits in report['queue_waits'].items():
+        print(f"Queue {queue_name}: {waits['jobs']} jobs, "
+              f"wait {waits['mean_seconds']:.0f} s mean, {waits['max_seconds']:.0f} s max")
+    for token_name, contention in report['token_contention'].items():
+        print(f"Token {token_name}: {contention['wait_seconds']:.0f} s waited by {len(contention['jobs'])} jobs")
+    for job in report['never_ran']:
+        print(f"Never ran: {job}")
+    for job in report['unfinished']:
+        print(f"Unfinished: {job}")
+
+
+@pytf.command()
+@click.option("--json", is_flag=True, show_default=True, default=False, help="Output JSON")
+@click.option("--last", type=click.IntRange(min=1), default=10, show_default=True, help="Number of ticks to show")
+@click.pass_context
+def ticks(context, json, last):
+    config = context.obj['config']
+    recent_ticks = tick_stats.load(config.log_dir, config.shard)[-last:]
+
+    if json:
+        print(j.dumps(recent_ticks))
+        return
+
+    phase_names = [tick_stats.PHASE_FAMILY_COPY,
+                   tick_stats.PHASE_INSTRUCTIONS,
+                   tick_stats.PHASE_FAMILY_PARSE,
+                   tick_stats.PHASE_LOG_SCAN,
+                   tick_stats.PHASE_DEPENDENCY_EVAL,
+                   tick_stats.PHASE_TOKEN_ACCOUNTING,
+                   tick_stats.PHASE_DISPATCH]
+    counter_names = [tick_stats.COUNTER_FILES_PARSED,
+                     tick_stats.COUNTER_INFO_FILES_READ,
+                     tick_stats.COUNTER_JOBS_EVALUATED,
+                     tick_stats.COUNTER_JOBS_DISPATCHED,
+                     tick_stats.COUNTER_TOKENS_GRANTED]
+    for tick in recent_ticks:
+        started = datetime.datetime.fromtimestamp(tick['started'], tz=pytz.timezone(config.primary_tz))
+        phases = " ".join(f"{name}={tick['phases'].get(name, 0) * 1000:.1f}ms" for name in phase_names)
+        counters = " ".join(f"{name}={tick['counters'].get(name, 0)}" for name in counter_names)
+        overrun = f" OVERRUN {tick['overrun']:.3f}s" if tick['overrun'] else ""
+        print(f"{started.strftime('%Y/%m/%d %H:%M:%S')} {tick['duration'] * 1000:.1f}ms{overrun}")
+        print(f"    {phases}")
+        print(f"    {counters}")
+
+
+@pytf.command()
+@click.option("--port", type=click.IntRange(min=1, max=65535), default=9100, show_default=True)
+@click.option("--host", default="0.0.0.0", show_default=True)
+@click.pass_context
+def metrics_server(context, port, host):
+    config = context.obj['config']
+    metrics.serve(metrics.metrics_dir_for(config.log_dir), port, host)
+
+
+@pytf.command(name="profile")
+@click.option("--ticks", "num_ticks", type=click.IntRange(min=1), default=5, show_default=True,
+              help="Number of ticks to profile")
+@click.option("--out", "out_dir", default="pytf_profile", show_default=True, type=click.Path(file_okay=False),
+              help="Directory for the reports")
+@click.option("--top", type=click.IntRange(min=1), default=40, show_default=True,
+              help="Number of functions and lines in each table")
+@click.option("--json", is_flag=True, show_default=True, default=False, help="Output JSON")
+@click.pass_context
+def profile_ticks(context, num_ticks, out_dir, top, json):
+    from pytf.tick_profile import profile as pytf_profile
+
+    config = context.obj['config']
+    summary = pytf_profile(config, num_ticks, out_dir, top)
+
+    if json:
+        print(j.dumps(summary))
+        return
+
+    print(f"Profiled {summary['ticks']} ticks: "
+          f"{' '.join(f'{seconds * 1000:.1f}ms' for seconds in summary['tick_seconds'])}")
+    for phase, seconds in sorted(summary['phase_seconds'].items(), key=lambda item: -item[1]):
+        peak = summary['phase_peak_bytes'].get(phase, 0) / 1024
+        print(f"    {phase:20} {seconds * 1000:10.1f}ms  peak {peak:10.1f} KiB")
+    for path in summary['files'].values():
+        print(f"Wrote {path}")
+
+
+@pytf.command()
+@click.pass_context
+def worker(context):
+    from pytf.worker_launcher import launch
+
+    config = context.obj['config']
+    launch(config)
+
+
+@pytf.command()
+@click.option("--json", is_flag=True, show_default=True, default=False, help="Output JSON")
+@click.pass_context
+def workers(context, json):
+    from pytf.worker_launcher import load_states
+
+    config = context.obj['config']
+    states = load_states(config.log_dir)
+
+    if json:
+        print(j.dumps(states))
+        return
+
+    for state in states:
+        updated = datetime.datetime.fromtimestamp(state['updated'], tz=pytz.timezone(config.primary_tz))
+        stale = " STALE" if state['stale'] else ""
+        print(f"{state['queue']}@{state['host']} pid={state['pid']} processes={state['processes']} "
+              f"({state['min_concurrency']}-{state['max_concurrency']}) backlog={state['backlog']} "
+              f"load={state['load_per_cpu']} updated={updated.strftime('%Y/%m/%d %H:%M:%S')}{stale}")
+
+
+@pytf.command(name="archive")
+@click.option("--date", "yyyymmdd", help="Archive only this day (YYYYMMDD)")
+@click.option("--keep_days", type=click.IntRange(min=1), default=1, show_default=True,
+              help="Number of most recent days, including today, to leave unarchived")
+@click.pass_context
+def archive_days(context, yyyymmdd, keep_days):
+    config = context.obj['config']
+    if yyyymmdd is not None:
+        paths = [path] if (path := archive.archive_day(config, yyyymmdd)) is not None else []
+    else:
+        paths = archive.archive_finished_days(config, keep_days)
+    for path in paths:
+        print(f"Archived {path}")
+
+
+@pytf.command()
+@click.argument('family')
+@click.argument('job')
+@click.option("--date", "yyyymmdd", help="Day of the run (YYYYMMDD). Defaults to today")
+@click.option("--info", is_flag=True, show_default=True, default=False, help="Show the .info records instead of the log")
+@click.pass_context
+def log(context, family, job, yyyymmdd, info):
+    config = context.obj['config']
+    if yyyymmdd is None:
+        yyyymmdd = MockDateTime.now(tz=config.primary_tz).strftime("%Y%m%d")
+    files = archive.job_files(config, yyyymmdd, family, job)
+
+    if info:
+        for file_name, text in files['info'].items():
+            print(f"# {file_name}")
+            print(text)
+        return
+    if files['log'] is not None:
+        print(files['log'], end="")
+
+
+@pytf.command(name="history")
+@click.option("--family", help="Family name")
+@click.option("--job", help="Job name. Includes repeating instances and reruns of the job")
+@click.option("--days", type=click.IntRange(min=1), default=90, show_default=True, help="Number of days to look back")
+@click.option("--failed", is_flag=True, show_default=True, default=False, help="Only failed runs")
+@click.option("--summary", is_flag=True, show_default=True, default=False, help="Aggregate instead of listing runs")
+@click.option("--reindex", is_flag=True, show_default=True, default=False,
+              help="First index any past days missing from the history")
+@click.option("--json", is_flag=True, show_default=True, default=False, help="Output JSON")
+@click.pass_context
+def history_command(context, family, job, days, failed, summary, reindex, json):
+    config = context.obj['config']
+    today = MockDateTime.now(tz=config.primary_tz)
+    if reindex:
+        history.index_missing_days(config, before=today.strftime("%Y%m%d"))
+    since = (today - datetime.timedelta(days=days)).strftime("%Y%m%d")
+    rows = history.runs(config, family, job, since=since, failed_only=failed)
+    result = history.summarize(rows) if summary else rows
+
+    if json:
+        print(j.dumps(result))
+        return
+
+    if summary:
+        def seconds(value):
+            return "-" if value is None else f"{value:.0f}s"
+        print(f"Runs:     {result['runs']}")
+        print(f"Failures: {result['failures']}")
+        print(f"Duration: mean {seconds(result['mean_seconds'])}, p50 {seconds(result['p50_seconds'])}, "
+              f"p95 {seconds(result['p95_seconds'])}, max {seconds(result['max_seconds'])}")
+        for day in result['failed_days']:
+            print(f"Failed on {day}")
+        return
+
+    for row in rows:
+        duration = "" if row['duration'] is None else f"{row['duration']:.0f}s"
+        print(f"{row['day']} {row['family_name']}::{row['job_name']} {row['start_time']} "
+              f"{duration:>8} rc={row['error_code']} {row['queue_name']}")
+
+
+@pytf.command()
+@click.argument('action', type=click.Choice(instructions.ACTIONS))
+@click.option("--family", default="*", show_default=True, help="Glob over family names")
+@click.option("--job", default="*", show_default=True, help="Glob over job names")
+@click.option("--downstream", is_flag=True, show_default=True, default=False,
+              help="With rerun, also rerun every job that depends on a matched job")
+@click.option("--error_code", type=click.IntRange(min=0, max=255), help="Error code for mark")
+@click.option("--now", is_flag=True, show_default=True, default=False,
+              help="Apply immediately instead of at the start of the scheduler's next tick")
+@click.pass_context
+def bulk(context, action, family, job, downstream, error_code, now):
+    config = context.obj['config']
+    instruction = instructions.make_instruction(action, family, job, downstream, error_code)
+    if now:
+        prepare_required_dirs(config)
+        print(f"Applied {instructions.apply(config, [instruction])} job operations")
+        return
+    print(f"Wrote {instructions.write_instruction_file(config, [instruction])}")
+
+
 @pytf.command()
 @click.argument('family')
 @click.argument('job')
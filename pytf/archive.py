@@ -0,0 +1,212 @@
+import collections
+import datetime
+import json
+import os
+import re
+import shutil
+import zipfile
+
+import tomlkit
+
+import pytf.dirs as dirs
+import pytf.exceptions as ex
+import pytf.runs as runs
+from .config import Config
+from .mockdatetime import MockDateTime
+
+ARCHIVE_SUBDIR = "archive"
+INDEX_MEMBER = "index.json"
+LOGS_PREFIX = "logs/"
+FAMILIES_PREFIX = "families/"
+MAX_OPEN_ARCHIVES = 8
+
+_DAY_DIR_REGEX = re.compile(r"^\d{8}$")
+
+# path -> (mtime, ZipFile, index). Opening an archive reads its central directory,
+# so keep the last few open for the web app, which asks for one job at a time.
+_open_archives: collections.OrderedDict = collections.OrderedDict()
+
+
+def archive_dir_for(log_dir: str) -> str:
+    return os.path.join(log_dir, ARCHIVE_SUBDIR)
+
+
+def archive_path(log_dir: str, yyyymmdd: str) -> str:
+    return os.path.join(archive_dir_for(log_dir), f"{yyyymmdd}.zip")
+
+
+def finished_days(config: Config, keep_days: int = 1) -> [str]:
+    """
+    Dated log and family dirs older than the most recent keep_days days (today counts as one).
+    """
+    today = MockDateTime.now(tz=config.primary_tz)
+    cutoff = (today - datetime.timedelta(days=keep_days - 1)).strftime("%Y%m%d")
+    days = set()
+    for parent in (config.log_dir, config.family_dir):
+        if parent is None or not os.path.isdir(parent):
+            continue
+        days.update(name for name in os.listdir(parent)
+                    if _DAY_DIR_REGEX.match(name) and os.path.isdir(os.path.join(parent, name)))
+    return sorted(day for day in days if day < cutoff)
+
+
+def archive_finished_days(config: Config, keep_days: int = 1) -> [str]:
+    return [path for day in finished_days(config, keep_days) if (path := archive_day(config, day)) is not None]
+
+
+def archive_day(config: Config, yyyymmdd: str) -> str | None:
+    """
+    Pack the day's log dir and family dir into log_dir/archive/YYYYMMDD.zip, then remove them.
+    The archive is written to a temp file and renamed, so the dirs are only removed once
+    a complete archive is in place. Archiving a day twice merges into the existing archive.
+
+    :return: the archive's path, or None if there was nothing to archive
+    """
+    validate_day(yyyymmdd)
+    log_day_dir = os.path.join(config.log_dir, yyyymmdd)
+    family_day_dir = os.path.join(config.family_dir, yyyymmdd) if config.family_dir else None
+    sources = [(LOGS_PREFIX, log_day_dir), (FAMILIES_PREFIX, family_day_dir)]
+    sources = [(prefix, d) for prefix, d in sources if d is not None and os.path.isdir(d)]
+    if not sources:
+        return None
+
+    path = archive_path(config.log_dir, yyyymmdd)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    _forget(path)
+
+    members = []
+    with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED) as new_archive:
+        for prefix, source_dir in sources:
+            for file_name in dirs.list_of_files_in_dir(source_dir):
+                new_archive.write(os.path.join(source_dir, file_name), prefix + file_name)
+                members.append(prefix + file_name)
+        written = set(members)
+        if os.path.exists(path):
+            with zipfile.ZipFile(path) as old_archive:
+                for name in old_archive.namelist():
+                    if name != INDEX_MEMBER and name not in written:
+                        new_archive.writestr(old_archive.getinfo(name), old_archive.read(name))
+                        members.append(name)
+        new_archive.writestr(INDEX_MEMBER, json.dumps(_build_index(yyyymmdd, members)))
+    os.replace(tmp_path, path)
+
+    for _, source_dir in sources:
+        shutil.rmtree(source_dir)
+    return path
+
+
+def list_day_files(config: Config, yyyymmdd: str) -> [str]:
+    """
+    Names of the files in the day's log dir, whether it's still a directory or archived.
+    """
+    log_day_dir = os.path.join(config.log_dir, yyyymmdd)
+    if os.path.isdir(log_day_dir):
+        return dirs.list_of_files_in_dir(log_day_dir)
+    if (opened := _open_archive(config.log_dir, yyyymmdd)) is None:
+        return []
+    return opened[1]['files']
+
+
+def read_day_file(config: Config, yyyymmdd: str, file_name: str) -> str | None:
+    log_day_dir = os.path.join(config.log_dir, yyyymmdd)
+    if os.path.isdir(log_day_dir):
+        path = os.path.join(log_day_dir, file_name)
+        if not os.path.isfile(path):
+            return None
+        with open(path) as f:
+            return f.read()
+    if (opened := _open_archive(config.log_dir, yyyymmdd)) is None:
+        return None
+    try:
+        return opened[0].read(LOGS_PREFIX + file_name).decode("utf-8", errors="replace")
+    except KeyError:
+        return None
+
+
+def job_files(config: Config, yyyymmdd: str, family_name: str, job_name: str) -> dict:
+    """
+    The job's .info records and run log for a day. Archived days are looked up through
+    the archive's index, so this doesn't depend on how many jobs ran that day.
+
+    :return: {"info": {file_name: toml_text}, "log": log_text or None}
+    """
+    validate_day(yyyymmdd)
+    key = f"{family_name}.{job_name}"
+    log_day_dir = os.path.join(config.log_dir, yyyymmdd)
+    if os.path.isdir(log_day_dir):
+        entry = _index_entry([f for f in dirs.list_of_files_in_dir(log_day_dir) if f.startswith(f"{key}.")], key)
+    elif (opened := _open_archive(config.log_dir, yyyymmdd)) is not None:
+        entry = opened[1]['jobs'].get(key, {"info": [], "log": None})
+    else:
+        entry = {"info": [], "log": None}
+
+    if not entry['info']:
+        # the instances of a repeating job share their base job's .runs file and log
+        base_name = runs.base_job_name(job_name)
+        runs_name = f"{family_name}.{base_name}{runs.RUNS_SUFFIX}"
+        if (runs_text := read_day_file(config, yyyymmdd, runs_name)) is not None:
+            log_text = read_day_file(config, yyyymmdd, f"{family_name}.{base_name}.log")
+            if job_name == base_name:
+                return {"info": {runs_name: runs_text}, "log": log_text}
+            if (record := runs.fold(runs_text).get(job_name)) is None:
+                return {"info": {}, "log": None}
+            return {"info": {f"{runs_name}:{job_name}": tomlkit.dumps(record)},
+                    "log": runs.instance_log(log_text.encode("utf-8"), record) if log_text is not None else None}
+
+    return {"info": {name: read_day_file(config, yyyymmdd, name) for name in entry['info']},
+            "log": read_day_file(config, yyyymmdd, entry['log']) if entry['log'] else None}
+
+
+def _build_index(yyyymmdd: str, members: [str]) -> dict:
+    files = sorted(m[len(LOGS_PREFIX):] for m in members if m.startswith(LOGS_PREFIX))
+    families = sorted(m[len(FAMILIES_PREFIX):] for m in members if m.startswith(FAMILIES_PREFIX))
+    by_job = {}
+    for file_name in files:
+        parts = file_name.split(".")
+        if len(parts) >= 3 and parts[-1] in ("info", "log"):
+            by_job.setdefault(f"{parts[0]}.{parts[1]}", []).append(file_name)
+    jobs = {key: _index_entry(file_names, key) for key, file_names in by_job.items()}
+    return {"date": yyyymmdd, "files": files, "families": families, "jobs": jobs}
+
+
+def _index_entry(file_names: [str], key: str) -> dict:
+    # File names are Family.Job.log and Family.Job.queue.worker.start_time.info
+    return {"info": sorted(f for f in file_names if f.endswith(".info")),
+            "log": f"{key}.log" if f"{key}.log" in file_names else None}
+
+
+def _open_archive(log_dir: str, yyyymmdd: str) -> tuple[zipfile.ZipFile, dict] | None:
+    path = archive_path(log_dir, yyyymmdd)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    cached = _open_archives.get(path)
+    if cached is not None and cached[0] == mtime:
+        _open_archives.move_to_end(path)
+        return cached[1], cached[2]
+
+    _forget(path)
+    archive = zipfile.ZipFile(path)
+    index = json.loads(archive.read(INDEX_MEMBER))
+    _open_archives[path] = (mtime, archive, index)
+    while len(_open_archives) > MAX_OPEN_ARCHIVES:
+        _, (_, oldest, _) = _open_archives.popitem(last=False)
+        oldest.close()
+    return archive, index
+
+
+def _forget(path: str):
+    if (cached := _open_archives.pop(path, None)) is not None:
+        cached[1].close()
+
+
+def validate_day(yyyymmdd: str):
+    try:
+        datetime.datetime.strptime(yyyymmdd, "%Y%m%d")
+    except ValueError as e:
+        raise ex.PyTaskforestParseException(f"{ex.MSG_ARCHIVE_INVALID_DATE} {yyyymmdd}") from e
+    if not _DAY_DIR_REGEX.match(yyyymmdd):
+        raise ex.PyTaskforestParseException(f"{ex.MSG_ARCHIVE_INVALID_DATE} {yyyymmdd}")
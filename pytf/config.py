@@ -22,6 +22,7 @@ class Config:
     family_dir: str | None = field(default=None)
     job_dir: str | None = field(default=None)
     instructions_dir: str | None = field(default=None)
+    config_file: str | None = field(default=None)
     todays_log_dir: str | None = field(default=None)
     todays_family_dir: str | None = field(default=None)
 
@@ -31,20 +32,46 @@ class Config:
     collapse: bool = field(default=True)
     chained: bool = field(default=True)
     log_level: int | None = field(default=logging.WARN)
+    json_log_batch: int = field(default=1)
     ignore_regex: [str] = field()
 
     @ignore_regex.default
     def _ignore_regex_default(self):
         return [".*~$", ".*\\.bak$", ".*\\$$"]
 
-    tokens: [PyTfToken] = field(default=[])
-    tokens_by_name: dict = field(default={})
+    tokens: [PyTfToken] = field(factory=list)
+    tokens_by_name: dict = field(factory=dict)
+    max_outstanding: dict = field(factory=dict)
+    token_weights: dict = field(factory=dict)
+    token_priorities: dict = field(factory=dict)
+    token_aging: int = field(default=300)
+    token_reserve_after: int = field(default=1800)
+    token_lease: int = field(default=300)
+    queued_timeout: int = field(default=3600)
+    max_runtime: int | None = field(default=None)
+    queues: dict = field(factory=dict)
+    info_fsync: str = field(default="never")
     num_retries: int = field(default=0)
     retry_sleep: int = field(default=1)
     web_hook: str = field(default=None)
     hook_auth: str = field(default=None)
+    email: str | None = field(default=None)
+    retry_email: str | None = field(default=None)
+    retry_success_email: str | None = field(default=None)
+    no_retry_email: bool = field(default=False)
+    no_retry_success_email: bool = field(default=False)
+    email_from: str = field(default="pytf@localhost")
+    email_window: int = field(default=60)
+    smtp_server: str | None = field(default=None)
+    smtp_port: int = field(default=25)
+    smtp_user: str | None = field(default=None)
+    smtp_password: str | None = field(default=None)
     primary_tz: str = field(default="UTC")
-    calendars: dict = field(default={})
+    calendars: dict = field(factory=dict)
+    simulation: dict = field(factory=dict)
+    shards: [str] = field(factory=list)
+    shard: str | None = field(default=None)
+    shard_vnodes: int = field(default=64)
 
     def set_if_not_none(self, key, orig_value):
         return self.d[key] if self.d.get(key) is not None else orig_value
@@ -64,15 +91,41 @@ class Config:
             obj.collapse = obj.set_if_not_none('collapse', obj.collapse)
             obj.chained = obj.set_if_not_none('chained', obj.chained)
             obj.log_level = obj.set_if_not_none('log_level', obj.log_level)  # TODO: Convert this from string to proper type
+            obj.json_log_batch = obj.set_if_not_none('json_log_batch', obj.json_log_batch)
             obj.ignore_regex = obj.set_if_not_none('ignore_regex', obj.ignore_regex)
             obj.num_retries = obj.set_if_not_none('num_retries', obj.num_retries)
             obj.retry_sleep = obj.set_if_not_none('retry_sleep', obj.retry_sleep)
             obj.web_hook = obj.set_if_not_none('web_hook', obj.web_hook)
             obj.hook_auth = obj.set_if_not_none('hook_auth', obj.hook_auth)
+            obj.email = obj.set_if_not_none('email', obj.email)
+            obj.retry_email = obj.set_if_not_none('retry_email', obj.retry_email)
+            obj.retry_success_email = obj.set_if_not_none('retry_success_email', obj.retry_success_email)
+            obj.no_retry_email = obj.set_if_not_none('no_retry_email', obj.no_retry_email)
+            obj.no_retry_success_email = obj.set_if_not_none('no_retry_success_email', obj.no_retry_success_email)
+            obj.email_from = obj.set_if_not_none('email_from', obj.email_from)
+            obj.email_window = obj.set_if_not_none('email_window', obj.email_window)
+            obj.smtp_server = obj.set_if_not_none('smtp_server', obj.smtp_server)
+            obj.smtp_port = obj.set_if_not_none('smtp_port', obj.smtp_port)
+            obj.smtp_user = obj.set_if_not_none('smtp_user', obj.smtp_user)
+            obj.smtp_password = obj.set_if_not_none('smtp_password', obj.smtp_password)
             obj.primary_tz = obj.set_if_not_none('primary_tz', obj.primary_tz)
             obj.run_local = obj.set_if_not_none('run_local', obj.run_local)
             obj.once_only = obj.set_if_not_none('once_only', obj.once_only)
+            obj.max_outstanding = obj.set_if_not_none('max_outstanding', obj.max_outstanding)
+            obj.token_weights = obj.set_if_not_none('token_weights', obj.token_weights)
+            obj.token_priorities = obj.set_if_not_none('token_priorities', obj.token_priorities)
+            obj.token_aging = obj.set_if_not_none('token_aging', obj.token_aging)
+            obj.token_reserve_after = obj.set_if_not_none('token_reserve_after', obj.token_reserve_after)
+            obj.token_lease = obj.set_if_not_none('token_lease', obj.token_lease)
+            obj.queued_timeout = obj.set_if_not_none('queued_timeout', obj.queued_timeout)
+            obj.max_runtime = obj.set_if_not_none('max_runtime', obj.max_runtime)
+            obj.queues = obj.set_if_not_none('queues', obj.queues)
+            obj.info_fsync = obj.set_if_not_none('info_fsync', obj.info_fsync)
             obj.calendars = obj.set_if_not_none('calendars', obj.calendars)
+            obj.simulation = obj.set_if_not_none('simulation', obj.simulation)
+            obj.shards = obj.set_if_not_none('shards', obj.shards)
+            obj.shard = obj.set_if_not_none('shard', obj.shard)
+            obj.shard_vnodes = obj.set_if_not_none('shard_vnodes', obj.shard_vnodes)
 
             if temp_tokens := obj.set_if_not_none('tokens', obj.tokens):
                 obj.tokens = [
@@ -0,0 +1,199 @@
+"""
+Re-read the config file while the scheduler is running.
+
+The scheduler checks between ticks whether it got a SIGHUP or the file's mtime changed. The new
+file is parsed and validated in full before anything is applied, so a broken config is logged
+and ignored and the old one stays in effect. The running Config object is updated in place,
+since families and their dependencies keep a reference to it.
+
+Settings given on the command line (the directories and --shard) aren't reloaded. end_time_hr
+and end_time_min are reloaded, but the current run still ends at the time it started with.
+"""
+import logging
+import os
+import pathlib
+import re
+import signal
+
+import pytz
+import tomlkit.exceptions
+
+import pytf.exceptions as ex
+import pytf.job_info as job_info
+import pytf.webhooks as webhooks
+from .config import Config
+from .family import families_using_calendars
+from .mockdatetime import MockDateTime
+from .pytf_calendar import Calendar
+
+RELOADABLE = (
+    'end_time_hr',
+    'end_time_min',
+    'once_only',
+    'collapse',
+    'chained',
+    'log_level',
+    'ignore_regex',
+    'tokens',
+    'max_outstanding',
+    'token_weights',
+    'token_priorities',
+    'token_aging',
+    'token_reserve_after',
+    'token_lease',
+    'queued_timeout',
+    'max_runtime',
+    'info_fsync',
+    'num_retries',
+    'retry_sleep',
+    'web_hook',
+    'hook_auth',
+    'email',
+    'retry_email',
+    'retry_success_email',
+    'no_retry_email',
+    'no_retry_success_email',
+    'email_from',
+    'email_window',
+    'smtp_server',
+    'smtp_port',
+    'smtp_user',
+    'smtp_password',
+    'primary_tz',
+    'calendars',
+    'simulation',
+    'shards',
+    'shard_vnodes',
+)
+
+
+def validate(config: Config):
+    """
+    Check what Config.from_str doesn't, so that a bad value is caught at reload time
+    rather than in the middle of a tick.
+    """
+    try:
+        pytz.timezone(config.primary_tz)
+    except pytz.UnknownTimeZoneError as e:
+        raise ex.PyTaskforestParseException(f"{ex.MSG_CONFIG_INVALID_VALUE} primary_tz = {config.primary_tz}") from e
+    for regex in config.ignore_regex:
+        try:
+            re.compile(regex)
+        except re.error as e:
+            raise ex.PyTaskforestParseException(f"{ex.MSG_CONFIG_INVALID_VALUE} ignore_regex = {regex}") from e
+    for token in config.tokens:
+        if not isinstance(token.num_instances, int) or token.num_instances < 0:
+            raise ex.PyTaskforestParseException(
+                f"{ex.MSG_CONFIG_INVALID_VALUE} tokens.{token.name} = {token.num_instances}")
+    for queue_name, limit in config.max_outstanding.items():
+        if not isinstance(limit, int) or limit < 0:
+            raise ex.PyTaskforestParseException(
+                f"{ex.MSG_CONFIG_INVALID_VALUE} max_outstanding.{queue_name} = {limit}")
+    for family_name, weight in config.token_weights.items():
+        if not isinstance(weight, (int, float)) or weight <= 0:
+            raise ex.PyTaskforestParseException(
+                f"{ex.MSG_CONFIG_INVALID_VALUE} token_weights.{family_name} = {weight}")
+    for family_name, priority in config.token_priorities.items():
+        if not isinstance(priority, int):
+            raise ex.PyTaskforestParseException(
+                f"{ex.MSG_CONFIG_INVALID_VALUE} token_priorities.{family_name} = {priority}")
+    for name in ('token_aging', 'token_reserve_after', 'token_lease'):
+        if not isinstance(getattr(config, name), int) or getattr(config, name) < 0:
+            raise ex.PyTaskforestParseException(f"{ex.MSG_CONFIG_INVALID_VALUE} {name} = {getattr(config, name)}")
+    if not isinstance(config.queued_timeout, int) or config.queued_timeout < 1:
+        raise ex.PyTaskforestParseException(f"{ex.MSG_CONFIG_INVALID_VALUE} queued_timeout = {config.queued_timeout}")
+    if config.max_runtime is not None and (not isinstance(config.max_runtime, int) or config.max_runtime < 1):
+        raise ex.PyTaskforestParseException(f"{ex.MSG_CONFIG_INVALID_VALUE} max_runtime = {config.max_runtime}")
+    if config.info_fsync not in job_info.FSYNC_POLICIES:
+        raise ex.PyTaskforestParseException(f"{ex.MSG_CONFIG_INVALID_VALUE} info_fsync = {config.info_fsync}")
+    today = MockDateTime.now(config.primary_tz)
+    for name, rules in config.calendars.items():
+        # raises on rules that don't parse
+        Calendar(name, rules=rules).is_date_included(today.year, today.month, today.day)
+    if config.shard is not None and config.shards and config.shard not in config.shards:
+        raise ex.PyTaskforestParseException(f"{ex.MSG_CONFIG_UNKNOWN_SHARD} {config.shard}")
+
+
+def reload(config: Config, toml_str: str) -> dict:
+    """
+    Apply toml_str to config, in place, if it's valid.
+
+    :return: {"changed": [setting names], "calendars": [changed calendar names],
+              "families": [cached families that use those calendars]}
+    :raises PyTaskforestParseException: if toml_str is invalid; config is untouched
+    """
+    try:
+        new_config = Config.from_str(toml_str)
+    except tomlkit.exceptions.ParseError as e:
+        raise ex.PyTaskforestParseException(ex.MSG_CONFIG_PARSING_FAILED) from e
+    new_config.shard = config.shard
+    validate(new_config)
+
+    changed = [name for name in RELOADABLE if _plain(getattr(config, name)) != _plain(getattr(new_config, name))]
+    old_calendars = _plain(config.calendars)
+    new_calendars = _plain(new_config.calendars)
+    calendars = sorted(name for name in set(old_calendars) | set(new_calendars)
+                       if old_calendars.get(name) != new_calendars.get(name))
+
+    for name in changed:
+        setattr(config, name, getattr(new_config, name))
+    config.tokens_by_name = {token.name: token for token in config.tokens}
+    config.toml_str = toml_str
+    config.d = new_config.d
+    if 'web_hook' in changed or 'hook_auth' in changed:
+        # the sender copied them when it started; the next event starts one with the new ones
+        webhooks.stop()
+
+    # Families are re-parsed on the next tick if primary_tz, end_time or their calendar
+    # changed (see get_families_from_dir); this is just for the log.
+    return {"changed": changed, "calendars": calendars, "families": families_using_calendars(calendars)}
+
+
+def _plain(value):
+    # tomlkit containers compare by content, but not always with plain ones
+    if isinstance(value, dict):
+        return {str(k): _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    return value
+
+
+class ConfigWatcher:
+    """
+    Call check() between ticks. It reloads the config file if the process got a SIGHUP or the
+    file's mtime changed since the last check.
+    """
+    def __init__(self, config: Config, path: str | None):
+        self.config = config
+        self.path = path
+        self.hangup = False
+        self.mtime = self._mtime()
+        if path is not None:
+            signal.signal(signal.SIGHUP, self._on_hangup)
+
+    def _on_hangup(self, _signum, _frame):
+        self.hangup = True
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns if self.path else None
+        except FileNotFoundError:
+            return None
+
+    def check(self) -> dict | None:
+        mtime = self._mtime()
+        if not self.hangup and mtime == self.mtime:
+            return None
+        self.hangup = False
+        self.mtime = mtime
+
+        logger = logging.getLogger('pytf_logger')
+        try:
+            diff = reload(self.config, pathlib.Path(self.path).read_text())
+        except (OSError, ex.PyTaskforestParseException) as e:
+            logger.error(f"Not reloading {self.path}, keeping the current config: {e}")
+            return None
+        logger.warning(f"Reloaded {self.path}: changed {', '.join(diff['changed']) or 'nothing'}"
+                       + (f"; calendars {', '.join(diff['calendars'])} used by {', '.join(diff['families']) or 'no families'}"
+                          if diff['calendars'] else ""))
+        return diff
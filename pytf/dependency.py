@@ -50,6 +50,7 @@ class JobDependency(Dependency):
                 return False
             if family_dict[self.job_name].error_code is None:
                 return False
+            # a job skipped because it was up to date has error_code 0 too
             return family_dict[self.job_name].error_code == 0
         return False
 
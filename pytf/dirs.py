@@ -44,9 +44,9 @@ def make_dir(dir_name: str):
     os.makedirs(dir_name)
 
 
-def text_files_in_dir(dir_name: str, ignore_regexes: [str]) -> [(str, str)]:
+def text_files_in_dir(dir_name: str, ignore_regexes: [str], keep=None) -> [(str, str)]:
     dir_path = pathlib.Path(dir_name)
-    files = [item for item in dir_path.iterdir() if item.is_file()]
+    files = [item for item in dir_path.iterdir() if item.is_file() and (keep is None or keep(item.name))]
     filtered = []
     for file in sorted(files):
         matched = False
@@ -0,0 +1,99 @@
+import json
+import os
+
+from .config import Config
+from .mockdatetime import MockDateTime
+
+EVENT_START = "start"
+EVENT_SUCCESS = "success"
+EVENT_FAILURE = "failure"
+EVENT_RETRY = "retry"
+
+EVENTS_BY_STATUS = {
+    'Running': EVENT_START,
+    'Success': EVENT_SUCCESS,
+    'Up To Date': EVENT_SUCCESS,
+    'Failure': EVENT_FAILURE,
+    'Timed Out': EVENT_FAILURE,
+    'Retry Wait': EVENT_RETRY,
+}
+
+SEEN_FILE = "events_seen.json"
+
+# seen file path -> {event id: [family_name, job_name, event]}. Saved to the log dir so that a
+# restarted scheduler doesn't announce everything that happened earlier in the day again.
+_seen: dict = {}
+
+
+def seen_path(config: Config) -> str:
+    """
+    Each shard only sees its own families, so each keeps its own file.
+    """
+    if config.shard is None:
+        return os.path.join(config.todays_log_dir, SEEN_FILE)
+    return os.path.join(config.todays_log_dir, f"events_seen.{config.shard}.json")
+
+
+def detect(config: Config, flat_list: [dict]) -> [dict]:
+    """
+    Compare this tick's statuses with what's already been announced and return an event for
+    each job that started, succeeded, failed or is waiting to retry since then. Each try has
+    its own start_time, so each try gets its own events. A try that goes through several
+    states between two ticks only gets an event for the one it's in now.
+
+    Success and failure events have retried = True if the job was waiting to retry earlier in the day.
+    """
+    path = seen_path(config)
+    seen = _load_seen(path)
+    day = os.path.basename(config.todays_log_dir)
+    now = MockDateTime.now(config.primary_tz).isoformat()
+
+    retried = {(family_name, job_name) for family_name, job_name, event in seen.values() if event == EVENT_RETRY}
+    events = []
+    for job in flat_list:
+        event = EVENTS_BY_STATUS.get(job['status'])
+        if event is None or job.get('start_time') is None:
+            continue
+        event_id = f"{day}.{job['family_name']}.{job['job_name']}.{job['start_time']}.{event}"
+        if event_id in seen:
+            continue
+        seen[event_id] = [job['family_name'], job['job_name'], event]
+        if event == EVENT_RETRY:
+            retried.add((job['family_name'], job['job_name']))
+        events.append({"id": event_id,
+                       "event": event,
+                       "time": now,
+                       "day": day,
+                       "family_name": job['family_name'],
+                       "job_name": job['job_name'],
+                       "queue_name": job.get('queue_name'),
+                       "worker_name": job.get('worker_name'),
+                       "start_time": job['start_time'],
+                       "end_time": job.get('end_time'),
+                       "error_code": job.get('error_code'),
+                       "retried": (job['family_name'], job['job_name']) in retried and event != EVENT_RETRY})
+
+    if events:
+        _save_seen(path, seen)
+    return events
+
+
+def reset():
+    _seen.clear()
+
+
+def _load_seen(path: str) -> dict:
+    if path not in _seen:
+        try:
+            with open(path) as f:
+                _seen[path] = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            _seen[path] = {}
+    return _seen[path]
+
+
+def _save_seen(path: str, seen: dict):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(seen, f)
+    os.replace(tmp_path, path)
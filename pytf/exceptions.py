@@ -13,10 +13,12 @@ MSG_START_TIME_PARSING_FAILED = "Start Time Parsing failed for job:"
 MSG_UNTIL_TIME_PARSING_FAILED = "Until Time Parsing failed for job:"
 MSG_UNRECOGNIZED_PARAM = "Unrecognized job parameter for job:"
 MSG_INVALID_TYPE = "Invalid Type for job/key:"
+MSG_INVALID_VALUE = "Invalid value for job/key:"
 MSG_FAMILY_START_TIME_PARSING_FAILED = "Start Time Parsing failed for family:"
 MSG_FAMILY_UNRECOGNIZED_PARAM = "Unrecognized job parameter for job:"
 MSG_FAMILY_FIRST_LINE_PARSE_FAIL = "First line of family failed to parse:"
 MSG_FAMILY_INVALID_TYPE = "Invalid Type for job/key:"
+MSG_FAMILY_INVALID_VALUE = "Invalid value for family/key:"
 MSG_FAMILY_CAL_AND_DAYS = "Cannot have both Calendar and Days specified"
 MSG_FAMILY_UNKNOWN_CALENDAR = "Unknown Calendar:"
 MSG_FAMILY_JOB_TWICE = "Job appears more than once in a family:"
@@ -32,6 +34,15 @@ MSG_CONFIG_MISSING_LOG_DIR = "Failed to parse config file - Missing log dir"
 MSG_CONFIG_MISSING_JOB_DIR = "Failed to parse config file - Missing job dir"
 MSG_CONFIG_MISSING_FAMILY_DIR = "Failed to parse config file - Missing family dir"
 MSG_CONFIG_MISSING_INSTRUCTIONS_DIR = "Failed to parse config file - Missing instructions dir"
+MSG_CONFIG_UNKNOWN_SHARD = "Shard is not listed in shards:"
+MSG_CONFIG_INVALID_VALUE = "Failed to parse config file - Invalid value:"
 
 MSG_FOREST_REPEATING_JOBS_SHOULD_BE_ALONE_IN_FOREST = "Failed to parse Family - repeating jobs should be in a forest by themselves:"
 MSG_CANT_FIND_SINGLE_JOB_INFO_FILE = "Failed to find single job info file:"
+
+MSG_SIMULATE_INVALID_DATE = "Invalid simulation date (expected YYYYMMDD):"
+MSG_ARCHIVE_INVALID_DATE = "Invalid archive date (expected YYYYMMDD):"
+MSG_INSTRUCTIONS_PARSING_FAILED = "Failed to parse instruction file"
+MSG_INSTRUCTIONS_UNKNOWN_ACTION = "Unknown instruction action:"
+MSG_INSTRUCTIONS_MARK_NEEDS_ERROR_CODE = "A mark instruction needs an integer error_code"
+MSG_LOG_INVALID_NAME = "Invalid family or job name:"
@@ -17,9 +17,17 @@ from .pytf_calendar import Calendar
 from .dependency import JobDependency, TimeDependency
 from .days import Days
 from .job import Job
+from .limits import limit_error
 import pytf.logs
 from .mockdatetime import MockDateTime
 import pytf.dirs as dirs
+import pytf.sharding as sharding
+import pytf.tick_stats as tick_stats
+
+MAX_CACHED_FAMILY_DIRS = 4
+
+# family_dir -> {family_name: (family_str, fingerprint, Family)}
+_parsed_families: dict = {}
 
 
 @define
@@ -42,6 +50,13 @@ class Family:
     no_retry_success_email: bool | None = field(default=None)
     forests: [Forest] = field(default=None)
     comment: str | None = field(default=None)
+    max_rss: int | None = field(default=None)
+    cpu_seconds: int | None = field(default=None)
+    open_files: int | None = field(default=None)
+    nice: int | None = field(default=None)
+    ionice: int | None = field(default=None)
+    cpu_affinity: list[int] | None = field(default=None)
+    max_runtime: int | None = field(default=None)
     jobs_by_name: dict = field()
 
     @jobs_by_name.default
@@ -177,6 +192,16 @@ class Family:
                     no_retry_email=job.no_retry_email,
                     no_retry_success_email=job.no_retry_success_email,
                     comment=job.comment,
+                    warm_python=job.warm_python,
+                    inputs=job.inputs,
+                    outputs=job.outputs,
+                    max_rss=job.max_rss,
+                    cpu_seconds=job.cpu_seconds,
+                    open_files=job.open_files,
+                    nice=job.nice,
+                    ionice=job.ionice,
+                    cpu_affinity=job.cpu_affinity,
+                    max_runtime=job.max_runtime,
                     start_time_met_today=job.start_time_met_today,
                     family_name=job.family_name,
                     base_name=job.base_name,
@@ -257,6 +282,13 @@ class Family:
         fam.no_retry_email = d.get('no_retry_email')
         fam.no_retry_success_email = d.get('no_retry_success_email')
         fam.comment = d.get('comment')
+        fam.max_rss = d.get('max_rss')
+        fam.cpu_seconds = d.get('cpu_seconds')
+        fam.open_files = d.get('open_files')
+        fam.nice = d.get('nice')
+        fam.ionice = d.get('ionice')
+        fam.cpu_affinity = d.get('cpu_affinity')
+        fam.max_runtime = d.get('max_runtime')
         if d.get('calendar'):
             calendar_name = d['calendar']
             try:
@@ -286,10 +318,42 @@ class Family:
         cls.validate_string_params(d)
         cls.validate_string_list_params(d)
         cls.validate_bool_params(d)
+        cls.validate_int_params(d)
+        cls.validate_int_list_params(d)
 
         if d.get('calendar') and d.get('days'):
             raise ex.PyTaskforestParseException(ex.MSG_FAMILY_CAL_AND_DAYS)
 
+        if (message := limit_error(d)) is not None:
+            raise ex.PyTaskforestParseException(f"{ex.MSG_FAMILY_INVALID_VALUE} {message}")
+
+    @classmethod
+    def validate_int_params(cls, d):
+        ints = [
+            'max_rss',
+            'cpu_seconds',
+            'open_files',
+            'nice',
+            'ionice',
+            'max_runtime',
+        ]
+        for key in ints:
+            if key in d and type(d[key]) is not tomlkit.items.Integer:
+                raise ex.PyTaskforestParseException(
+                    f"{ex.MSG_FAMILY_INVALID_TYPE} {key} ({d[key]}) is type {simple_type(d[key])}")
+
+    @classmethod
+    def validate_int_list_params(cls, d):
+        int_lists = [
+            'cpu_affinity',
+        ]
+        for key in [i for i in int_lists if i in d]:
+            if not isinstance(d[key], list):
+                raise ex.PyTaskforestParseException(f"{ex.MSG_FAMILY_INVALID_TYPE} {key} ({d[key]}) is not a list")
+            for i in d[key]:
+                if type(i) is not tomlkit.items.Integer:
+                    raise ex.PyTaskforestParseException(f"{ex.MSG_FAMILY_INVALID_TYPE} {key} ({d[key]} :: {i})")
+
     @classmethod
     def validate_bool_params(cls, d):
         bools = [
@@ -341,6 +405,13 @@ class Family:
             'no_retry_email',
             'no_retry_success_email',
             'comment',
+            'max_rss',
+            'cpu_seconds',
+            'open_files',
+            'nice',
+            'ionice',
+            'cpu_affinity',
+            'max_runtime',
         ]
         for key in d:
             if key not in valid_keys:
@@ -384,7 +455,59 @@ class Family:
         return self.calendar_or_days.is_date_included(yyyy, mm, dd)
 
 
-def get_families_from_dir(family_dir: str, config: Config) -> [Family]:
-    files = dirs.text_files_in_dir(family_dir, config.ignore_regex)
+def get_families_from_dir(family_dir: str, config: Config, all_shards: bool = False) -> [Family]:
+    """
+    Parse the families in family_dir. A family is only parsed again if its file changed, or
+    something it was parsed with did: the day, primary_tz, end_time or the rules of its calendar.
+
+    :param all_shards: In sharded mode, include the families other shards schedule too
+    """
+    # in sharded mode, only read and parse the families this scheduler owns
+    owned = (lambda name: True) if all_shards else (lambda name: sharding.owns_family(config, name))
+    files = dirs.text_files_in_dir(family_dir, config.ignore_regex, keep=owned)
     files.sort(key=lambda tup: tup[0])
-    return [Family.parse(family_name=item[0], family_str=item[1], config=config) for item in files]
+
+    cached = _parsed_families.pop(family_dir, {})
+    parsed = {}
+    for family_name, family_str in files:
+        entry = cached.get(family_name)
+        if entry is None or entry[0] != family_str or entry[1] != _parse_fingerprint(config, entry[2]):
+            family = Family.parse(family_name=family_name, family_str=family_str, config=config)
+            entry = (family_str, _parse_fingerprint(config, family), family)
+            tick_stats.count(tick_stats.COUNTER_FILES_PARSED)
+        parsed[family_name] = entry
+
+    # keep the other shards' families for the next all_shards call
+    _parsed_families[family_dir] = {**{name: entry for name, entry in cached.items() if not owned(name)}, **parsed}
+    while len(_parsed_families) > MAX_CACHED_FAMILY_DIRS:
+        del _parsed_families[next(iter(_parsed_families))]
+    return [entry[2] for entry in parsed.values()]
+
+
+def families_using_calendars(calendar_names: [str]) -> [str]:
+    """
+    Names of the cached families that use one of these calendars.
+    """
+    return sorted({name
+                   for parsed in _parsed_families.values()
+                   for name, (_, _, family) in parsed.items()
+                   if isinstance(family.calendar_or_days, Calendar)
+                   and family.calendar_or_days.calendar_name in calendar_names})
+
+
+def clear_family_cache():
+    _parsed_families.clear()
+
+
+def _parse_fingerprint(config: Config, family: Family) -> tuple:
+    # everything Family.parse reads besides the family file
+    calendar_rules = None
+    if isinstance(family.calendar_or_days, Calendar):
+        calendar_rules = [str(rule) for rule in config.calendars.get(family.calendar_or_days.calendar_name, [])]
+    tz = family.tz or config.primary_tz
+    return (family.config is config,
+            MockDateTime.now(tz).date(),
+            config.primary_tz,
+            config.end_time_hr,
+            config.end_time_min,
+            calendar_rules)
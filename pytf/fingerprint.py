@@ -0,0 +1,103 @@
+"""
+Make-style up-to-date checks for jobs that declare inputs and outputs.
+
+A job with inputs=["data/*.csv"] and outputs=["out/report.pdf"] (globs, relative to the job
+dir unless absolute) is skipped when nothing it reads has changed since its last successful
+run and everything it wrote is still there, unchanged. Its script counts as an input.
+
+The state of each job's last successful run is kept in log_dir/fingerprints, so it lasts
+across days. It includes the size, mtime and hash of every file that was read, so a check
+only reads the files whose size or mtime has changed since. Touching a file without
+changing it doesn't make the job run again.
+"""
+import glob
+import hashlib
+import json
+import os
+
+from .runs import base_job_name
+
+STATE_DIR = "fingerprints"
+
+CHUNK_SIZE = 1 << 20
+
+
+def check(log_dir: str, family_name: str, job_name: str, job_dir: str, inputs: [str], outputs: [str]) -> (bool, dict):
+    """
+    :return: (whether the job is up to date, what to pass to record() if it runs and succeeds)
+    """
+    last = _load(_state_path(log_dir, family_name, job_name))
+    known = last.get('files', {})
+    # only the files read this time are kept, so deleted files drop out
+    files = {}
+    state = {'inputs': _digest(_matches(job_dir, [job_name, *inputs]), known, files), 'files': files}
+
+    output_paths = _matches(job_dir, outputs, every_pattern=True)
+    if output_paths is None or not last:
+        return False, state
+    up_to_date = last['inputs'] == state['inputs'] and last.get('outputs') == _digest(output_paths, known, files)
+    return up_to_date, state
+
+
+def record(log_dir: str, family_name: str, job_name: str, job_dir: str, state: dict, outputs: [str]):
+    """
+    Save the state of a successful run: its inputs as they were when it started, and its outputs.
+    """
+    output_paths = _matches(job_dir, outputs, every_pattern=True) or []
+    state = dict(state, outputs=_digest(output_paths, state['files'], state['files']))
+    path = _state_path(log_dir, family_name, job_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def _state_path(log_dir: str, family_name: str, job_name: str) -> str:
+    # every instance and rerun of a job shares its state
+    return os.path.join(log_dir, STATE_DIR, f"{family_name}.{base_job_name(job_name)}.json")
+
+
+def _load(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _matches(job_dir: str, patterns: [str], every_pattern: bool = False) -> list[str] | None:
+    """
+    :param every_pattern: Return None if any pattern matches nothing
+    """
+    paths = set()
+    for pattern in patterns:
+        found = [p for p in glob.glob(os.path.join(job_dir, pattern), recursive=True) if os.path.isfile(p)]
+        if every_pattern and not found:
+            return None
+        paths.update(found)
+    return sorted(paths)
+
+
+def _digest(paths: [str], known: dict, files: dict) -> str:
+    """
+    One hash for the names and contents of paths. known and files are path -> [size, mtime_ns, sha256].
+    A file whose size and mtime are in known isn't read again. Every path is added to files.
+    """
+    combined = hashlib.sha256()
+    for path in paths:
+        stat = os.stat(path)
+        cached = known.get(path)
+        if cached is None or cached[:2] != [stat.st_size, stat.st_mtime_ns]:
+            cached = [stat.st_size, stat.st_mtime_ns, _hash_file(path)]
+        files[path] = cached
+        combined.update(f"{path}\0{cached[2]}\0".encode())
+    return combined.hexdigest()
+
+
+def _hash_file(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            sha.update(chunk)
+    return sha.hexdigest()
@@ -0,0 +1,213 @@
+import datetime
+import os
+import re
+import sqlite3
+
+import pytz
+
+import pytf.archive as archive
+from .config import Config
+from .job_result import JobResult
+from .logs import job_result_from_info
+from .runs import RUNS_SUFFIX, base_job_name, records_in_day_file
+
+HISTORY_FILE = "history.sqlite"
+INFO_TIME_FORMAT = "%Y/%m/%d %H:%M:%S"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    day TEXT NOT NULL,
+    family_name TEXT NOT NULL,
+    job_name TEXT NOT NULL,
+    base_job_name TEXT NOT NULL,
+    queue_name TEXT,
+    worker_name TEXT,
+    tz TEXT,
+    start_time TEXT NOT NULL,
+    start_epoch REAL,
+    duration REAL,
+    error_code INTEGER,
+    PRIMARY KEY (day, family_name, job_name, start_time)
+);
+CREATE INDEX IF NOT EXISTS runs_by_job ON runs (family_name, base_job_name, day);
+CREATE TABLE IF NOT EXISTS indexed_days (
+    day TEXT PRIMARY KEY
+);
+"""
+
+# (log_dir, day, family, job, start_time) of runs this process has already recorded,
+# so that each tick only writes runs that finished since the last one
+_recorded: set = set()
+
+
+def history_path(log_dir: str) -> str:
+    return os.path.join(log_dir, HISTORY_FILE)
+
+
+def connect(log_dir: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(history_path(log_dir), timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def index_day(config: Config, yyyymmdd: str) -> int:
+    """
+    (Re)build the rows for one day from its .info and .runs files, whether the day is still a
+    directory or has been archived. Replacing the whole day picks up reruns, which
+    rename earlier runs to Job-Orig-n.
+
+    :return: the number of completed runs indexed
+    """
+    rows = []
+    for file_name in archive.list_day_files(config, yyyymmdd):
+        if not file_name.endswith((".info", RUNS_SUFFIX)):
+            continue
+        for info in records_in_day_file(file_name, archive.read_day_file(config, yyyymmdd, file_name)):
+            try:
+                job_result = job_result_from_info(info)
+            except KeyError:
+                continue
+            if (row := _row(yyyymmdd, job_result)) is not None:
+                rows.append(row)
+
+    with connect(config.log_dir) as conn:
+        conn.execute("DELETE FROM runs WHERE day = ?", (yyyymmdd,))
+        conn.executemany("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.execute("INSERT OR IGNORE INTO indexed_days VALUES (?)", (yyyymmdd,))
+    conn.close()
+    return len(rows)
+
+
+def index_missing_days(config: Config, before: str) -> [str]:
+    """
+    Index every day before `before` (YYYYMMDD) that has a log dir or an archive but isn't indexed yet.
+    """
+    days = set(archive.finished_days(config, keep_days=1))
+    archive_dir = archive.archive_dir_for(config.log_dir)
+    if os.path.isdir(archive_dir):
+        days.update(f[:-4] for f in os.listdir(archive_dir) if re.match(r"^\d{8}\.zip$", f))
+
+    conn = connect(config.log_dir)
+    indexed = {row['day'] for row in conn.execute("SELECT day FROM indexed_days")}
+    conn.close()
+
+    missing = sorted(day for day in days if day < before and day not in indexed)
+    for day in missing:
+        index_day(config, day)
+    return missing
+
+
+def record_completed(config: Config, flat_list: [dict]):
+    """
+    Upsert today's runs that have finished. Called every tick with the status's flat list;
+    runs already recorded by this process are skipped without touching the database.
+    """
+    day = os.path.basename(config.todays_log_dir)
+    rows = []
+    for job in flat_list:
+        if job.get('error_code') is None or job.get('start_time') is None or job['status'] == 'Retry Wait':
+            continue
+        key = (config.log_dir, day, job['family_name'], job['job_name'], job['start_time'])
+        if key in _recorded:
+            continue
+        job_result = JobResult(family_name=job['family_name'],
+                               job_name=job['job_name'],
+                               status=job['status'],
+                               queue_name=job['queue_name'],
+                               tz=job['tz'],
+                               worker_name=job['worker_name'],
+                               start_time=job['start_time'],
+                               end_time=job.get('end_time'),
+                               error_code=job['error_code'])
+        if (row := _row(day, job_result)) is not None:
+            rows.append(row)
+            _recorded.add(key)
+
+    if not rows:
+        return
+    with connect(config.log_dir) as conn:
+        conn.executemany("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.close()
+
+
+def runs(config: Config,
+         family_name: str | None = None,
+         job_name: str | None = None,
+         since: str | None = None,
+         until: str | None = None,
+         failed_only: bool = False) -> [dict]:
+    """
+    Indexed runs, oldest first. job_name matches the base job, so J1 includes J1-0930 and J1-Orig-1.
+    since and until are inclusive YYYYMMDD days.
+    """
+    clauses, params = [], []
+    for column, value in (("family_name = ?", family_name),
+                          ("base_job_name = ?", job_name),
+                          ("day >= ?", since),
+                          ("day <= ?", until)):
+        if value is not None:
+            clauses.append(column)
+            params.append(value)
+    if failed_only:
+        clauses.append("error_code != 0")
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    conn = connect(config.log_dir)
+    result = [dict(row) for row in conn.execute(f"SELECT * FROM runs {where} ORDER BY day, start_epoch", params)]
+    conn.close()
+    return result
+
+
+def summarize(run_rows: [dict]) -> dict:
+    durations = sorted(r['duration'] for r in run_rows if r['duration'] is not None)
+    failures = [r for r in run_rows if r['error_code']]
+    return {
+        "runs": len(run_rows),
+        "failures": len(failures),
+        "failed_days": sorted({r['day'] for r in failures}),
+        "mean_seconds": sum(durations) / len(durations) if durations else None,
+        "p50_seconds": percentile(durations, 50),
+        "p95_seconds": percentile(durations, 95),
+        "max_seconds": durations[-1] if durations else None,
+    }
+
+
+def percentile(sorted_values: [float], pct: float) -> float | None:
+    # nearest rank
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def reset():
+    _recorded.clear()
+
+
+def _row(day: str, job_result: JobResult) -> tuple | None:
+    if job_result.error_code is None:
+        return None
+    start_epoch = duration = None
+    if job_result.tz:
+        tz = pytz.timezone(job_result.tz)
+        try:
+            start = tz.localize(datetime.datetime.strptime(job_result.start_time, INFO_TIME_FORMAT))
+            start_epoch = start.timestamp()
+            if job_result.end_time:
+                end = tz.localize(datetime.datetime.strptime(job_result.end_time, INFO_TIME_FORMAT))
+                duration = (end - start).total_seconds()
+        except ValueError:
+            # keep the run, just without timings
+            pass
+    return (day,
+            job_result.family_name,
+            job_result.job_name,
+            base_job_name(job_result.job_name),
+            job_result.queue_name,
+            job_result.worker_name,
+            job_result.tz,
+            job_result.start_time,
+            start_epoch,
+            duration,
+            int(job_result.error_code))
@@ -0,0 +1,224 @@
+import fnmatch
+import logging
+import os
+import pathlib
+
+import tomlkit
+import tomlkit.exceptions
+
+import pytf.exceptions as ex
+import pytf.runs as runs
+import pytf.tick_stats as tick_stats
+from .config import Config
+from .dependency import JobDependency
+from .family import Family, get_families_from_dir
+from .holdAndRelease import hold, remove_hold, release_dependencies
+from .mark import mark
+from .mockdatetime import MockDateTime
+from .rerun import rerun
+from .runner import prepare_required_dirs
+
+ACTION_HOLD = "hold"
+ACTION_REMOVE_HOLD = "remove_hold"
+ACTION_RELEASE = "release_dependencies"
+ACTION_RERUN = "rerun"
+ACTION_MARK = "mark"
+ACTIONS = (ACTION_HOLD, ACTION_REMOVE_HOLD, ACTION_RELEASE, ACTION_RERUN, ACTION_MARK)
+
+PROCESSED_SUBDIR = "processed"
+FAILED_SUBDIR = "failed"
+
+
+def parse_instructions(toml_str: str) -> [dict]:
+    """
+    An instruction file is a list of tables:
+
+        [[instruction]]
+        action = "rerun"        # hold, remove_hold, release_dependencies, rerun or mark
+        family = "F*"           # glob over family names
+        job = "*"               # glob over job names
+        downstream = true       # rerun only: also rerun every job that depends on a matched job
+        error_code = 0          # mark only
+
+    The whole file is validated before anything in it is applied.
+    """
+    try:
+        doc = tomlkit.loads(toml_str)
+    except tomlkit.exceptions.ParseError as e:
+        raise ex.PyTaskforestParseException(ex.MSG_INSTRUCTIONS_PARSING_FAILED) from e
+
+    return [make_instruction(action=table.get('action'),
+                             family=table.get('family', "*"),
+                             job=table.get('job', "*"),
+                             downstream=bool(table.get('downstream', False)),
+                             error_code=table.get('error_code'))
+            for table in doc.get('instruction', [])]
+
+
+def make_instruction(action: str, family: str = "*", job: str = "*", downstream: bool = False,
+                     error_code: int | None = None) -> dict:
+    if action not in ACTIONS:
+        raise ex.PyTaskforestParseException(f"{ex.MSG_INSTRUCTIONS_UNKNOWN_ACTION} {action}")
+    if action == ACTION_MARK and not isinstance(error_code, int):
+        raise ex.PyTaskforestParseException(ex.MSG_INSTRUCTIONS_MARK_NEEDS_ERROR_CODE)
+    return {"action": action, "family": family, "job": job, "downstream": downstream, "error_code": error_code}
+
+
+def write_instruction_file(config: Config, instructions: [dict]) -> str:
+    """
+    Drop instructions for the scheduler to pick up at the start of its next tick.
+    The file is renamed into place so the scheduler never reads half of it.
+    """
+    doc = tomlkit.document()
+    aot = tomlkit.aot()
+    for instruction in instructions:
+        aot.append({k: v for k, v in instruction.items() if v is not None})
+    doc.append('instruction', aot)
+
+    stamp = MockDateTime.now(tz=config.primary_tz).strftime("%Y%m%d%H%M%S")
+    path = os.path.join(config.instructions_dir, f"{stamp}.{os.getpid()}.toml")
+    tmp_path = os.path.join(config.instructions_dir, f".{stamp}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(tomlkit.dumps(doc))
+    os.replace(tmp_path, path)
+    return path
+
+
+def pending_instruction_files(config: Config) -> [str]:
+    if config.instructions_dir is None or not os.path.isdir(config.instructions_dir):
+        return []
+    return sorted(f for f in os.listdir(config.instructions_dir)
+                  if f.endswith(".toml") and os.path.isfile(os.path.join(config.instructions_dir, f)))
+
+
+def apply_pending(config: Config) -> int:
+    """
+    Called by the scheduler at the start of a tick. Applies every instruction file in
+    instructions_dir in one pass, then moves each file to processed/ (or failed/ if it
+    doesn't parse). The tick's status is computed after this, so it never sees half a batch.
+
+    :return: the number of job operations applied
+    """
+    file_names = pending_instruction_files(config)
+    if not file_names:
+        return 0
+    prepare_required_dirs(config)
+
+    logger = logging.getLogger('pytf_logger')
+    with tick_stats.phase(tick_stats.PHASE_INSTRUCTIONS):
+        instructions = []
+        for file_name in file_names:
+            # Moving the file first claims it, in case several shards share instructions_dir
+            try:
+                path = _move(os.path.join(config.instructions_dir, file_name),
+                             os.path.join(config.instructions_dir, PROCESSED_SUBDIR))
+            except FileNotFoundError:
+                continue
+            try:
+                instructions.extend(parse_instructions(pathlib.Path(path).read_text()))
+            except ex.PyTaskforestParseException as e:
+                logger.error(f"Skipping instruction file {file_name}: {e}")
+                _move(path, os.path.join(config.instructions_dir, FAILED_SUBDIR))
+
+        applied = apply(config, instructions)
+    logger.info(f"Applied {applied} job operations from {len(file_names)} instruction files")
+    return applied
+
+
+def apply(config: Config, instructions: [dict]) -> int:
+    """
+    Apply instructions to today's jobs, listing the log dir and parsing the families once.
+    Requires prepare_required_dirs to have set config.todays_log_dir and config.todays_family_dir.
+    """
+    # instructions can name any family, including ones another shard schedules
+    families = get_families_from_dir(config.todays_family_dir, config, all_shards=True)
+    all_files = os.listdir(config.todays_log_dir)
+    known_jobs = sorted({(f.name, j) for f in families for j in f.jobs_by_name}
+                        | set(_jobs_with_info_files(config.todays_log_dir, all_files)))
+    info_keys = _info_keys(config.todays_log_dir, all_files)
+    downstream_of = _downstream_graph(families)
+    logger = logging.getLogger('pytf_logger')
+
+    applied = 0
+    for instruction in instructions:
+        targets = [(f, j) for f, j in known_jobs
+                   if fnmatch.fnmatchcase(f, instruction['family']) and fnmatch.fnmatchcase(j, instruction['job'])]
+        action = instruction['action']
+
+        if action == ACTION_RERUN:
+            downstream = _all_downstream(targets, downstream_of) if instruction['downstream'] else []
+            for family_name, job_name in targets:
+                rerun(config, family_name, job_name, all_files)
+            # downstream jobs wait for the jobs above them instead of being released
+            for family_name, job_name in downstream:
+                rerun(config, family_name, job_name, all_files, release=False)
+            applied += len(targets) + len(downstream)
+            all_files = os.listdir(config.todays_log_dir)
+            info_keys = _info_keys(config.todays_log_dir, all_files)
+            continue
+
+        for family_name, job_name in targets:
+            if action == ACTION_HOLD:
+                hold(config, family_name, job_name)
+            elif action == ACTION_REMOVE_HOLD:
+                remove_hold(config, family_name, job_name)
+            elif action == ACTION_RELEASE:
+                release_dependencies(config, family_name, job_name)
+            elif action == ACTION_MARK:
+                if (family_name, job_name) not in info_keys:
+                    continue
+                try:
+                    mark(config, family_name, job_name, instruction['error_code'], all_files)
+                except ex.PyTaskforestParseException as e:
+                    logger.error(f"Couldn't mark {family_name}::{job_name}: {e}")
+                    continue
+            applied += 1
+
+    return applied
+
+
+def _jobs_with_info_files(log_dir: str, all_files: [str]) -> [(str, str)]:
+    # File names are Family.Job.queue.worker.start_time.info and Family.BaseJob.runs.
+    # Reruns' -Orig-n copies aren't targets.
+    jobs = [tuple(f.split(".")[:2]) for f in all_files if f.endswith(".info") and "-Orig-" not in f]
+    for f in all_files:
+        if f.endswith(runs.RUNS_SUFFIX):
+            family_name = f.split(".")[0]
+            jobs.extend((family_name, job_name) for job_name in runs.instances(os.path.join(log_dir, f))
+                        if "-Orig-" not in job_name)
+    return jobs
+
+
+def _info_keys(log_dir: str, all_files: [str]) -> set:
+    return set(_jobs_with_info_files(log_dir, all_files))
+
+
+def _downstream_graph(families: [Family]) -> dict:
+    downstream_of = {}
+    for family in families:
+        for job_name, job in family.jobs_by_name.items():
+            for dependency in job.dependencies:
+                if isinstance(dependency, JobDependency):
+                    downstream_of.setdefault((dependency.family_name, dependency.job_name), set()).add(
+                        (family.name, job_name))
+    return downstream_of
+
+
+def _all_downstream(targets: [(str, str)], downstream_of: dict) -> [(str, str)]:
+    seen = set(targets)
+    result = []
+    to_visit = list(targets)
+    while to_visit:
+        for job in sorted(downstream_of.get(to_visit.pop(), ())):
+            if job not in seen:
+                seen.add(job)
+                result.append(job)
+                to_visit.append(job)
+    return result
+
+
+def _move(path: str, dest_dir: str) -> str:
+    os.makedirs(dest_dir, exist_ok=True)
+    dest = os.path.join(dest_dir, os.path.basename(path))
+    os.replace(path, dest)
+    return dest
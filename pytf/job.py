@@ -9,6 +9,7 @@ import pytf.exceptions as ex
 from .parse_utils import parse_time, lower_true_false, simple_type
 from .dependency import Dependency
 from .job_status import JobStatus
+from .limits import limit_error
 
 
 @define
@@ -32,6 +33,16 @@ class Job:
     no_retry_email: bool | None = field(default=None)
     no_retry_success_email: bool | None = field(default=None)
     comment: str | None = field(default=None)
+    warm_python: bool | None = field(default=None)
+    inputs: list[str] | None = field(default=None)
+    outputs: list[str] | None = field(default=None)
+    max_rss: int | None = field(default=None)
+    cpu_seconds: int | None = field(default=None)
+    open_files: int | None = field(default=None)
+    nice: int | None = field(default=None)
+    ionice: int | None = field(default=None)
+    cpu_affinity: list[int] | None = field(default=None)
+    max_runtime: int | None = field(default=None)
 
     # dynamic fields
     start_time_met_today: bool = field(default=False)
@@ -88,6 +99,16 @@ class Job:
         j.no_retry_email = d.get('no_retry_email')
         j.no_retry_success_email = d.get('no_retry_success_email')
         j.comment = d.get('comment')
+        j.warm_python = d.get('warm_python')
+        j.inputs = d.get('inputs')
+        j.outputs = d.get('outputs')
+        j.max_rss = d.get('max_rss')
+        j.cpu_seconds = d.get('cpu_seconds')
+        j.open_files = d.get('open_files')
+        j.nice = d.get('nice')
+        j.ionice = d.get('ionice')
+        j.cpu_affinity = d.get('cpu_affinity')
+        j.max_runtime = d.get('max_runtime')
 
         return j
 
@@ -103,10 +124,34 @@ class Job:
 
         cls.validate_str_lists(d, job_name)
 
+        cls.validate_int_lists(d, job_name)
+
+        cls.validate_limits(d, job_name)
+
+    @classmethod
+    def validate_int_lists(cls, d, job_name):
+        int_lists = [
+            'cpu_affinity',
+        ]
+        for key in [k for k in int_lists if k in d]:
+            try:
+                for i in d[key]:
+                    if type(i) is not tomlkit.items.Integer:
+                        raise ex.PyTaskforestParseException(f"{ex.MSG_INVALID_TYPE} {job_name}/{key} ({d[key]} :: {i})")
+            except TypeError as e:
+                raise ex.PyTaskforestParseException(f"{ex.MSG_INVALID_TYPE} {job_name}/{key} ({d[key]}) is not iterable") from e
+
+    @classmethod
+    def validate_limits(cls, d, job_name):
+        if (message := limit_error(d)) is not None:
+            raise ex.PyTaskforestParseException(f"{ex.MSG_INVALID_VALUE} {job_name}/{message}")
+
     @classmethod
     def validate_str_lists(cls, d, job_name):
         str_lists = [
             'tokens',
+            'inputs',
+            'outputs',
         ]
         for key in [k for k in str_lists if k in d]:
             try:
@@ -123,6 +168,7 @@ class Job:
             'chained', # TODO: Do we need chained any more?
             'no_retry_email',
             'no_retry_success_email',
+            'warm_python',
         ]
         for key in bools:
             if key in d and type(d[key]) is not bool:
@@ -150,6 +196,12 @@ class Job:
             'every',
             'num_retries',
             'retry_sleep',
+            'max_rss',
+            'cpu_seconds',
+            'open_files',
+            'nice',
+            'ionice',
+            'max_runtime',
         ]
         for key in ints:
             if key in d and type(d[key]) is not tomlkit.items.Integer:
@@ -174,6 +226,16 @@ class Job:
             'no_retry_email',
             'no_retry_success_email',
             'comment',
+            'warm_python',
+            'inputs',
+            'outputs',
+            'max_rss',
+            'cpu_seconds',
+            'open_files',
+            'nice',
+            'ionice',
+            'cpu_affinity',
+            'max_runtime',
         ]
         for key in d:
             if key not in valid_keys:
@@ -0,0 +1,99 @@
+"""
+The record of a job's run: its .info file, or for an instance of a repeating job its line in
+the base job's .runs file (see runs.py).
+
+The worker keeps the record in memory and writes all of it once each time the run changes
+state: started, waiting to retry, finished. A .info file is written to a temp file and renamed
+into place, so the scheduler reads either the previous record or the new one, never part of
+one. Lines in a .runs file are appended with a single write.
+
+info_fsync in the config decides whether records are flushed to disk before the scheduler
+can see them: "never" (the default), "final" (only the finished record) or "always".
+
+Records have schema_version. Records without one were written before it was added.
+"""
+import os
+import pathlib
+
+import tomlkit
+from attrs import define, field
+
+import pytf.runs as runs
+
+SCHEMA_VERSION = 1
+
+FSYNC_POLICIES = ("never", "final", "always")
+
+
+def write(path: str, record, fsync: bool = False):
+    """
+    Replace the .info file at path with record.
+    """
+    text = tomlkit.dumps(record)
+    dir_name, file_name = os.path.split(path)
+    # doesn't end in .info, so nothing reads it
+    tmp_path = os.path.join(dir_name, f".{file_name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(text)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    if fsync:
+        _fsync_dir(dir_name)
+
+
+def read(path: str) -> tomlkit.TOMLDocument:
+    return tomlkit.loads(pathlib.Path(path).read_text())
+
+
+def _fsync_dir(dir_name: str):
+    # makes the rename itself durable
+    fd = os.open(dir_name or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@define
+class JobInfoWriter:
+    path: str
+    job_log_file: str
+    fsync: str = field(default="never")
+    record: dict = field(factory=dict)
+
+    @property
+    def compact(self) -> bool:
+        return self.path.endswith(runs.RUNS_SUFFIX)
+
+    def start(self, record: dict):
+        """
+        Write a new record, replacing the one for the job's previous try.
+        """
+        self.record = {'schema_version': SCHEMA_VERSION, **record}
+        self._save(final=False, log_end=False)
+
+    def update(self, final: bool = False, **changes):
+        """
+        Change the record and write it. A change to None removes the key.
+
+        :param final: This is the run's last record
+        """
+        for key, value in changes.items():
+            if value is None:
+                self.record.pop(key, None)
+            else:
+                self.record[key] = value
+        self._save(final, log_end=True)
+
+    def _save(self, final: bool, log_end: bool):
+        fsync = self.fsync == "always" or (final and self.fsync == "final")
+        if not self.compact:
+            write(self.path, self.record, fsync)
+            return
+        record = dict(self.record)
+        if log_end:
+            # the end of this instance's part of the shared log
+            record['log_end'] = os.path.getsize(self.job_log_file)
+        runs.append(self.path, record, fsync)
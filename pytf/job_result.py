@@ -16,8 +16,14 @@ class JobResult:
     retry_sleep: int = field(default=10)
     worker_name: str | None = field(default=None)
     start_time: str | None = field(default=None)  # this comes in from parsing a string from .info
+    end_time: str | None = field(default=None)  # written by the worker when the job finishes
     error_code: int | None = field(default=None)
     tokens: [str] = field(default=[])
+    warm_python: bool = field(default=False)
+    inputs: list[str] | None = field(default=None)
+    outputs: list[str] | None = field(default=None)
+    limits: dict | None = field(default=None)  # see limits.py
+    base_name: str | None = field(default=None)  # set for the instances of a repeating job
 
     
 def serializer(_, field, value):
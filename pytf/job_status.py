@@ -6,8 +6,12 @@ class JobStatus(Enum):
     READY = "Ready"
     RELEASED = "Released"
     TOKEN_WAIT = "Token Wait"
+    QUEUED = "Queued"
+    QUEUE_WAIT = "Queue Wait"
     RUNNING = "Running"
     SUCCESS = "Success"
+    SKIPPED_UP_TO_DATE = "Up To Date"
     FAILURE = "Failure"
+    TIMED_OUT = "Timed Out"
     HOLD = "On Hold"
     RETRY_WAIT = "Retry Wait"
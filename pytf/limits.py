@@ -0,0 +1,218 @@
+"""
+Per-job resource limits, applied by the worker to the job's process.
+
+Families and jobs can set:
+
+- max_rss: megabytes of resident memory. Linux ignores RLIMIT_RSS, so the worker checks the
+  job's RSS each time it polls it and kills the job if it's over.
+- cpu_seconds: RLIMIT_CPU. The job gets SIGXCPU, and SIGKILL a second later.
+- open_files: RLIMIT_NOFILE
+- nice: added to the job's niceness
+- ionice: best-effort I/O priority, 0 (highest) to 7
+- cpu_affinity: the CPUs the job may run on
+- max_runtime: seconds. The job's process group gets SIGTERM, and SIGKILL TERM_GRACE_SECONDS
+  later if it's still running.
+
+A job's setting overrides its family's, and for max_runtime the family's overrides the config's.
+The rlimits, niceness and affinity are set in the child between fork and exec, so the script
+starts with them. A job that was stopped for going over max_rss, cpu_seconds or max_runtime
+gets limit_exceeded in its .info.
+
+Every job runs in its own process group, so stopping it also stops whatever it started.
+"""
+import os
+import resource
+import signal
+import time
+
+from attrs import define, field
+
+LIMIT_KEYS = ('max_rss', 'cpu_seconds', 'open_files', 'nice', 'ionice', 'cpu_affinity', 'max_runtime')
+
+# set in the child before exec
+_PREEXEC_KEYS = {'cpu_seconds', 'open_files', 'nice', 'ionice', 'cpu_affinity'}
+
+TERM_GRACE_SECONDS = 10
+
+# ioprio_set has no wrapper in os or libc
+_IOPRIO_SET = {'x86_64': 251, 'aarch64': 30, 'ppc64le': 273, 's390x': 282}
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_BE = 2
+_IOPRIO_CLASS_SHIFT = 13
+
+
+def limit_error(d) -> str | None:
+    """
+    Check the limits in a family's or job's parameters, once their types are known to be right.
+
+    :return: "key (value)" for the first one that's out of range, or None
+    """
+    for key in ('max_rss', 'cpu_seconds', 'open_files', 'max_runtime'):
+        if key in d and d[key] < 1:
+            return f"{key} ({d[key]})"
+    if 'nice' in d and not 0 <= d['nice'] <= 19:
+        return f"nice ({d['nice']})"
+    if 'ionice' in d and not 0 <= d['ionice'] <= 7:
+        return f"ionice ({d['ionice']})"
+    if 'cpu_affinity' in d and (not d['cpu_affinity'] or any(cpu < 0 for cpu in d['cpu_affinity'])):
+        return f"cpu_affinity ({d['cpu_affinity']})"
+    return None
+
+
+def for_job(family, job) -> dict:
+    """
+    :return: The limits that apply to job: {key: value} for the keys in LIMIT_KEYS that it, its
+             family or the config sets
+    """
+    limits = {}
+    for key in LIMIT_KEYS:
+        value = getattr(job, key)
+        if value is None:
+            value = getattr(family, key)
+        if value is None and key == 'max_runtime':
+            value = getattr(family.config, key, None)
+        if value is not None:
+            limits[key] = list(value) if key == 'cpu_affinity' else int(value)
+    return limits
+
+
+@define
+class LimitWatcher:
+    limits: dict
+    exceeded: str | None = field(default=None)
+    _cpu_before: float = field(init=False, default=0.0)
+    _started: float = field(init=False, default=0.0)
+    _term_sent: float | None = field(init=False, default=None)
+
+    def __attrs_post_init__(self):
+        self._cpu_before = _children_cpu_seconds()
+        self._started = time.monotonic()
+
+    def preexec(self):
+        """
+        :return: A function for Popen's preexec_fn that applies the limits, or None if there's nothing to apply
+        """
+        limits = self.limits
+        if not set(limits) & _PREEXEC_KEYS:
+            return None
+        # look the syscall up before forking
+        ioprio_set = _ioprio_set() if 'ionice' in limits else None
+
+        def apply():
+            if (cpu_seconds := limits.get('cpu_seconds')) is not None:
+                resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+            if (open_files := limits.get('open_files')) is not None:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (open_files, open_files))
+            if limits.get('nice'):
+                os.nice(limits['nice'])
+            if ioprio_set is not None:
+                ioprio_set(_IOPRIO_WHO_PROCESS, 0, (_IOPRIO_CLASS_BE << _IOPRIO_CLASS_SHIFT) | limits['ionice'])
+            if limits.get('cpu_affinity'):
+                os.sched_setaffinity(0, limits['cpu_affinity'])
+
+        return apply
+
+    def check(self, process):
+        """
+        Called while the job runs. Stops it if it has run longer than max_runtime or is using
+        more than max_rss.
+        """
+        now = time.monotonic()
+        if self._term_sent is not None:
+            if now - self._term_sent >= TERM_GRACE_SECONDS:
+                _signal_group(process, signal.SIGKILL)
+            return
+        if self.exceeded:
+            return
+        if (max_runtime := self.limits.get('max_runtime')) is not None and now - self._started > max_runtime:
+            self.exceeded = 'max_runtime'
+            _signal_group(process, signal.SIGTERM)
+            self._term_sent = now
+        elif (max_rss := self.limits.get('max_rss')) is not None:
+            if (rss := _group_rss_megabytes(process.pid)) is not None and rss > max_rss:
+                # no grace period: it's using memory the rest of the host needs
+                self.exceeded = 'max_rss'
+                _signal_group(process, signal.SIGKILL)
+
+    def finished(self, process, err_code: int) -> str | None:
+        """
+        :return: The limit the job was stopped for going over, if any
+        """
+        if self._term_sent is not None:
+            # the script exited on SIGTERM, but what it started may not have
+            _signal_group(process, signal.SIGKILL)
+        if self.exceeded is None and (cpu_seconds := self.limits.get('cpu_seconds')) is not None:
+            used = _children_cpu_seconds() - self._cpu_before
+            killed_by = _signal_of(err_code)
+            if killed_by == signal.SIGXCPU or (killed_by == signal.SIGKILL and used >= cpu_seconds):
+                self.exceeded = 'cpu_seconds'
+        return self.exceeded
+
+
+def _signal_group(process, signal_number):
+    try:
+        os.killpg(process.pid, signal_number)
+    except ProcessLookupError:
+        pass
+
+
+def _signal_of(err_code: int) -> int | None:
+    # -n if the script was killed by signal n, 128 + n if the shell running it reported that
+    if err_code < 0:
+        return -err_code
+    if err_code > 128:
+        return err_code - 128
+    return None
+
+
+def _children_cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _group_rss_megabytes(pgid: int) -> float | None:
+    """
+    The RSS of every process in the job's process group. The script's process is often just the
+    shell running the command, with the real work in a child.
+    """
+    total = None
+    for pid in _group_pids(pgid):
+        if (rss := _rss_megabytes(pid)) is not None:
+            total = (total or 0) + rss
+    return total
+
+
+def _group_pids(pgid: int) -> [int]:
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # the command name, in parentheses, can have spaces; pgrp is the third field after it
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (FileNotFoundError, ProcessLookupError, IndexError):
+            continue
+        if int(fields[2]) == pgid:
+            pids.append(int(entry))
+    return pids
+
+
+def _rss_megabytes(pid: int) -> float | None:
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (FileNotFoundError, ProcessLookupError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def _ioprio_set():
+    import ctypes
+    import platform
+
+    number = _IOPRIO_SET.get(platform.machine())
+    if number is None:
+        return None
+    syscall = ctypes.CDLL(None, use_errno=True).syscall
+    return lambda which, who, ioprio: syscall(number, which, who, ioprio)
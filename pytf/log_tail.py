@@ -0,0 +1,237 @@
+import array
+import collections
+import mmap
+import os
+import threading
+import time
+
+import tomlkit
+import tomlkit.exceptions
+
+import pytf.exceptions as ex
+import pytf.runs as runs
+from .archive import validate_day
+
+# Keep the offset of every CHECKPOINT_EVERY-th line. Finding line n means jumping to the
+# checkpoint before it and scanning at most CHECKPOINT_EVERY lines.
+CHECKPOINT_EVERY = 1024
+SCAN_CHUNK = 64 * 1024
+MAX_INDEXES = 32
+MAX_LINES = 10000
+MAX_TAIL_BYTES = 1024 * 1024
+
+_indexes: collections.OrderedDict = collections.OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def job_log_path(log_dir: str, yyyymmdd: str, family_name: str, job_name: str) -> str:
+    """
+    The run log pytf_worker.run writes for a job on a day that hasn't been archived yet.
+    """
+    validate_day(yyyymmdd)
+    for name in (family_name, job_name):
+        if not name or name.startswith(".") or "/" in name or os.sep in name:
+            raise ex.PyTaskforestParseException(f"{ex.MSG_LOG_INVALID_NAME} {name}")
+    return os.path.join(log_dir, yyyymmdd, f"{family_name}.{job_name}.log")
+
+
+def job_is_running(log_path: str) -> bool:
+    """
+    A job is running while one of its .info files has no error_code (the worker writes the
+    error_code when the last try ends). The log shared by a repeating job's instances is
+    live while any of them is running.
+    """
+    day_dir = os.path.dirname(log_path)
+    prefix = os.path.basename(log_path)[:-len("log")]
+    if any(record.get('error_code') is None
+           for record in runs.instances(os.path.join(day_dir, f"{prefix[:-1]}{runs.RUNS_SUFFIX}")).values()):
+        return True
+    try:
+        file_names = os.listdir(day_dir)
+    except FileNotFoundError:
+        return False
+    for file_name in file_names:
+        if file_name.startswith(prefix) and file_name.endswith(".info") and "-Orig-" not in file_name:
+            try:
+                with open(os.path.join(day_dir, file_name)) as f:
+                    if 'error_code' not in tomlkit.loads(f.read()):
+                        return True
+            except (OSError, tomlkit.exceptions.ParseError):
+                # the worker is rewriting it
+                return True
+    return False
+
+
+class LineIndex:
+    """
+    A sparse newline index over a log file that's only ever appended to.
+    It's built the first time it's needed and only the new bytes are scanned after that.
+    If the file is replaced or truncated the index starts over.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._identity = None
+        self._reset()
+
+    def _reset(self):
+        # checkpoints[i] is the offset of line i * CHECKPOINT_EVERY
+        self.checkpoints = array.array('q', [0])
+        self.num_lines = 0       # newlines seen so far
+        self.indexed_to = 0      # offset just past the last newline seen
+
+    def refresh(self) -> int:
+        """
+        Index whatever was appended since the last call.
+
+        :return: the file's size
+        """
+        st = os.stat(self.path)
+        identity = (st.st_dev, st.st_ino)
+        if identity != self._identity or st.st_size < self.indexed_to:
+            self._identity = identity
+            self._reset()
+        if st.st_size > self.indexed_to:
+            with open(self.path, "rb") as f, mmap.mmap(f.fileno(), st.st_size, access=mmap.ACCESS_READ) as mm:
+                self._scan(mm, st.st_size)
+        return st.st_size
+
+    def _scan(self, mm: mmap.mmap, size: int):
+        pos = self.indexed_to
+        while pos < size:
+            end = min(pos + SCAN_CHUNK, size)
+            newlines = mm[pos:end].count(b"\n")
+            next_checkpoint = len(self.checkpoints) * CHECKPOINT_EVERY
+            if self.num_lines + newlines < next_checkpoint:
+                # no checkpoint in this chunk, so there's no need to find each newline
+                self.num_lines += newlines
+                if newlines:
+                    self.indexed_to = mm.rfind(b"\n", pos, end) + 1
+            else:
+                line_pos = pos
+                while (nl := mm.find(b"\n", line_pos, end)) != -1:
+                    line_pos = nl + 1
+                    self.num_lines += 1
+                    if self.num_lines % CHECKPOINT_EVERY == 0:
+                        self.checkpoints.append(line_pos)
+                self.indexed_to = line_pos
+            pos = end
+
+    def read_lines(self, start: int, count: int) -> dict:
+        """
+        Lines [start, start + count), counting from 0. A last line without a newline is
+        included, since it may be the job's most recent output.
+
+        :return: {"start", "lines", "total_lines", "offset"}, where offset is the byte offset
+                 just past the last line returned, for resuming with tail()
+        """
+        size = self.refresh()
+        lines = []
+        offset = self._line_offset(start) if start <= self.num_lines else size
+        if size and count > 0 and offset < size:
+            with open(self.path, "rb") as f, mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                while len(lines) < count and offset < size:
+                    nl = mm.find(b"\n", offset, size)
+                    line_end = size if nl == -1 else nl + 1
+                    lines.append(mm[offset:line_end].rstrip(b"\n").decode(errors='replace'))
+                    offset = line_end
+        total = self.num_lines + (1 if size > self.indexed_to else 0)
+        return {"start": start, "lines": lines, "total_lines": total, "offset": offset}
+
+    def _line_offset(self, line: int) -> int:
+        checkpoint = min(line // CHECKPOINT_EVERY, len(self.checkpoints) - 1)
+        offset = self.checkpoints[checkpoint]
+        to_skip = line - checkpoint * CHECKPOINT_EVERY
+        if not to_skip:
+            return offset
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), self.indexed_to, access=mmap.ACCESS_READ) as mm:
+            for _ in range(to_skip):
+                offset = mm.find(b"\n", offset) + 1
+        return offset
+
+
+def line_index(path: str) -> LineIndex:
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = _indexes[path] = LineIndex(path)
+            while len(_indexes) > MAX_INDEXES:
+                _indexes.popitem(last=False)
+        else:
+            _indexes.move_to_end(path)
+    return index
+
+
+def read_lines(path: str, start: int, count: int) -> dict:
+    index = line_index(path)
+    with _indexes_lock:
+        return index.read_lines(max(start, 0), min(count, MAX_LINES))
+
+
+def read_from(path: str, offset: int, max_bytes: int = MAX_TAIL_BYTES) -> tuple[bytes, int]:
+    """
+    Whatever's been written since offset, up to max_bytes. If the file was truncated (the
+    offset is past its end) reading starts over from the beginning. Unless it's at the end
+    of the file the data is cut at the last newline, so lines and UTF-8 sequences aren't split.
+
+    :return: (data, offset to pass next time)
+    """
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return b"", offset
+    if offset > size:
+        offset = 0
+    if offset == size:
+        return b"", offset
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(min(max_bytes, size - offset))
+    if offset + len(data) < size and (nl := data.rfind(b"\n")) != -1:
+        data = data[:nl + 1]
+    return data, offset + len(data)
+
+
+def tail(path: str, offset: int, timeout: float, poll_interval: float = 0.5, is_running=job_is_running) -> dict:
+    """
+    Long-poll: wait up to timeout seconds for the log to grow past offset. Returns straight
+    away if there's new output, or if the job isn't running and there never will be.
+
+    :return: {"offset", "data", "running"}
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        # check first: if the job writes its last output and exits in between, that output is
+        # still read, and a client that stops once running is False doesn't miss it
+        running = is_running(path)
+        data, new_offset = read_from(path, offset)
+        if data or not running or time.monotonic() >= deadline:
+            return {"offset": new_offset, "data": data.decode(errors='replace'), "running": running}
+        time.sleep(poll_interval)
+
+
+def sse_events(path: str, offset: int, max_duration: float, poll_interval: float = 0.5,
+               heartbeat: float = 15.0, is_running=job_is_running):
+    """
+    Server-sent events for `tail -f`. Each event's id is the byte offset after its data, so a
+    client that reconnects with Last-Event-ID picks up where it left off. An `end` event is
+    sent once the job has finished and all its output has been sent.
+    """
+    deadline = time.monotonic() + max_duration
+    last_sent = time.monotonic()
+    while time.monotonic() < deadline:
+        running = is_running(path)
+        data, offset = read_from(path, offset)
+        if data:
+            lines = data.decode(errors='replace').split("\n")
+            if lines[-1] == "":
+                lines.pop()
+            yield f"id: {offset}\n" + "".join(f"data: {line}\n" for line in lines) + "\n"
+            last_sent = time.monotonic()
+            continue
+        if not running:
+            yield f"id: {offset}\nevent: end\ndata: \n\n"
+            return
+        if time.monotonic() - last_sent >= heartbeat:
+            yield ": keepalive\n\n"
+            last_sent = time.monotonic()
+        time.sleep(poll_interval)
@@ -1,9 +1,9 @@
 import os
 
-import pathlib
-import tomlkit
-
 import pytf.dirs as dirs
+import pytf.job_info as job_info
+import pytf.runs as runs
+import pytf.tick_stats as tick_stats
 from .job_result import JobResult
 from .job_status import JobStatus
 
@@ -28,47 +28,123 @@ def get_released_jobs(log_dir: str):
     return released_jobs
 
 
+def queued_file(log_dir: str, family_name: str, job_name: str) -> str:
+    return os.path.join(log_dir, f"{family_name}.{job_name}.queued")
+
+
+def mark_queued(log_dir: str, family_name: str, job_name: str, queue_name: str, now: float):
+    """
+    Record that the scheduler is sending the job to the broker. Until the worker writes the
+    job's .info file and removes this, it's the only sign that the job is waiting in its queue.
+
+    :param now: epoch seconds, so a marker whose job never started can be found (see remove_stale_queued)
+    """
+    with open(queued_file(log_dir, family_name, job_name), "w") as f:
+        f.write(f"{queue_name}\n{now}\n")
+
+
+def remove_stale_queued(log_dir: str, stale_before: float) -> [(str, str)]:
+    """
+    Remove the markers of jobs sent before stale_before that no worker has started. The broker
+    lost them, or the worker died before starting them; without this they'd stay Queued and
+    hold a slot of their queue's max_outstanding all day.
+
+    :return: (family_name, job_name) of each marker removed
+    """
+    removed = []
+    for file_name in os.listdir(log_dir):
+        if not file_name.endswith(".queued"):
+            continue
+        path = os.path.join(log_dir, file_name)
+        try:
+            with open(path) as f:
+                lines = f.read().split()
+            # markers written before the time was added to them have only the queue name
+            sent = float(lines[1]) if len(lines) > 1 else os.path.getmtime(path)
+        except FileNotFoundError:
+            # started while we were looking
+            continue
+        if sent < stale_before:
+            family_name, job_name, _ = file_name.split(".")
+            remove_queued(log_dir, family_name, job_name)
+            removed.append((family_name, job_name))
+    return removed
+
+
+def remove_queued(log_dir: str, family_name: str, job_name: str):
+    try:
+        os.remove(queued_file(log_dir, family_name, job_name))
+    except FileNotFoundError:
+        pass
+
+
+def get_queued_jobs(log_dir: str):
+    queued_jobs = {}
+    queued_files = [(fn.split(".")) for fn in os.listdir(log_dir) if fn.endswith(".queued")]
+    for f, j, _ in queued_files:
+        if queued_jobs.get(f) is None:
+            queued_jobs[f] = {}
+        queued_jobs[f][j] = True
+    return queued_jobs
+
+
 def get_logged_job_results(log_dir: str) -> ([JobResult], dict[str, object]):
     """
     File names are FamilyName.JobName.queue.worker_name.start_time_local.info
     File names are FamilyName.JobName.queue.worker_name.start_time_local.log
+    The instances of a repeating job are in FamilyName.BaseJobName.runs (see runs.py)
 
     :param log_dir:
     :return:
     """
     files = dirs.list_of_files_in_dir(log_dir)
     prefixes = [file_name[:-5] for file_name in files if file_name.endswith('.info')]
+    runs_files = [file_name for file_name in files if file_name.endswith(runs.RUNS_SUFFIX)]
     job_array = []
     job_dict = {}
+    tick_stats.count(tick_stats.COUNTER_INFO_FILES_READ, len(prefixes) + len(runs_files))
 
-    for prefix in prefixes:
-        job_info_str = pathlib.Path(os.path.join(log_dir, f"{prefix}.info")).read_text()
-        print(job_info_str)
-        job_info = tomlkit.loads(job_info_str)
-        status = JobStatus.RUNNING
-        error_code = job_info.get('error_code')
-
-        if error_code is not None:
-            status = JobStatus.FAILURE if error_code else JobStatus.SUCCESS
-            error_code = job_info['error_code']
-
-        if job_info.get('retry_wait_until'):
-            status = JobStatus.RETRY_WAIT
-
-        job_result = JobResult(family_name=job_info['family_name'],
-                               job_name=job_info['job_name'],
-                               status=status,
-                               tz=job_info['tz'],  # this will always be config.primary_tz
-                               queue_name=job_info['queue_name'],
-                               num_retries=job_info['num_retries'],
-                               retry_sleep=job_info['retry_sleep'],
-                               worker_name=job_info['worker_name'],
-                               error_code=error_code,
-                               start_time=job_info["start_time"],
-                               )
+    def add(job_result):
         if not job_dict.get(job_result.family_name):
             job_dict[job_result.family_name] = {}
         job_dict[job_result.family_name][job_result.job_name] = job_result
         job_array.append(job_result)
 
+    for prefix in prefixes:
+        add(job_result_from_info(job_info.read(os.path.join(log_dir, f"{prefix}.info"))))
+
+    for file_name in runs_files:
+        for record in runs.instances(os.path.join(log_dir, file_name)).values():
+            add(job_result_from_info(record))
+
     return job_array, job_dict
+
+
+def job_result_from_info(job_info) -> JobResult:
+    status = JobStatus.RUNNING
+    error_code = job_info.get('error_code')
+
+    if error_code is not None:
+        status = JobStatus.FAILURE if error_code else JobStatus.SUCCESS
+        error_code = job_info['error_code']
+        if error_code == 0 and job_info.get('up_to_date'):
+            # skipped without running; see fingerprint.py
+            status = JobStatus.SKIPPED_UP_TO_DATE
+        elif error_code and job_info.get('limit_exceeded') == 'max_runtime':
+            status = JobStatus.TIMED_OUT
+
+    if job_info.get('retry_wait_until'):
+        status = JobStatus.RETRY_WAIT
+
+    return JobResult(family_name=job_info['family_name'],
+                     job_name=job_info['job_name'],
+                     status=status,
+                     tz=job_info['tz'],  # this will always be config.primary_tz
+                     queue_name=job_info['queue_name'],
+                     num_retries=job_info['num_retries'],
+                     retry_sleep=job_info['retry_sleep'],
+                     worker_name=job_info['worker_name'],
+                     error_code=error_code,
+                     start_time=job_info["start_time"],
+                     end_time=job_info.get("end_time"),
+                     )
@@ -6,23 +6,22 @@ import traceback
 import pytz
 
 from .config import Config
+from .config_reload import ConfigWatcher
 from .mockdatetime import MockDateTime
-from .runner import prepare_required_dirs
-from .pytf_worker import run_task
+from .runner import prepare_required_dirs, setup_logging_and_tokens
 from .status import status_and_families_and_token_doc
-from .pytftoken import PyTfToken
-from .pytf_logging import setup_logging
 import pytf.dirs as dirs
+import pytf.events as events
 import pytf.exceptions as ex
-
-
-def setup_logging_and_tokens(config):
-    setup_logging(config.log_dir)
-    _ = logging.getLogger("pytf_logger")
-    # before doing anything, make sure token file is up-to-date
-    # This is important because a rerun may move an info file and cause a token file to point to
-    # a non-existent file
-    PyTfToken.update_token_usage(config)
+import pytf.history as history
+import pytf.instructions as instructions
+import pytf.logs as logs
+import pytf.metrics as metrics
+import pytf.notify as notify
+import pytf.runs as runs
+import pytf.sharding as sharding
+import pytf.tick_stats as tick_stats
+import pytf.webhooks as webhooks
 
 
 def main(config: Config):
@@ -37,7 +36,13 @@ def main(config: Config):
                                                                            minute=config.end_time_min))
     logger.info(f"Running until {end_time}")
     logger.info(f"{config.run_local=}")
-    run_main_loop_until_end(config, end_time, main_function)
+    today = now.strftime("%Y%m%d")
+    history.index_missing_days(config, before=today)
+    watcher = ConfigWatcher(config, config.config_file)
+    run_main_loop_until_end(config, end_time, main_function, before_tick=watcher.check)
+    history.index_day(config, today)
+    webhooks.stop()
+    notify.stop()
 
 
 def main_with_exception_for_testing(config: Config):
@@ -63,18 +68,29 @@ def main_with_exception_for_testing(config: Config):
     run_main_loop_until_end(config, end_time, main_function)
 
 
-def run_main_loop_until_end(config: Config, end_time: datetime, function_to_run):
+def run_main_loop_until_end(config: Config, end_time: datetime, function_to_run, before_tick=None):
+    """
+    :param before_tick: Called at the start of every tick, before anything else, e.g. to reload the config
+    """
     logger = logging.getLogger('pytf_logger')
     sleep_time = 10
     while True:
         logger.info("Entering main PyTF Loop")
+        tick_stats.start_tick()
+        if before_tick is not None:
+            before_tick()
         # primary_tz is used for the start and end time of the main loop
         now: datetime.datetime = MockDateTime.now(config.primary_tz)
         todays_family_dir = dirs.dated_dir(os.path.join(config.family_dir, "{YYYY}{MM}{DD}"), now)
-        dirs.copy_files_from_dir_to_dir(config.family_dir, todays_family_dir)
+        with tick_stats.phase(tick_stats.PHASE_FAMILY_COPY):
+            dirs.copy_files_from_dir_to_dir(config.family_dir, todays_family_dir)
 
         function_to_run(config)  # Assume this takes less than a minute to run
 
+        stats = tick_stats.end_tick(sleep_time)
+        tick_stats.save(config.log_dir, config.shard)
+        metrics.observe_scheduler_tick(config.log_dir, stats, config.shard)
+
         if config.once_only:
             logger.info("Once_only is set. Exiting loop now.")
             break
@@ -89,50 +105,91 @@ def run_main_loop_until_end(config: Config, end_time: datetime, function_to_run)
             break
 
 
-def main_function(config: Config):
-    logger = logging.getLogger('pytf_logger')
-    status, families, new_token_doc = status_and_families_and_token_doc(config)
+def main_function(config: Config, executor=None):
+    """
+    Run a single scheduler tick.
+
+    :param config:
+    :param executor: Anything with a Celery-style apply_async(args, queue). Defaults to the Celery task.
+    :return: The status computed for this tick
+    """
+    instructions.apply_pending(config)
+    status, families, new_token_doc = status_and_families_and_token_doc(config, save_tokens=True)
+    metrics.observe_scheduler_status(config, status, new_token_doc)
+    history.record_completed(config, status['status']['flat_list'])
+    job_events = events.detect(config, status['status']['flat_list'])
+    webhooks.submit(config, job_events)
+    notify.notify(config, families, job_events)
     ready_jobs = [j for j in status['status']['flat_list'] if j['status'] in ['Ready', 'Released']]
 
     if not ready_jobs:
-        return
+        return status
+
+    with tick_stats.phase(tick_stats.PHASE_DISPATCH):
+        _dispatch_jobs(config, ready_jobs, executor)
 
-    PyTfToken.save_token_document(config, new_token_doc)
+    return status
 
+
+def _dispatch_jobs(config: Config, ready_jobs, executor):
+    logger = logging.getLogger('pytf_logger')
     for job in ready_jobs:
-        job_log_file = os.path.join(config.todays_log_dir, f"{job['family_name']}.{job['job_name']}.log")
-        run_logger = logging.getLogger('run_logger')
-        run_logger.setLevel(logging.INFO)
-        handler = logging.FileHandler(filename=job_log_file)
-        handler.setFormatter(logging.Formatter("%(asctime)s -> %(message)s", datefmt="%Y-%m-%dT%H:%M:%S%z"))
-        handler.setLevel(logging.DEBUG)
-        for old_handler in run_logger.handlers:
-            run_logger.removeHandler(old_handler)
-        run_logger.addHandler(handler)
-        run_logger.propagate = False
-
-        now = MockDateTime.now(config.primary_tz)
-        start_small = now.strftime("%Y%m%d%H%M%S")
-        info_path = os.path.join(config.todays_log_dir,
-                                 f"{job['family_name']}.{job['job_name']}.{job['queue_name']}.x.{start_small}.info")
+        if config.shard is not None and not sharding.claim(config, job['family_name'], job['job_name']):
+            continue
+        if job.get('base_name'):
+            # the instances of a repeating job share a .runs file and a log
+            job_log_file = os.path.join(config.todays_log_dir, f"{job['family_name']}.{job['base_name']}.log")
+            info_path = runs.runs_path(config.todays_log_dir, job['family_name'], job['base_name'])
+        else:
+            job_log_file = os.path.join(config.todays_log_dir, f"{job['family_name']}.{job['job_name']}.log")
+            now = MockDateTime.now(config.primary_tz)
+            start_small = now.strftime("%Y%m%d%H%M%S")
+            info_path = os.path.join(config.todays_log_dir,
+                                     f"{job['family_name']}.{job['job_name']}.{job['queue_name']}.x.{start_small}.info")
+        # The worker writes the job's log. Just make sure it exists; opening a
+        # FileHandler per job here leaked a descriptor for every dispatch.
+        open(job_log_file, "a").close()
 
         logger.info(f"Queuing job {job['family_name']}::{job['job_name']} on queue: {job['queue_name']}")
 
-        func = run_task.apply if config.run_local else run_task.apply_async
+        if executor is not None:
+            func = executor.apply_async
+        else:
+            # Celery is only imported by a scheduler that dispatches, not by every CLI command
+            from .pytf_worker import run_task
+            func = run_task.apply if config.run_local else run_task.apply_async
         # func = _local_run if config.run_local else run_task.apply_async
 
-        func(args=[config.todays_log_dir,
-                   config.job_dir,
-                   config.primary_tz,
-                   job['family_name'],
-                   job['job_name'],
-                   job['tz'],
-                   job['queue_name'],
-                   job['num_retries'],
-                   job['retry_sleep'],
-                   job_log_file,
-                   info_path],
-             queue=job['queue_name'])
+        # Until the worker writes the .info file, this keeps the job from being sent again
+        # and counts it against its queue's max_outstanding
+        logs.mark_queued(config.todays_log_dir, job['family_name'], job['job_name'], job['queue_name'],
+                         MockDateTime.now(config.primary_tz).timestamp())
+        try:
+            func(args=[config.todays_log_dir,
+                       config.job_dir,
+                       config.primary_tz,
+                       job['family_name'],
+                       job['job_name'],
+                       job['tz'],
+                       job['queue_name'],
+                       job['num_retries'],
+                       job['retry_sleep'],
+                       job_log_file,
+                       info_path,
+                       job.get('warm_python', False),
+                       job.get('inputs'),
+                       job.get('outputs'),
+                       job.get('limits'),
+                       config.info_fsync],
+                 queue=job['queue_name'])
+        except Exception:
+            logs.remove_queued(config.todays_log_dir, job['family_name'], job['job_name'])
+            if config.shard is not None:
+                # or no shard could send it again
+                sharding.release_claim(config.todays_log_dir, job['family_name'], job['job_name'])
+            raise
+        tick_stats.count(tick_stats.COUNTER_JOBS_DISPATCHED)
+        metrics.observe_scheduler_dispatch(job)
 
 
 # def _local_run(args, queue):
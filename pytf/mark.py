@@ -1,27 +1,31 @@
 import os
 
-import pathlib
-import tomlkit
-
 from .config import Config
 from .mockdatetime import MockDateTime
 import pytf.exceptions as ex
+import pytf.job_info as job_info
+import pytf.runs as runs
 
 
-def mark(config:Config, family_name:str, job_name:str, error_code:int):
-    all_files = os.listdir(config.todays_log_dir)
+def mark(config:Config, family_name:str, job_name:str, error_code:int, all_files=None):
+    if all_files is None:
+        all_files = os.listdir(config.todays_log_dir)
     info_files = [f for f in all_files
                   if f.startswith(f"{family_name}.{job_name}") and
                   f.endswith(".info")]
+    now_str = MockDateTime.now(tz=config.primary_tz).strftime("%Y%m%d_%H%M%S")
+    if not info_files:
+        runs_file, record = runs.find(config.todays_log_dir, family_name, job_name)
+        if record is not None:
+            # an instance of a repeating job
+            runs.mark(runs_file, job_name, error_code, now_str)
+            return
     if len(info_files) != 1:
         raise ex.PyTaskforestParseException(f"{ex.MSG_CANT_FIND_SINGLE_JOB_INFO_FILE} {family_name}:{job_name}")
 
     info_path = os.path.join(config.todays_log_dir, info_files[0])
-    job_toml_str = pathlib.Path(info_path).read_text()
-    job_dict = tomlkit.loads(job_toml_str)
+    job_dict = job_info.read(info_path)
     old_error_code = job_dict['error_code']
     job_dict['error_code'] = error_code
-    now_str = MockDateTime.now(tz=config.primary_tz).strftime("%Y%m%d_%H%M%S")
     job_dict[f"original_error_code_{now_str}"] = old_error_code
-    with open(info_path, "w") as f:
-        f.write(tomlkit.dumps(job_dict))
+    job_info.write(info_path, job_dict)
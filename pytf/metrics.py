@@ -0,0 +1,339 @@
+import fcntl
+import json
+import logging
+import os
+import socket
+import time
+
+from attrs import define, field
+
+METRICS_SUBDIR = "metrics"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+TICK_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LATENCY_BUCKETS = (1.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+RUN_BUCKETS = (1.0, 10.0, 60.0, 300.0, 900.0, 3600.0, 4 * 3600.0, 12 * 3600.0)
+
+
+@define
+class Metric:
+    """
+    One metric family. Counter and gauge samples are numbers; histogram samples are
+    [per-bucket counts..., sum, count] with non-cumulative bucket counts, so that
+    snapshots from several processes can be merged by adding.
+    """
+    name: str
+    help: str
+    kind: str
+    buckets: tuple = field(default=())
+    samples: dict = field(factory=dict)
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        self.samples[key] = self.samples.get(key, 0) + amount
+
+    def set(self, value: float, **labels):
+        self.samples[_label_key(labels)] = value
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        sample = self.samples.setdefault(key, [0] * (len(self.buckets) + 3))
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        sample[index] += 1
+        sample[-2] += value
+        sample[-1] += 1
+
+    def clear(self):
+        self.samples = {}
+
+    def merge(self, samples: dict):
+        for key, value in samples.items():
+            if self.kind == HISTOGRAM:
+                current = self.samples.setdefault(key, [0] * len(value))
+                self.samples[key] = [a + b for a, b in zip(current, value)]
+            elif self.kind == GAUGE:
+                # merged oldest snapshot first, so the newest value wins
+                self.samples[key] = value
+            else:
+                self.samples[key] = self.samples.get(key, 0) + value
+
+    def render(self) -> [str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key in sorted(self.samples):
+            value = self.samples[key]
+            if self.kind != HISTOGRAM:
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(list(self.buckets) + ["+Inf"], value):
+                cumulative += bucket_count
+                le = bound if bound == "+Inf" else _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(value[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {value[-1]}")
+        return lines
+
+
+@define
+class Registry:
+    metrics: dict = field(factory=dict)
+
+    def counter(self, name: str, help_text: str) -> Metric:
+        return self._get_or_create(name, help_text, COUNTER, ())
+
+    def gauge(self, name: str, help_text: str) -> Metric:
+        return self._get_or_create(name, help_text, GAUGE, ())
+
+    def histogram(self, name: str, help_text: str, buckets: tuple) -> Metric:
+        return self._get_or_create(name, help_text, HISTOGRAM, tuple(buckets))
+
+    def _get_or_create(self, name, help_text, kind, buckets) -> Metric:
+        if (metric := self.metrics.get(name)) is None:
+            metric = Metric(name=name, help=help_text, kind=kind, buckets=buckets)
+            self.metrics[name] = metric
+        return metric
+
+    def save(self, metrics_dir: str, process_name: str):
+        """
+        Each process owns one snapshot file, replaced atomically. Nothing is shared
+        between processes, so Celery prefork children never contend.
+        """
+        os.makedirs(metrics_dir, exist_ok=True)
+        doc = {name: {"help": m.help,
+                      "kind": m.kind,
+                      "buckets": list(m.buckets),
+                      "samples": [[list(map(list, key)), value] for key, value in m.samples.items()]}
+               for name, m in self.metrics.items()}
+        path = os.path.join(metrics_dir, f"{process_name}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(doc, f)
+        os.replace(tmp_path, path)
+
+    def merge_snapshot(self, doc: dict):
+        for name, m in doc.items():
+            metric = self._get_or_create(name, m['help'], m['kind'], tuple(m['buckets']))
+            metric.merge({tuple(map(tuple, key)): value for key, value in m['samples']})
+
+    def render(self) -> str:
+        lines = []
+        for name in sorted(self.metrics):
+            lines.extend(self.metrics[name].render())
+        return "\n".join(lines) + "\n"
+
+
+def collect(metrics_dir: str) -> Registry:
+    """
+    Merge every process's snapshot. Counters and histograms are summed. A gauge is a reading
+    of something, not a share of it, so where two snapshots have the same gauge and labels,
+    the newer snapshot's value is taken.
+    """
+    merged = Registry()
+    if not os.path.isdir(metrics_dir):
+        return merged
+    docs = []
+    for file_name in os.listdir(metrics_dir):
+        if not file_name.endswith(".json"):
+            continue
+        path = os.path.join(metrics_dir, file_name)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            with open(path) as f:
+                docs.append((mtime, file_name, json.load(f)))
+        except (OSError, json.JSONDecodeError):
+            continue
+    for _, _, doc in sorted(docs, key=lambda entry: entry[:2]):
+        merged.merge_snapshot(doc)
+    return merged
+
+
+def metrics_dir_for(log_dir: str) -> str:
+    return os.path.join(log_dir, METRICS_SUBDIR)
+
+
+def serve(metrics_dir: str, port: int, host: str = "0.0.0.0"):
+    server = make_server(metrics_dir, port, host)
+    logging.getLogger('pytf_logger').info(f"Serving metrics on {host}:{server.server_address[1]}/metrics")
+    server.serve_forever()
+
+
+def make_server(metrics_dir: str, port: int, host: str):
+    # only the metrics server needs http.server; every scheduler tick imports this module
+    import http.server
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = collect(metrics_dir).render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.getLogger('pytf_logger').debug(format % args)
+
+    return http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+
+
+# Scheduler side
+
+scheduler_registry = Registry()
+_ready_since: dict[(str, str), float] = {}
+
+
+def observe_scheduler_status(config, status: dict, token_doc):
+    # each shard counts only its own families; the tokens are shared, so they aren't labeled
+    shard = {} if config.shard is None else {'shard': config.shard}
+    jobs = scheduler_registry.gauge("pytf_jobs", "Jobs in today's families by status")
+    running = scheduler_registry.gauge("pytf_queue_running", "Running jobs per queue")
+    queued = scheduler_registry.gauge("pytf_queue_queued", "Jobs sent to each queue that no worker has started")
+    jobs.clear()
+    running.clear()
+    queued.clear()
+
+    now = time.time()
+    ready_now = set()
+    for job in status['status']['flat_list']:
+        jobs.inc(status=job['status'], **shard)
+        if job['status'] == 'Running':
+            running.inc(queue=job['queue_name'], **shard)
+        elif job['status'] == 'Queued':
+            queued.inc(queue=job['queue_name'], **shard)
+        if job['status'] in ('Ready', 'Released', 'Token Wait', 'Queue Wait'):
+            key = (job['family_name'], job['job_name'])
+            ready_now.add(key)
+            _ready_since.setdefault(key, now)
+    for key in set(_ready_since) - ready_now:
+        del _ready_since[key]
+
+    in_use = scheduler_registry.gauge("pytf_token_in_use", "Token instances held")
+    capacity = scheduler_registry.gauge("pytf_token_capacity", "Token instances configured")
+    utilization = scheduler_registry.gauge("pytf_token_utilization", "Fraction of token instances held")
+    held = {}
+    for token in token_doc.get('token', []) if token_doc is not None else []:
+        held[token['token_name']] = held.get(token['token_name'], 0) + 1
+    for tok in config.tokens:
+        in_use.set(held.get(tok.name, 0), token=tok.name)
+        capacity.set(tok.num_instances, token=tok.name)
+        utilization.set(held.get(tok.name, 0) / tok.num_instances if tok.num_instances else 0, token=tok.name)
+
+
+def observe_token_wait(token_name: str, seconds: float):
+    scheduler_registry.histogram("pytf_token_wait_seconds",
+                                 "Time from a job first being ready to being granted a token",
+                                 LATENCY_BUCKETS).observe(seconds, token=token_name)
+
+
+def observe_scheduler_dispatch(job: dict):
+    scheduler_registry.counter("pytf_queue_dispatched_total", "Jobs dispatched per queue").inc(queue=job['queue_name'])
+    ready_since = _ready_since.pop((job['family_name'], job['job_name']), time.time())
+    scheduler_registry.histogram("pytf_ready_to_dispatch_seconds",
+                                 "Time from a job first being ready to being dispatched",
+                                 LATENCY_BUCKETS).observe(time.time() - ready_since)
+
+
+def observe_scheduler_tick(log_dir: str, stats, shard: str | None = None):
+    if stats is not None:
+        scheduler_registry.histogram("pytf_tick_duration_seconds",
+                                     "Main loop tick duration",
+                                     TICK_BUCKETS).observe(stats.duration)
+    # schedulers sharing a log dir each save their own snapshot
+    scheduler_registry.save(metrics_dir_for(log_dir), "scheduler" if shard is None else f"scheduler.{shard}")
+
+
+# Worker side
+
+worker_registry = Registry()
+
+
+def observe_worker_run(log_dir: str, queue_name: str, exit_code: int, duration: float):
+    worker_registry.counter("pytf_worker_runs_total",
+                            "Job runs completed by workers").inc(queue=queue_name, exit_code=str(exit_code))
+    worker_registry.histogram("pytf_worker_run_duration_seconds",
+                              "Job run duration on workers",
+                              RUN_BUCKETS).observe(duration, queue=queue_name)
+    metrics_dir = metrics_dir_for(log_dir)
+    worker_registry.save(metrics_dir, f"worker-{socket.gethostname()}-{os.getpid()}")
+    retire_dead_workers(metrics_dir)
+
+
+def retire_dead_workers(metrics_dir: str):
+    """
+    Fold the snapshots of this host's worker processes that have exited into one
+    worker-{host}-retired snapshot. Autoscaling keeps starting children with new pids, so
+    otherwise the metrics dir grows without bound; folding rather than deleting keeps the
+    counters from going backwards.
+    """
+    prefix = f"worker-{socket.gethostname()}-"
+    retired = []
+    for file_name in os.listdir(metrics_dir):
+        pid = file_name[len(prefix):-len(".json")]
+        if not (file_name.startswith(prefix) and file_name.endswith(".json") and pid.isdigit()) or _alive(int(pid)):
+            continue
+        # renaming claims it, so two processes never fold the same snapshot
+        claimed_path = os.path.join(metrics_dir, f"{file_name}.{os.getpid()}.retiring")
+        try:
+            os.rename(os.path.join(metrics_dir, file_name), claimed_path)
+        except FileNotFoundError:
+            continue
+        retired.append(claimed_path)
+    if not retired:
+        return
+
+    with open(os.path.join(metrics_dir, f"{prefix}retired.lock"), "a") as lock_file:
+        fcntl.lockf(lock_file, fcntl.LOCK_EX)
+        try:
+            registry = Registry()
+            for path in [os.path.join(metrics_dir, f"{prefix}retired.json")] + retired:
+                try:
+                    with open(path) as f:
+                        registry.merge_snapshot(json.load(f))
+                except (FileNotFoundError, json.JSONDecodeError):
+                    continue
+            registry.save(metrics_dir, f"{prefix}retired")
+            for path in retired:
+                os.remove(path)
+        finally:
+            fcntl.lockf(lock_file, fcntl.LOCK_UN)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def reset():
+    scheduler_registry.metrics.clear()
+    worker_registry.metrics.clear()
+    _ready_since.clear()
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: tuple) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in key) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
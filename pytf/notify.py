@@ -0,0 +1,209 @@
+"""
+Email notifications for job failures and retries.
+
+Who gets mail follows the job -> family -> config inheritance of each setting:
+
+    failure                       email
+    retry                         retry_email (or email), unless no_retry_email
+    success after a retry         retry_success_email (or email), unless no_retry_success_email
+
+Notifications are collected per recipient for email_window seconds, starting with the first
+one, and sent as a single digest. Digests go out over one SMTP connection, which is kept open
+between windows while the server allows it, so a mass failure is a handful of messages rather
+than one SMTP session per job. Sending happens on a background thread so the tick never waits
+on the mail server.
+
+Nothing is sent unless smtp_server is set in the config.
+"""
+import atexit
+import collections
+import email.message
+import logging
+import queue
+import smtplib
+import threading
+import time
+
+import pytf.events as events
+from .config import Config
+from .family import Family
+
+MAX_QUEUE = 10000
+MAX_ATTEMPTS = 3
+SMTP_IDLE = 60.0
+SMTP_TIMEOUT = 30.0
+
+_notifier = None
+
+
+def _coalesce(*args):
+    for arg in args:
+        if arg is not None:
+            return arg
+
+
+def _setting(config: Config, family: Family, job, name: str):
+    return _coalesce(getattr(job, name, None), getattr(family, name, None), getattr(config, name))
+
+
+def recipients_for(config: Config, family: Family | None, event: dict) -> [str]:
+    job = family.jobs_by_name.get(event['job_name']) if family is not None else None
+    kind = event['event']
+    if kind == events.EVENT_FAILURE:
+        to = _setting(config, family, job, 'email')
+    elif kind == events.EVENT_RETRY:
+        if _setting(config, family, job, 'no_retry_email'):
+            return []
+        to = _coalesce(_setting(config, family, job, 'retry_email'), _setting(config, family, job, 'email'))
+    elif kind == events.EVENT_SUCCESS and event.get('retried'):
+        if _setting(config, family, job, 'no_retry_success_email'):
+            return []
+        to = _coalesce(_setting(config, family, job, 'retry_success_email'), _setting(config, family, job, 'email'))
+    else:
+        return []
+    return [address.strip() for address in (to or "").split(",") if address.strip()]
+
+
+def digest(config: Config, recipient: str, batch: [dict]) -> email.message.EmailMessage:
+    counts = collections.Counter(_describe(e) for e in batch)
+    if len(batch) == 1:
+        subject = f"[pytf] {batch[0]['family_name']}::{batch[0]['job_name']} {_describe(batch[0])}"
+    else:
+        subject = f"[pytf] {len(batch)} job notifications: " + ", ".join(f"{n} {what}" for what, n in sorted(counts.items()))
+    lines = [f"{_describe(e):<24} {e['family_name']}::{e['job_name']}  queue={e.get('queue_name')}  "
+             f"start={e.get('start_time')}  end={e.get('end_time')}  exit={e.get('error_code')}"
+             for e in batch]
+
+    message = email.message.EmailMessage()
+    message['From'] = config.email_from
+    message['To'] = recipient
+    message['Subject'] = subject
+    message.set_content("\n".join(lines) + "\n")
+    return message
+
+
+def _describe(event: dict) -> str:
+    if event['event'] == events.EVENT_FAILURE:
+        return "failed"
+    if event['event'] == events.EVENT_RETRY:
+        return "failed, will retry"
+    return "succeeded after retry"
+
+
+class EmailNotifier:
+    def __init__(self, config: Config):
+        self.config = config
+        self.queue = queue.Queue(maxsize=MAX_QUEUE)
+        self.sent = 0
+        # recipient -> [time of the first event, [events], attempts]
+        self._pending: dict = {}
+        self._smtp: smtplib.SMTP | None = None
+        self._smtp_last_used = 0.0
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="pytf-notify", daemon=True)
+        self._thread.start()
+
+    def submit(self, recipient: str, event: dict):
+        try:
+            self.queue.put_nowait((recipient, event))
+        except queue.Full:
+            logging.getLogger('pytf_logger').error(
+                f"Notification queue is full; not emailing {recipient} about {event['id']}")
+
+    def stop(self, timeout: float = 10.0):
+        """
+        Send everything that's pending now, without waiting for the window to close.
+        """
+        self._stopping.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            stopping = self._stopping.is_set()
+            self._collect(timeout=0 if stopping else 0.1)
+            self._flush(everything=stopping)
+            if stopping:
+                break
+            if self._smtp is not None and time.monotonic() - self._smtp_last_used > SMTP_IDLE:
+                self._close()
+        self._close()
+
+    def _collect(self, timeout: float):
+        try:
+            while True:
+                recipient, event = self.queue.get(timeout=timeout) if timeout else self.queue.get_nowait()
+                timeout = 0
+                entry = self._pending.setdefault(recipient, [time.monotonic(), [], 0])
+                entry[1].append(event)
+        except queue.Empty:
+            pass
+
+    def _flush(self, everything: bool):
+        now = time.monotonic()
+        due = [r for r, (first, _, _) in self._pending.items() if everything or now - first >= self.config.email_window]
+        logger = logging.getLogger('pytf_logger')
+        for recipient in due:
+            first, batch, attempts = self._pending[recipient]
+            try:
+                self._connection().send_message(digest(self.config, recipient, batch))
+                self._smtp_last_used = time.monotonic()
+                self.sent += 1
+                del self._pending[recipient]
+            except (smtplib.SMTPException, OSError) as e:
+                self._close()
+                attempts += 1
+                if attempts >= MAX_ATTEMPTS or everything:
+                    logger.error(f"Giving up on emailing {len(batch)} notifications to {recipient}: {e}")
+                    del self._pending[recipient]
+                else:
+                    logger.warning(f"Couldn't email {recipient} ({e}); trying again in {self.config.email_window}s")
+                    self._pending[recipient] = [now, batch, attempts]
+
+    def _connection(self) -> smtplib.SMTP:
+        if self._smtp is not None:
+            try:
+                self._smtp.noop()
+                return self._smtp
+            except (smtplib.SMTPException, OSError):
+                self._close()
+        smtp = smtplib.SMTP(str(self.config.smtp_server), int(self.config.smtp_port), timeout=SMTP_TIMEOUT)
+        if self.config.smtp_user:
+            smtp.ehlo()
+            if smtp.has_extn('starttls'):
+                smtp.starttls()
+                smtp.ehlo()
+            smtp.login(self.config.smtp_user, self.config.smtp_password or "")
+        self._smtp = smtp
+        return smtp
+
+    def _close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+
+def notify(config: Config, families: [Family], job_events: [dict]):
+    """
+    Queue emails for this tick's events. Nothing is started unless someone needs to be emailed.
+    Email is off unless smtp_server is set.
+    """
+    global _notifier
+    if not config.smtp_server:
+        return
+    families_by_name = {f.name: f for f in families}
+    for event in job_events:
+        for recipient in recipients_for(config, families_by_name.get(event['family_name']), event):
+            if _notifier is None:
+                _notifier = EmailNotifier(config)
+                atexit.register(stop)
+            _notifier.submit(recipient, event)
+
+
+def stop(timeout: float = 10.0):
+    global _notifier
+    if _notifier is not None:
+        _notifier.stop(timeout)
+        _notifier = None
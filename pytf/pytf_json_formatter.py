@@ -1,6 +1,21 @@
+"""
+One JSON object per log record, for pytf.jlog.
+
+fmt_keys maps output keys to LogRecord attributes, plus "message" (the formatted message) and
+"timestamp" (ISO 8601, UTC). The message and timestamp are always included, as are exc_info
+and stack_info when the record has them, and any extra attributes given with extra={...}.
+
+The formatter runs for every record the scheduler logs, so the work that doesn't depend on
+the record is done once, in __init__: each field's key is encoded ahead of time, and each
+value is fetched and encoded by a function chosen for it. The date and time up to the second
+are formatted once per second.
+"""
 import datetime as dt
 import json
+import json.encoder
 import logging
+import math
+import operator
 from typing import override
 
 LOG_RECORD_BUILTIN_ATTRS = {
@@ -29,6 +44,21 @@ LOG_RECORD_BUILTIN_ATTRS = {
     "taskName",
 }
 
+# the C version when there is one, as json.dumps uses
+_encode_str = json.encoder.encode_basestring_ascii
+
+
+def _encode(value) -> str:
+    # the same as json.dumps(value, default=str), without its setup for the common types
+    value_type = type(value)
+    if value_type is str:
+        return _encode_str(value)
+    if value_type is int:
+        return int.__repr__(value)
+    if value is None:
+        return "null"
+    return json.dumps(value, default=str)
+
 
 class PytfJSONFormatter(logging.Formatter):
     def __init__(
@@ -38,18 +68,47 @@ class PytfJSONFormatter(logging.Formatter):
     ):
         super().__init__()
         self.fmt_keys = fmt_keys if fmt_keys is not None else {}
+        # (seconds, "YYYY-MM-DDTHH:MM:SS"), replaced as a whole so threads can share it
+        self._second = (None, "")
+
+        fields = {"message": self._message, "timestamp": self._timestamp,
+                  "exc_info": self._exc_info, "stack_info": self._stack_info}
+        self._plan = [(f"{_encode_str(key)}: ", fields.get(attr) or operator.attrgetter(attr))
+                      for key, attr in self.fmt_keys.items()]
+        mapped = set(self.fmt_keys.values())
+        # the ones that aren't in fmt_keys go after them
+        self._unmapped_message = None if "message" in mapped else f"{_encode_str('message')}: "
+        self._unmapped_timestamp = None if "timestamp" in mapped else f"{_encode_str('timestamp')}: "
+        self._unmapped_exc_info = None if "exc_info" in mapped else f"{_encode_str('exc_info')}: "
+        self._unmapped_stack_info = None if "stack_info" in mapped else f"{_encode_str('stack_info')}: "
+        self._keys = set(self.fmt_keys) | {"message", "timestamp", "exc_info", "stack_info"}
 
     @override
     def format(self, record: logging.LogRecord) -> str:
-        message = self._prepare_log_dict(record)
-        return json.dumps(message, default=str)
+        extras = record.__dict__.keys() - LOG_RECORD_BUILTIN_ATTRS
+        if extras & self._keys:
+            # an extra attribute replaces a field; let json sort that out
+            return json.dumps(self._prepare_log_dict(record), default=str)
+
+        parts = [prefix + _encode(get(record)) for prefix, get in self._plan]
+        if self._unmapped_message is not None:
+            parts.append(self._unmapped_message + _encode_str(record.getMessage()))
+        if self._unmapped_timestamp is not None:
+            parts.append(self._unmapped_timestamp + _encode_str(self._timestamp(record)))
+        if self._unmapped_exc_info is not None and record.exc_info is not None:
+            parts.append(self._unmapped_exc_info + _encode_str(self._exc_info(record)))
+        if self._unmapped_stack_info is not None and record.stack_info is not None:
+            parts.append(self._unmapped_stack_info + _encode_str(self._stack_info(record)))
+        if extras:
+            # in the order they were set
+            parts.extend(f"{_encode_str(key)}: {_encode(value)}"
+                         for key, value in record.__dict__.items() if key in extras)
+        return "{" + ", ".join(parts) + "}"
 
     def _prepare_log_dict(self, record: logging.LogRecord):
         always_fields = {
             "message": record.getMessage(),
-            "timestamp": dt.datetime.fromtimestamp(
-                record.created, tz=dt.timezone.utc
-            ).isoformat(),
+            "timestamp": self._timestamp(record),
         }
         if record.exc_info is not None:
             always_fields["exc_info"] = self.formatException(record.exc_info)
@@ -70,3 +129,31 @@ class PytfJSONFormatter(logging.Formatter):
                 message[key] = val
 
         return message
+
+    @staticmethod
+    def _message(record: logging.LogRecord) -> str:
+        return record.getMessage()
+
+    def _timestamp(self, record: logging.LogRecord) -> str:
+        """
+        The same as datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat()
+        """
+        # rounded the way datetime.fromtimestamp rounds
+        fraction, seconds = math.modf(record.created)
+        microseconds = round(fraction * 1e6)
+        if microseconds >= 1_000_000:
+            seconds += 1
+            microseconds -= 1_000_000
+        cached_seconds, prefix = self._second
+        if seconds != cached_seconds:
+            prefix = dt.datetime.fromtimestamp(seconds, tz=dt.timezone.utc).isoformat()[:19]
+            self._second = (seconds, prefix)
+        if microseconds:
+            return f"{prefix}.{microseconds:06d}+00:00"
+        return f"{prefix}+00:00"
+
+    def _exc_info(self, record: logging.LogRecord) -> str | None:
+        return None if record.exc_info is None else self.formatException(record.exc_info)
+
+    def _stack_info(self, record: logging.LogRecord) -> str | None:
+        return None if record.stack_info is None else self.formatStack(record.stack_info)
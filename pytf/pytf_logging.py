@@ -1,15 +1,152 @@
+import atexit
+import copy
 import logging
 import logging.config
+import logging.handlers
 import os
+import queue
 
+LOG_QUEUE_SIZE = 10_000
+# longest a record waits in a batching handler when nothing else is logged
+LOG_FLUSH_INTERVAL = 1.0
 
-def setup_logging(log_dir: str):
-    logging_dict = get_logging_config(log_dir)
+_listener: logging.handlers.QueueListener | None = None
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread without ever blocking the caller.
+    If the listener falls LOG_QUEUE_SIZE records behind, new records are dropped and counted.
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only merge args into the message so later mutation can't change it. Formatting
+        # (including JSON encoding and tracebacks) happens on the listener thread.
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class FlushingQueueListener(logging.handlers.QueueListener):
+    """
+    A QueueListener that flushes its handlers once the queue has been empty for flush_interval
+    seconds, so a quiet scheduler's last records don't sit in a batch until it logs again.
+    """
+    def __init__(self, log_queue, *handlers, respect_handler_level=False, flush_interval: float = LOG_FLUSH_INTERVAL):
+        super().__init__(log_queue, *handlers, respect_handler_level=respect_handler_level)
+        self.flush_interval = flush_interval
+        self._unflushed = False
+
+    def dequeue(self, block):
+        while True:
+            try:
+                record = self.queue.get(block, self.flush_interval if block and self._unflushed else None)
+            except queue.Empty:
+                if not block:
+                    raise
+                for handler in self.handlers:
+                    handler.flush()
+                self._unflushed = False
+                continue
+            self._unflushed = True
+            return record
+
+
+class BatchingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    A RotatingFileHandler that writes up to batch_size records at a time, with one write and
+    one flush. A WARNING or worse, flush() and close() write what's waiting straight away, but
+    otherwise a record waits for the batch to fill, or for FlushingQueueListener to flush it. With batch_size = 1 it writes each record
+    as it comes, like RotatingFileHandler, but formats it once rather than twice.
+    """
+    def __init__(self, filename, batch_size: int = 1, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.batch_size = batch_size
+        self._lines = []
+        self._last_record = None
+
+    def emit(self, record):
+        try:
+            self._lines.append(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+            return
+        self._last_record = record
+        if len(self._lines) >= self.batch_size or record.levelno >= logging.WARNING:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self._lines:
+                text = "".join(self._lines)
+                self._lines = []
+                try:
+                    if self.stream is None:
+                        self.stream = self._open()
+                    if 0 < self.maxBytes <= self.stream.tell() + len(text) and self.stream.tell() > 0:
+                        self.doRollover()
+                    self.stream.write(text)
+                except Exception:
+                    self.handleError(self._last_record)
+            super().flush()
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+def setup_logging(log_dir: str, json_batch_size: int = 1):
+    """
+    Configure the handlers from get_logging_config, then move them behind a bounded queue
+    so that a logger call on the scheduler's thread is just a queue put.
+    """
+    global _listener
+    stop_logging()
+
+    logging_dict = get_logging_config(log_dir, json_batch_size)
     logging.config.dictConfig(logging_dict)
     # _ = logging.getLogger('runner')
 
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    for handler in handlers:
+        root.removeHandler(handler)
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    root.addHandler(DroppingQueueHandler(log_queue))
+
+    _listener = FlushingQueueListener(log_queue, *handlers, respect_handler_level=True,
+                                      flush_interval=LOG_FLUSH_INTERVAL)
+    _listener.start()
+
 
-def get_logging_config(log_dir: str):
+def stop_logging():
+    """
+    Flush the queue and close the real handlers.
+    """
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+
+
+atexit.register(stop_logging)
+
+
+def get_logging_config(log_dir: str, json_batch_size: int = 1):
 
     # if not os.path.exists("/pytf_root/logs/pytf.log"):
     #     print("**** Creating log file")
@@ -58,10 +195,11 @@ def get_logging_config(log_dir: str):
                 "backupCount": 10,
             },
             "json": {
-                "class": "logging.handlers.RotatingFileHandler",
+                "class": "pytf.pytf_logging.BatchingRotatingFileHandler",
                 "level": "INFO",
                 "formatter": "json",
                 "filename": os.path.join(log_dir, "pytf.jlog"),
+                "batch_size": json_batch_size,
                 "maxBytes": 10_000_000,
                 "backupCount": 2,
             },
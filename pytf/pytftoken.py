@@ -1,71 +1,238 @@
 from attrs import define
+import collections
+import contextlib
+import fcntl
+import json
 import logging
 import os
 import pathlib
+import socket
 
 import tomlkit
 
+import pytf.job_info as job_info
+import pytf.runs as runs
+from .mockdatetime import MockDateTime
+
+LEASE_SUFFIX = ".lease"
+
 
 @define
 class PyTfToken:
     name: str
     num_instances: int
 
+    @staticmethod
+    @contextlib.contextmanager
+    def lock(config):
+        """
+        Exclusive lock around deciding which jobs get tokens. Schedulers sharing a root (see
+        sharding.py) hold it so their token grants can't interleave. It's a POSIX record lock,
+        which, unlike flock, also works between hosts on an NFS log dir.
+        """
+        with open(os.path.join(config.log_dir, "token_usage.lock"), "a") as lock_file:
+            fcntl.lockf(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(lock_file, fcntl.LOCK_UN)
+
     @staticmethod
     def update_token_usage(config):
-        token_file = os.path.join(config.log_dir, "token_usage.toml")
-        if not os.path.exists(token_file):
+        with PyTfToken.lock(config):
+            PyTfToken._update_token_usage(config)
+
+    @staticmethod
+    def _update_token_usage(config):
+        """
+        Release the leases of holders that are done: the job's .info (or .runs record) has an
+        error_code, or the job never started and its lease has expired, e.g. because the
+        scheduler that was granted the token died before sending the job.
+        """
+        logger = logging.getLogger('pytf_logger')
+        PyTfToken._import_token_usage_file(config)
+        leases = PyTfToken._leases(config)
+        if not leases:
             return
 
-        token_file_text = pathlib.Path(token_file).read_text()
-        token_usage_doc = tomlkit.loads(token_file_text)
+        # lazy, because pytf.logs and pytf.dirs need pytf.config, which needs this module
+        import pytf.dirs as dirs
+        import pytf.logs as logs
 
-        if not token_usage_doc.get('token'):
+        now = MockDateTime.now(config.primary_tz)
+        # the CLI gets here before prepare_required_dirs has set todays_log_dir
+        todays_log_dir = config.todays_log_dir or dirs.dated_subdir(config.log_dir, now)
+        if not os.path.isdir(todays_log_dir):
+            # nothing has started today, so there's nothing to tell about the holders yet
             return
 
-        new_token_doc:tomlkit.TOMLDocument = tomlkit.document()
-        aot = None
-
-        for token in token_usage_doc['token']:
-            all_log_dir_files = os.listdir(config.todays_log_dir)
-            family_name = token['family_name']
-            job_name = token['job_name']
-            info_files = [f for f in all_log_dir_files
-                          if f.startswith(f"{family_name}.{job_name}.")
-                          and f.endswith(".info")
-                          ]
-
-            info_file = info_files[0]
-            info_file_path = os.path.join(config.todays_log_dir, info_file)
-            info_doc = tomlkit.loads(pathlib.Path(info_file_path).read_text())
-            if info_doc.get('error_code') is None:
-                # still running
-                if aot is None:
-                    aot = tomlkit.aot()
-                aot.append(token)
+        info_files = {}
+        for file_name in os.listdir(todays_log_dir):
+            if file_name.endswith(".info"):
+                family_name, job_name = file_name.split(".")[:2]
+                info_files.setdefault((family_name, job_name), file_name)
 
-        if aot is None:
-            os.remove(token_file)
-            return
+        for lease_path, lease in leases:
+            family_name = lease['family_name']
+            job_name = lease['job_name']
+            if info_file := info_files.get((family_name, job_name)):
+                info_doc = job_info.read(os.path.join(todays_log_dir, info_file))
+            else:
+                # an instance of a repeating job is in its base job's .runs file
+                _, info_doc = runs.find(todays_log_dir, family_name, job_name)
 
-        new_token_doc.append('token', aot)
-        with open(token_file, "w") as f:
-            f.write(tomlkit.dumps(new_token_doc))
+            if info_doc is None:
+                if os.path.exists(logs.queued_file(todays_log_dir, family_name, job_name)):
+                    # sent, but the worker hasn't picked it up yet
+                    continue
+                if lease['lease_expires'] > now.timestamp():
+                    # granted, and about to be sent
+                    continue
+                logger.warning(f"Reclaiming {lease['token_name']} from {family_name}::{job_name}, "
+                               f"granted by {lease['holder']}, which never started")
+            elif info_doc.get('error_code') is None:
+                # still running
+                continue
+            PyTfToken._release(lease_path)
 
     @staticmethod
     def current_token_document(config):
-        token_file = os.path.join(config.log_dir, "token_usage.toml")
-        if not os.path.exists(token_file):
-            return tomlkit.TOMLDocument()
+        """
+        Every held token instance, as a [[token]] table with token_name, family_name and job_name
+        """
+        doc = tomlkit.TOMLDocument()
+        leases = PyTfToken._leases(config)
+        if leases:
+            aot = tomlkit.aot()
+            for _, lease in leases:
+                table = tomlkit.table()
+                table['token_name'] = lease['token_name']
+                table['family_name'] = lease['family_name']
+                table['job_name'] = lease['job_name']
+                aot.append(table)
+            doc.append('token', aot)
+        return doc
+
+    @staticmethod
+    def save_token_document(config, doc: tomlkit.TOMLDocument) -> set:
+        """
+        Make the held tokens match doc. Only the differences are written: a lease file is created
+        for each new holder and removed for each holder no longer in doc.
+
+        :return: (family_name, job_name) of the jobs in doc that couldn't get all of their tokens,
+                 because another process took the last instance first. They get none.
+        """
+        wanted = collections.Counter(PyTfToken._holding(token) for token in doc.get('token', []))
+        for lease_path, lease in PyTfToken._leases(config):
+            holding = PyTfToken._holding(lease)
+            if wanted[holding] > 0:
+                wanted[holding] -= 1
+            else:
+                PyTfToken._release(lease_path)
+
+        by_job = {}
+        for (token_name, family_name, job_name), n in wanted.items():
+            by_job.setdefault((family_name, job_name), []).extend([token_name] * n)
+        return {job for job, token_names in by_job.items() if not PyTfToken._acquire(config, *job, token_names)}
+
+    @staticmethod
+    def _acquire(config, family_name, job_name, token_names) -> bool:
+        """
+        Take one instance of each of token_names, or none of them. An instance is a slot file,
+        T1.0 .. T1.{n-1}, created with link(2) so it appears complete or not at all, and at most
+        once however many schedulers try.
+        """
+        lease_dir = _lease_dir(config)
+        os.makedirs(lease_dir, exist_ok=True)
+        now = MockDateTime.now(config.primary_tz).timestamp()
+        # the process granting the lease, for the log when it's reclaimed
+        holder = f"{socket.gethostname()}-{os.getpid()}"
+        lease = {'family_name': family_name, 'job_name': job_name, 'holder': holder,
+                 'granted': now, 'lease_expires': now + config.token_lease}
+        tmp_path = os.path.join(lease_dir, f".{holder}.tmp")
+        taken = []
+        try:
+            for token_name in token_names:
+                tok = config.tokens_by_name.get(token_name)
+                num_instances = tok.num_instances if tok is not None else 0
+                # a new file each time: a linked slot shares the temp file's inode
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(tmp_path)
+                with open(tmp_path, "w") as f:
+                    json.dump(dict(lease, token_name=token_name), f)
+                for slot in range(num_instances):
+                    lease_path = os.path.join(lease_dir, f"{token_name}.{slot}{LEASE_SUFFIX}")
+                    try:
+                        os.link(tmp_path, lease_path)
+                    except FileExistsError:
+                        continue
+                    taken.append(lease_path)
+                    break
+                else:
+                    for lease_path in taken:
+                        PyTfToken._release(lease_path)
+                    return False
+            return True
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def release_job(config, family_name, job_name):
+        """
+        Release every token instance the job holds.
+        """
+        for lease_path, lease in PyTfToken._leases(config):
+            if (lease['family_name'], lease['job_name']) == (family_name, job_name):
+                PyTfToken._release(lease_path)
 
-        return tomlkit.loads(pathlib.Path(token_file).read_text())
+    @staticmethod
+    def _release(lease_path):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(lease_path)
+
+    @staticmethod
+    def _leases(config) -> [(str, dict)]:
+        """
+        :return: (path, lease) for every held instance, oldest first
+        """
+        lease_dir = _lease_dir(config)
+        try:
+            file_names = os.listdir(lease_dir)
+        except FileNotFoundError:
+            return []
+        leases = []
+        for file_name in file_names:
+            if not file_name.endswith(LEASE_SUFFIX):
+                continue
+            lease_path = os.path.join(lease_dir, file_name)
+            try:
+                with open(lease_path) as f:
+                    leases.append((lease_path, json.load(f)))
+            except FileNotFoundError:
+                # released while we were looking
+                continue
+        leases.sort(key=lambda entry: (entry[1]['granted'], entry[0]))
+        return leases
+
+    @staticmethod
+    def _holding(token) -> (str, str, str):
+        return str(token['token_name']), str(token['family_name']), str(token['job_name'])
 
     @staticmethod
-    def save_token_document(config, doc: tomlkit.TOMLDocument):
+    def _import_token_usage_file(config):
+        """
+        Turn the token_usage.toml written by earlier versions into leases.
+        """
         token_file = os.path.join(config.log_dir, "token_usage.toml")
-        with open(token_file, "w") as f:
-            # doc is never None
-            f.write(tomlkit.dumps(doc))
+        if not os.path.exists(token_file):
+            return
+        doc = tomlkit.loads(pathlib.Path(token_file).read_text())
+        held = PyTfToken.current_token_document(config)
+        for token in doc.get('token', []):
+            held.setdefault('token', tomlkit.aot()).append(token)
+        PyTfToken.save_token_document(config, held)
+        os.remove(token_file)
 
     @staticmethod
     def consume_tokens_from_doc(config, token_names, token_usage_doc, family_name, job_name) -> tomlkit.TOMLDocument|None:
@@ -85,8 +252,8 @@ class PyTfToken:
             current_token_usage[token_name_in_usage] = current_token_usage.get(token_name_in_usage, 0) + 1
             t = tomlkit.table()
             t['token_name'] = token_name_in_usage
-            t['family_name'] = family_name
-            t['job_name'] = job_name
+            t['family_name'] = token['family_name']
+            t['job_name'] = token['job_name']
             new_token_usage_doc['token'].append(t)
 
         logger.info(f"{current_token_usage=}")
@@ -108,3 +275,6 @@ class PyTfToken:
         logger.info("All tokens available")
         return new_token_usage_doc
 
+
+def _lease_dir(config) -> str:
+    return os.path.join(config.log_dir, "tokens")
@@ -1,26 +1,32 @@
 import os
-import pathlib
 import re
 
-import tomlkit
-
 from .config import Config
 from .holdAndRelease import release_dependencies
+import pytf.job_info as job_info
+import pytf.logs as logs
+import pytf.runs as runs
+import pytf.sharding as sharding
 
 
-def rerun(config:Config, family, job):
+def rerun(config:Config, family, job, all_files=None, release=True):
     """
     A rerun should do the following:
-    - Move the old info file to *.Orig-$n.info
+    - Move the old info file to *.Orig-$n.info (for an instance of a repeating job, record
+      the old run as *-Orig-$n in the .runs file)
     - Release all dependencies on that job
         - This should cause that job to be eligible for the next run
         - A job should not be rerun if it's still running
+    - A job that was sent to its queue but never started is sent again
     :param config:
     :param family:
     :param job:
+    :param all_files: Listing of todays_log_dir, for callers rerunning many jobs in one pass
+    :param release: False leaves the job waiting on its dependencies, e.g. when they're being rerun too
     :return:
     """
-    all_files = os.listdir(config.todays_log_dir)
+    if all_files is None:
+        all_files = os.listdir(config.todays_log_dir)
     all_info_files = [fn for fn in all_files
                       if (fn.startswith(f"{family}.{job}.")
                           or fn.startswith(f"{family}.{job}-Orig-"))
@@ -32,20 +38,37 @@ def rerun(config:Config, family, job):
         next_info_number = max(existing_info_numbers) + 1
 
     file_to_rename = [f for f in all_info_files if not re.findall(r, f)]
+    if not file_to_rename:
+        runs_file, record = runs.find(config.todays_log_dir, family, job)
+        if record is not None:
+            # an instance of a repeating job
+            if runs.rerun(runs_file, job):
+                sharding.release_claim(config.todays_log_dir, family, job)
+                logs.remove_queued(config.todays_log_dir, family, job)
+                if release:
+                    release_dependencies(config, family, job)
+            return
+    if not file_to_rename and f"{family}.{job}.queued" in all_files:
+        # the broker lost it, or the worker died before starting it
+        logs.remove_queued(config.todays_log_dir, family, job)
+        sharding.release_claim(config.todays_log_dir, family, job)
+        return
     if file_to_rename:
         new_job_name = f'{job}-Orig-{next_info_number}'
         l = file_to_rename[0].split(".")
         l[1] = new_job_name
         new_file_name = ".".join(l)
         # change the job name to be the new job name
-        job_info_str = pathlib.Path(os.path.join(config.todays_log_dir, file_to_rename[0])).read_text()
-        job_info = tomlkit.loads(job_info_str)
-        if job_info.get('error_code') is None:
+        old_info = job_info.read(os.path.join(config.todays_log_dir, file_to_rename[0]))
+        if old_info.get('error_code') is None:
             # don't rerun if the job is still running
             return
-        job_info['job_name'] = new_job_name
+        old_info['job_name'] = new_job_name
+        job_info.write(os.path.join(config.todays_log_dir, new_file_name), old_info)
         os.remove(os.path.join(config.todays_log_dir, file_to_rename[0]))
-        with open(os.path.join(config.todays_log_dir, new_file_name), "w") as f:
-            f.write(tomlkit.dumps(job_info))
+        # let whichever shard owns the family dispatch the job again
+        sharding.release_claim(config.todays_log_dir, family, job)
+        logs.remove_queued(config.todays_log_dir, family, job)
 
-        release_dependencies(config, family, job)
+        if release:
+            release_dependencies(config, family, job)
@@ -1,8 +1,20 @@
 import datetime
+import logging
 import os
 
 import pytf.dirs as dirs
 from .mockdatetime import MockDateTime
+from .pytf_logging import setup_logging
+from .pytftoken import PyTfToken
+
+
+def setup_logging_and_tokens(config):
+    setup_logging(config.log_dir, config.json_log_batch)
+    _ = logging.getLogger("pytf_logger")
+    # before doing anything, make sure token file is up-to-date
+    # This is important because a rerun may move an info file and cause a token file to point to
+    # a non-existent file
+    PyTfToken.update_token_usage(config)
 
 
 def prepare_required_dirs(config):
@@ -0,0 +1,147 @@
+"""
+Compact storage of the runs of a repeating job.
+
+A job with `every` is expanded into one instance per start time (J1-0100, J1-0115, ...).
+Rather than a .info and a .log file per instance, the worker appends the instances' records
+to one Family.J1.runs file and their output to one Family.J1.log.
+
+Each line of a .runs file is a JSON record with everything a .info file would hold for one
+instance at that moment. The last record for a job_name wins, and a record with
+"removed": true drops the instance (a rerun writes the old run back as J1-0100-Orig-n and
+then removes J1-0100). Records also hold log_offset and log_end, the bytes of the shared
+log that were written while the instance ran. Lines in that log are tagged with the
+instance's name (log_tag), since instances can overlap.
+"""
+import json
+import os
+import re
+
+import tomlkit
+
+RUNS_SUFFIX = ".runs"
+
+# path -> (inode, bytes folded so far, {job_name: record})
+_folded: dict = {}
+
+
+def base_job_name(job_name: str) -> str:
+    # J1-Orig-2 (a rerun) and J1-0930 (a repeating instance) are both runs of J1
+    job_name = re.sub(r'-Orig-\d+$', '', job_name)
+    return re.sub(r'-\d{4}$', '', job_name)
+
+
+def runs_path(log_dir: str, family_name: str, base_name: str) -> str:
+    return os.path.join(log_dir, f"{family_name}.{base_name}{RUNS_SUFFIX}")
+
+
+def log_tag(job_name: str) -> str:
+    return f"[{job_name}]"
+
+
+def append(path: str, record: dict, fsync: bool = False):
+    """
+    Append one record. It's a single write to a file opened for appending, so concurrent
+    writers (overlapping instances, a rerun) don't interleave within a record.
+    """
+    line = json.dumps(record, separators=(",", ":")) + "\n"
+    with open(path, "a") as f:
+        f.write(line)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def fold(text: str, records: dict | None = None) -> dict:
+    """
+    Apply the records in text, in order, to records.
+
+    :return: {job_name: latest record}
+    """
+    records = {} if records is None else records
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if record.get('removed'):
+            records.pop(record['job_name'], None)
+        else:
+            records[record['job_name']] = record
+    return records
+
+
+def instances(path: str) -> dict:
+    """
+    The current record of every instance in a .runs file. The file is only ever appended to,
+    so only what was added since the last call is read. The result is shared; don't change it.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        _folded.pop(path, None)
+        return {}
+    inode, offset, records = _folded.get(path, (None, 0, None))
+    if inode != stat.st_ino or stat.st_size < offset:
+        offset, records = 0, {}
+    if stat.st_size > offset:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            new_bytes = f.read(stat.st_size - offset)
+        # a record that's still being written is picked up next time
+        complete = new_bytes[:new_bytes.rfind(b"\n") + 1]
+        records = fold(complete.decode("utf-8"), dict(records))
+        offset += len(complete)
+    _folded[path] = (stat.st_ino, offset, records)
+    return records
+
+
+def find(log_dir: str, family_name: str, job_name: str) -> (str, dict | None):
+    """
+    :return: (path of the .runs file job_name would be in, its record or None)
+    """
+    path = runs_path(log_dir, family_name, base_job_name(job_name))
+    return path, instances(path).get(job_name)
+
+
+def records_in_day_file(file_name: str, text: str) -> [dict]:
+    """
+    The run records in a file from a day's log dir: the one in a .info file, every
+    instance's in a .runs file, and none in anything else.
+    """
+    if file_name.endswith(".info"):
+        return [tomlkit.loads(text)]
+    if file_name.endswith(RUNS_SUFFIX):
+        return list(fold(text).values())
+    return []
+
+
+def rerun(path: str, job_name: str) -> bool:
+    """
+    Keep the instance's last run as job_name-Orig-n and remove it, so it's dispatched again.
+
+    :return: False if the instance is still running
+    """
+    records = instances(path)
+    record = records[job_name]
+    if record.get('error_code') is None:
+        return False
+    numbers = [int(m.group(1)) for name in records if (m := re.match(rf"^{re.escape(job_name)}-Orig-(\d+)$", name))]
+    append(path, dict(record, job_name=f"{job_name}-Orig-{max(numbers, default=0) + 1}"))
+    append(path, {"job_name": job_name, "removed": True})
+    return True
+
+
+def mark(path: str, job_name: str, error_code: int, now_str: str):
+    record = instances(path)[job_name]
+    append(path, dict(record, error_code=error_code, **{f"original_error_code_{now_str}": record.get('error_code')}))
+
+
+def instance_log(log_bytes: bytes, record: dict) -> str:
+    """
+    The lines the instance wrote to its base job's shared log.
+    """
+    start = record.get('log_offset', 0)
+    end = record.get('log_end')
+    # a rerun's -Orig-n record keeps the tag the instance ran with
+    tag = record.get('log_tag', log_tag(record['job_name'])).encode()
+    chunk = log_bytes[start:end] if end is not None else log_bytes[start:]
+    return b"".join(line for line in chunk.splitlines(keepends=True) if tag in line).decode("utf-8", errors="replace")
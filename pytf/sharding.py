@@ -0,0 +1,86 @@
+import bisect
+import hashlib
+import logging
+import os
+
+from attrs import define, field
+
+import pytf.exceptions as ex
+from .config import Config
+
+DEFAULT_VNODES = 64
+
+_rings: dict = {}
+
+
+@define
+class HashRing:
+    """
+    Consistent hashing of family names onto shards. Each shard gets `vnodes` points on
+    the ring, so adding a shard to a list of n moves about 1/(n+1) of the families,
+    all of them to the new shard.
+    """
+    shards: tuple
+    vnodes: int = field(default=DEFAULT_VNODES)
+    _points: list = field(init=False, factory=list)
+    _owners: list = field(init=False, factory=list)
+
+    def __attrs_post_init__(self):
+        ring = sorted((_hash(f"{shard}#{i}"), shard) for shard in self.shards for i in range(self.vnodes))
+        self._points = [point for point, _ in ring]
+        self._owners = [shard for _, shard in ring]
+
+    def owner(self, family_name: str) -> str:
+        index = bisect.bisect(self._points, _hash(family_name)) % len(self._points)
+        return self._owners[index]
+
+
+def ring_for(config: Config) -> HashRing:
+    key = (tuple(config.shards), config.shard_vnodes)
+    if (ring := _rings.get(key)) is None:
+        ring = HashRing(shards=key[0], vnodes=key[1])
+        _rings[key] = ring
+    return ring
+
+
+def owns_family(config: Config, family_name: str) -> bool:
+    """
+    Without a shard set, this scheduler owns every family.
+    """
+    if config.shard is None:
+        return True
+    if config.shard not in config.shards:
+        raise ex.PyTaskforestParseException(f"{ex.MSG_CONFIG_UNKNOWN_SHARD} {config.shard}")
+    return ring_for(config).owner(family_name) == config.shard
+
+
+def claim_file(todays_log_dir: str, family_name: str, job_name: str) -> str:
+    return os.path.join(todays_log_dir, f"{family_name}.{job_name}.claim")
+
+
+def claim(config: Config, family_name: str, job_name: str) -> bool:
+    """
+    Atomically create the job's claim file on the shared log dir. While shards are being
+    added, two schedulers can briefly both think they own a family; only the one that
+    creates the claim dispatches the job.
+    """
+    try:
+        fd = os.open(claim_file(config.todays_log_dir, family_name, job_name), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        logging.getLogger('pytf_logger').warning(f"{family_name}::{job_name} was already claimed by another shard")
+        return False
+    os.write(fd, f"{config.shard}\n".encode())
+    os.close(fd)
+    return True
+
+
+def release_claim(todays_log_dir: str, family_name: str, job_name: str):
+    try:
+        os.remove(claim_file(todays_log_dir, family_name, job_name))
+    except FileNotFoundError:
+        pass
+
+
+def _hash(value: str) -> int:
+    # stable across processes and hosts, unlike hash()
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
@@ -0,0 +1,335 @@
+import datetime
+import logging
+import os
+import pathlib
+import random
+import shutil
+import tempfile
+import time
+
+import attrs
+from attrs import define, field
+import pytz
+import tomlkit
+
+from .config import Config
+from .runs import base_job_name as _base_job_name
+from .main import run_main_loop_until_end, main_function
+from .mockdatetime import MockDateTime
+from .pytftoken import PyTfToken
+from .runner import prepare_required_dirs
+from .status import status as pytf_status
+import pytf.archive as archive
+import pytf.dirs as dirs
+import pytf.exceptions as ex
+import pytf.job_info as job_info
+import pytf.logs as logs
+import pytf.runs as runs
+
+INFO_TIME_FORMAT = "%Y/%m/%d %H:%M:%S"
+
+
+@define
+class SimulatedRun:
+    family_name: str
+    job_name: str
+    queue_name: str
+    job_tz: str
+    num_retries: int
+    retry_sleep: int
+    info_path: str
+    submitted: datetime.datetime
+    started: datetime.datetime | None = field(default=None)
+    ends: datetime.datetime | None = field(default=None)
+    error_code: int | None = field(default=None)
+    runs_completed: int = field(default=0)
+    retry_waiting: bool = field(default=False)
+
+
+@define
+class SimulatedExecutor:
+    """
+    Stands in for the Celery task in main_function. Jobs are queued per queue, started when a
+    slot is free, and completed when the simulated clock passes their sampled duration.
+    The .info files are written exactly like pytf_worker.run writes them, so the scheduler
+    can't tell the difference.
+    """
+    config: Config
+    history: dict = field(factory=dict)
+    rng: random.Random = field(factory=random.Random)
+    pending: dict = field(factory=dict)
+    running: list = field(factory=list)
+    finished: list = field(factory=list)
+    queue_waits: dict = field(factory=dict)
+    first_dispatch: datetime.datetime | None = field(default=None)
+    last_completion: datetime.datetime | None = field(default=None)
+    duplicate_dispatches: int = field(default=0)
+
+    def apply_async(self, args, queue):
+        (_, _, _, family_name, job_name, job_tz, queue_name,
+         num_retries, retry_sleep, _, info_path) = args[:11]
+        now = MockDateTime.now(self.config.primary_tz)
+        if self.first_dispatch is None:
+            self.first_dispatch = now
+        if any(r.family_name == family_name and r.job_name == job_name for r in self.pending.get(queue, [])):
+            # The scheduler marks a job .queued when it sends it, so this only happens
+            # if something else sent the job again.
+            self.duplicate_dispatches += 1
+            return
+        self.pending.setdefault(queue, []).append(SimulatedRun(family_name=family_name,
+                                                               job_name=job_name,
+                                                               queue_name=queue_name,
+                                                               job_tz=job_tz,
+                                                               num_retries=num_retries or 0,
+                                                               retry_sleep=retry_sleep or 0,
+                                                               info_path=info_path,
+                                                               submitted=now))
+
+    def advance(self, now: datetime.datetime):
+        for run in [r for r in self.running if r.ends <= now]:
+            if run.retry_waiting:
+                run.retry_waiting = False
+                self._start(run, now)
+            else:
+                self._finish(run, now)
+
+        for queue_name, runs in self.pending.items():
+            while runs and self._running_in_queue(queue_name) < self._concurrency(queue_name):
+                run = runs.pop(0)
+                self.queue_waits.setdefault(queue_name, []).append((now - run.submitted).total_seconds())
+                self.running.append(run)
+                self._start(run, now)
+
+    def _running_in_queue(self, queue_name):
+        return len([r for r in self.running if r.queue_name == queue_name])
+
+    def _concurrency(self, queue_name):
+        return self.config.simulation.get('queue_concurrency', {}).get(queue_name, 1)
+
+    def _start(self, run: SimulatedRun, now: datetime.datetime):
+        duration, run.error_code = self._sample(run.family_name, run.job_name)
+        run.started = now
+        run.ends = now + datetime.timedelta(seconds=duration)
+        doc = tomlkit.document()
+        doc['family_name'] = run.family_name
+        doc['job_name'] = run.job_name
+        doc['queue_name'] = run.queue_name
+        doc['num_retries'] = str(run.num_retries)
+        doc['retry_sleep'] = str(run.retry_sleep)
+        doc['tz'] = run.job_tz
+        doc['worker_name'] = "simulated"
+        doc['worker_pid'] = 0
+        doc['job_pid'] = 0
+        doc['start_time'] = now.astimezone(pytz.timezone(run.job_tz)).strftime(INFO_TIME_FORMAT)
+        _write_info(run.info_path, doc)
+        logs.remove_queued(os.path.dirname(run.info_path), run.family_name, run.job_name)
+
+    def _finish(self, run: SimulatedRun, now: datetime.datetime):
+        doc = _read_info(run.info_path, run.job_name)
+        doc['error_code'] = run.error_code
+        doc['end_time'] = now.astimezone(pytz.timezone(run.job_tz)).strftime(INFO_TIME_FORMAT)
+
+        if run.error_code and run.runs_completed < run.num_retries:
+            # the real worker sleeps in its slot, so a retry wait keeps the slot busy
+            del doc['job_pid']
+            doc['retry_wait_until'] = int(now.timestamp()) + run.retry_sleep
+            _write_info(run.info_path, doc)
+            run.runs_completed += 1
+            run.retry_waiting = True
+            run.ends = now + datetime.timedelta(seconds=run.retry_sleep)
+            return
+
+        _write_info(run.info_path, doc)
+        self.running.remove(run)
+        self.finished.append(run)
+        self.last_completion = now
+
+    def _sample(self, family_name, job_name) -> (int, int):
+        settings = self.config.simulation
+        key = f"{family_name}::{job_name}"
+        base_key = f"{family_name}::{_base_job_name(job_name)}"
+        failure_rate = settings.get('failure_rate', 0.0)
+
+        configured = settings.get('durations', {})
+        if (duration := configured.get(key, configured.get(base_key))) is not None:
+            return _sample_duration(self.rng, duration), self._sample_error_code(failure_rate)
+
+        if samples := self.history.get(key, self.history.get(base_key)):
+            return self.rng.choice(samples)
+
+        return (_sample_duration(self.rng, settings.get('default_duration', 60)),
+                self._sample_error_code(failure_rate))
+
+    def _sample_error_code(self, failure_rate):
+        return 1 if self.rng.random() < failure_rate else 0
+
+
+@define
+class SimulationReport:
+    tick_cpu: list = field(factory=list)
+    token_wait_seconds: dict = field(factory=dict)
+    token_waiting_jobs: dict = field(factory=dict)
+    last_tick: datetime.datetime | None = field(default=None)
+
+    def record_tick(self, now: datetime.datetime, cpu_seconds: float, status: dict):
+        self.tick_cpu.append(cpu_seconds)
+        elapsed = (now - self.last_tick).total_seconds() if self.last_tick is not None else 0
+        self.last_tick = now
+        for job in status['status']['flat_list']:
+            if job['status'] != 'Token Wait':
+                continue
+            for token_name in job['tokens'] or []:
+                self.token_wait_seconds[token_name] = self.token_wait_seconds.get(token_name, 0) + elapsed
+                self.token_waiting_jobs.setdefault(token_name, set()).add(f"{job['family_name']}::{job['job_name']}")
+
+    def as_dict(self, executor: SimulatedExecutor, final_status: dict) -> dict:
+        makespan = None
+        if executor.first_dispatch is not None and executor.last_completion is not None:
+            makespan = (executor.last_completion - executor.first_dispatch).total_seconds()
+
+        flat_list = final_status['status']['flat_list']
+        return {
+            "makespan_seconds": makespan,
+            "jobs_completed": len(executor.finished),
+            "duplicate_dispatches": executor.duplicate_dispatches,
+            "queue_waits": {
+                queue_name: {"jobs": len(waits),
+                             "mean_seconds": sum(waits) / len(waits),
+                             "max_seconds": max(waits)}
+                for queue_name, waits in executor.queue_waits.items()
+            },
+            "token_contention": {
+                token_name: {"wait_seconds": seconds,
+                             "jobs": sorted(self.token_waiting_jobs[token_name])}
+                for token_name, seconds in self.token_wait_seconds.items()
+            },
+            "scheduler_cpu_per_tick": {
+                "ticks": len(self.tick_cpu),
+                "mean_seconds": sum(self.tick_cpu) / len(self.tick_cpu) if self.tick_cpu else 0,
+                "max_seconds": max(self.tick_cpu, default=0),
+            },
+            "never_ran": [f"{j['family_name']}::{j['job_name']} ({j['status']})"
+                          for j in flat_list if j['status'] not in ('Success', 'Up To Date', 'Failure', 'Timed Out', 'Running', 'Retry Wait')],
+            "unfinished": [f"{j['family_name']}::{j['job_name']} ({j['status']})"
+                           for j in flat_list if j['status'] in ('Running', 'Retry Wait')],
+        }
+
+
+def simulate(config: Config, yyyymmdd: str, keep_dir: bool = False) -> dict:
+    """
+    Replay a whole day of the real scheduler loop against a simulated executor.
+    Nothing runs and nothing is written under the real root: families are copied into a
+    scratch root and the clock is driven by MockDateTime.
+
+    :param config:
+    :param yyyymmdd: The day to simulate, in the primary tz
+    :param keep_dir: Don't delete the scratch root when done
+    :return: A report dict
+    """
+    logger = logging.getLogger('pytf_logger')
+    try:
+        day = datetime.datetime.strptime(yyyymmdd, "%Y%m%d")
+    except ValueError as e:
+        raise ex.PyTaskforestParseException(f"{ex.MSG_SIMULATE_INVALID_DATE} {yyyymmdd}") from e
+
+    settings = config.simulation
+    history = load_historical_runs(config, day, settings.get('history_days', 30))
+
+    sim_root = tempfile.mkdtemp(prefix="pytf_simulate_")
+    sim_config = attrs.evolve(config,
+                              log_dir=os.path.join(sim_root, "logs"),
+                              family_dir=os.path.join(sim_root, "families"),
+                              instructions_dir=None,
+                              web_hook=None,
+                              smtp_server=None,
+                              once_only=False,
+                              run_local=False)
+    sim_config.d = config.d
+    dirs.make_dir(sim_config.log_dir)
+    dirs.make_dir(sim_config.family_dir)
+    dirs.copy_files_from_dir_to_dir(config.family_dir, sim_config.family_dir)
+
+    executor = SimulatedExecutor(config=sim_config,
+                                 history=history,
+                                 rng=random.Random(settings.get('seed', 0)))
+    report = SimulationReport()
+
+    def tick(cfg):
+        now = MockDateTime.now(cfg.primary_tz)
+        executor.advance(now)
+        PyTfToken.update_token_usage(cfg)
+        cpu_start = time.process_time()
+        tick_status = main_function(cfg, executor)
+        report.record_tick(now, time.process_time() - cpu_start, tick_status)
+
+    try:
+        MockDateTime.set_mock(day.year, day.month, day.day, 0, 0, 0, config.primary_tz)
+        now = prepare_required_dirs(sim_config)
+        end_time = pytz.timezone(config.primary_tz).localize(datetime.datetime(year=now.year,
+                                                                               month=now.month,
+                                                                               day=now.day,
+                                                                               hour=config.end_time_hr,
+                                                                               minute=config.end_time_min))
+        logger.info(f"Simulating {yyyymmdd} until {end_time} in {sim_root}")
+        run_main_loop_until_end(sim_config, end_time, tick)
+        executor.advance(MockDateTime.now(config.primary_tz))
+        final_status = pytf_status(sim_config)
+    finally:
+        MockDateTime.reset_mock_now()
+        if not keep_dir:
+            shutil.rmtree(sim_root, ignore_errors=True)
+
+    result = report.as_dict(executor, final_status)
+    result['date'] = yyyymmdd
+    return result
+
+
+def load_historical_runs(config: Config, day: datetime.datetime, num_days: int) -> dict:
+    """
+    Collect (duration, error_code) samples per family::job from the dated log dirs (or their
+    archives) before `day`.
+    Only completed runs that recorded an end_time are used.
+
+    :return: dict of "family::job" -> [(duration_seconds, error_code)]
+    """
+    history = {}
+    if config.log_dir is None or not os.path.exists(config.log_dir):
+        return history
+
+    for days_back in range(1, num_days + 1):
+        yyyymmdd = (day - datetime.timedelta(days=days_back)).strftime("%Y%m%d")
+        for file_name in archive.list_day_files(config, yyyymmdd):
+            if not file_name.endswith(('.info', runs.RUNS_SUFFIX)):
+                continue
+            for info in runs.records_in_day_file(file_name, archive.read_day_file(config, yyyymmdd, file_name)):
+                if info.get('error_code') is None or info.get('end_time') is None:
+                    continue
+                tz = pytz.timezone(info['tz'])
+                start = tz.localize(datetime.datetime.strptime(info['start_time'], INFO_TIME_FORMAT))
+                end = tz.localize(datetime.datetime.strptime(info['end_time'], INFO_TIME_FORMAT))
+                key = f"{info['family_name']}::{_base_job_name(info['job_name'])}"
+                history.setdefault(key, []).append((int((end - start).total_seconds()), int(info['error_code'])))
+
+    return history
+
+
+def _sample_duration(rng: random.Random, duration) -> int:
+    # either a fixed number of seconds, or a [min, max] range
+    if isinstance(duration, list):
+        return rng.randint(int(duration[0]), int(duration[1]))
+    return int(duration)
+
+
+def _write_info(info_path: str, doc: tomlkit.TOMLDocument):
+    if info_path.endswith(runs.RUNS_SUFFIX):
+        runs.append(info_path, dict(doc))
+        return
+    job_info.write(info_path, doc)
+
+
+def _read_info(info_path: str, job_name: str) -> tomlkit.TOMLDocument:
+    if info_path.endswith(runs.RUNS_SUFFIX):
+        doc = tomlkit.document()
+        doc.update(runs.instances(info_path)[job_name])
+        return doc
+    return job_info.read(info_path)
@@ -1,4 +1,5 @@
 import datetime
+import logging
 import os.path
 
 import tomlkit
@@ -9,10 +10,14 @@ import pytf.dirs as dirs
 from .family import Family, get_families_from_dir
 from .job_result import JobResult, serializer
 from .job_status import JobStatus
-from .logs import get_logged_job_results, get_held_jobs, get_released_jobs
+from .logs import get_logged_job_results, get_held_jobs, get_released_jobs, get_queued_jobs
+import pytf.logs as logs
 from .mockdatetime import MockDateTime
 from .runner import prepare_required_dirs
 from .pytftoken import PyTfToken
+import pytf.tick_stats as tick_stats
+import pytf.limits as limits
+import pytf.token_allocation as token_allocation
 
 
 def status(config: Config, dt: datetime.datetime = None):
@@ -20,58 +25,105 @@ def status(config: Config, dt: datetime.datetime = None):
     return status
 
 
-def status_and_families_and_token_doc(config: Config, dt: datetime.datetime = None):
-    return _status_helper(config, dt)
+def status_and_families_and_token_doc(config: Config, dt: datetime.datetime = None, save_tokens: bool = False):
+    """
+    :param save_tokens: Grant tokens and save the token document while holding the token lock,
+                        so that schedulers sharing the root can't grant the same instance twice.
+                        Only the scheduler does; it also drops .queued markers older than
+                        queued_timeout first, so those jobs are Ready again.
+    """
+    return _status_helper(config, dt, save_tokens)
 
 
-def _status_helper(config: Config, dt: datetime.datetime = None):
+def _status_helper(config: Config, dt: datetime.datetime = None, save_tokens: bool = False):
     if dt is None:
         dt = MockDateTime.now(config.primary_tz)
 
     result = {"status": {"flat_list": [], "family": {}}}
 
     prepare_required_dirs(config)
+    if save_tokens:
+        _remove_stale_queued(config)
     new_token_doc = tomlkit.TOMLDocument()
 
     # To see what's run, don't consult families. Things might have changed.
     # Look at the log dir
     log_dir_to_examine = config.todays_log_dir
 
-    all_families: [Family] = get_families_from_dir(config.todays_family_dir, config)
+    with tick_stats.phase(tick_stats.PHASE_FAMILY_PARSE):
+        all_families: [Family] = get_families_from_dir(config.todays_family_dir, config)
 
-    # only include families that will run today
-    families = [f for f in all_families if f.will_family_run_today()]
+        # only include families that will run today
+        families = [f for f in all_families if f.will_family_run_today()]
 
     _get_status(config, families, log_dir_to_examine, result)
 
-    # convert ready to token wait if necessary
-    token_doc = PyTfToken.current_token_document(config)
-    for job_result_dict in result['status']['flat_list']:
-        if job_result_dict['status'] == 'Ready':
-            if tokens := job_result_dict['tokens']:
-                new_token_doc = PyTfToken.consume_tokens_from_doc(config,
-                                                                  tokens,
-                                                                  token_doc,
-                                                                  job_result_dict['family_name'],
-                                                                  job_result_dict['job_name'])
-                if new_token_doc is not None:
-                    token_doc = new_token_doc
-                else:
-                    job_result_dict['status'] = 'Token Wait'
+    # convert ready to queue wait or token wait if necessary
+    with tick_stats.phase(tick_stats.PHASE_TOKEN_ACCOUNTING):
+        if save_tokens:
+            with PyTfToken.lock(config):
+                # free the tokens of jobs that finished or were lost since the last tick
+                PyTfToken._update_token_usage(config)
+                token_doc, granted = _grant_slots_and_tokens(config, result, save=True)
+                if granted:
+                    _keep_tokens_granted(config, result, token_doc)
+        else:
+            token_doc, _ = _grant_slots_and_tokens(config, result)
 
     return result, families, token_doc
 
 
+def _remove_stale_queued(config):
+    logger = logging.getLogger('pytf_logger')
+    stale_before = MockDateTime.now(config.primary_tz).timestamp() - config.queued_timeout
+    for family_name, job_name in logs.remove_stale_queued(config.todays_log_dir, stale_before):
+        logger.warning(f"{family_name}::{job_name} was sent over {config.queued_timeout}s ago and no worker "
+                       f"started it; it will be sent again")
+
+
+def _keep_tokens_granted(config, result, token_doc):
+    for family_name, job_name in PyTfToken.save_token_document(config, token_doc):
+        # another process took an instance first; try again next tick
+        for job_result_dict in result['status']['flat_list']:
+            if (job_result_dict['family_name'], job_result_dict['job_name']) == (family_name, job_name):
+                job_result_dict['status'] = 'Token Wait'
+
+
+def _free_queue_slots(config, flat_list) -> dict:
+    """
+    For each queue with a max_outstanding, how many more jobs it can take. Jobs the worker hasn't
+    started yet (Queued) count against the limit along with the ones it's running or retrying.
+    """
+    free = {str(queue_name): int(limit) for queue_name, limit in config.max_outstanding.items()}
+    for job_result_dict in flat_list:
+        if job_result_dict['queue_name'] in free and job_result_dict['status'] in ('Queued', 'Running', 'Retry Wait'):
+            free[job_result_dict['queue_name']] -= 1
+    return free
+
+
+def _grant_slots_and_tokens(config, result, save=False):
+    token_doc = PyTfToken.current_token_document(config)
+    free_slots = _free_queue_slots(config, result['status']['flat_list'])
+    now = MockDateTime.now(config.primary_tz).timestamp()
+    granted = token_allocation.allocate(config, result['status']['flat_list'], token_doc, free_slots, now, save)
+    return token_doc, granted
+
+
 def _get_status(config, families, log_dir, result):
-    logged_jobs_list, logged_jobs_dict = get_logged_job_results(log_dir)
-    held_jobs = get_held_jobs(log_dir)
-    released_jobs = get_released_jobs(log_dir)
+    with tick_stats.phase(tick_stats.PHASE_LOG_SCAN):
+        # The worker removes a job's .queued file after writing its .info file, so look for
+        # .queued files first: a job that starts in between is then seen by one or the other.
+        queued_jobs = get_queued_jobs(log_dir)
+        logged_jobs_list, logged_jobs_dict = get_logged_job_results(log_dir)
+        held_jobs = get_held_jobs(log_dir)
+        released_jobs = get_released_jobs(log_dir)
 
-    for family in families:
-        _get_family_status(config, family, logged_jobs_dict, held_jobs, released_jobs, result)
+    with tick_stats.phase(tick_stats.PHASE_DEPENDENCY_EVAL):
+        for family in families:
+            _get_family_status(config, family, logged_jobs_dict, held_jobs, released_jobs, queued_jobs, result)
 
 
-def _get_family_status(config, family, logged_jobs_dict, held_jobs, released_jobs, result):
+def _get_family_status(config, family, logged_jobs_dict, held_jobs, released_jobs, queued_jobs, result):
     result['status']['family'][family.name] = []
 
     def coalesce(*args):
@@ -89,6 +141,7 @@ def _get_family_status(config, family, logged_jobs_dict, held_jobs, released_job
                         logged_jobs_dict=logged_jobs_dict,
                         held_jobs=held_jobs,
                         released_jobs=released_jobs,
+                        queued_jobs=queued_jobs,
                         job_queue=job_queue,
                         job_tz=job_tz,
                         job_num_retries=job_num_retries,
@@ -101,6 +154,7 @@ def _get_job_status(family,
                     logged_jobs_dict,
                     held_jobs,
                     released_jobs,
+                    queued_jobs,
                     job_queue,
                     job_tz,
                     job_num_retries,
@@ -118,7 +172,15 @@ def _get_job_status(family,
             released_jobs.get(family_name) and released_jobs[family_name].get(job_name)
         )
 
-        job_status = JobStatus.RELEASED if released else JobStatus.HOLD if held else JobStatus.WAITING if unmet else JobStatus.READY
+        queued = bool(
+            queued_jobs.get(family_name) and queued_jobs[family_name].get(job_name)
+        )
+
+        if queued:
+            # sent to the broker, but the worker hasn't started it yet
+            job_status = JobStatus.QUEUED
+        else:
+            job_status = JobStatus.RELEASED if released else JobStatus.HOLD if held else JobStatus.WAITING if unmet else JobStatus.READY
 
         the_job_result = JobResult(family_name=family_name,
                                    job_name=job_name,
@@ -127,9 +189,15 @@ def _get_job_status(family,
                                    tz=job_tz,
                                    num_retries=job_num_retries,
                                    retry_sleep=job_retry_sleep,
-                                   tokens=family.jobs_by_name[job_name].tokens)
+                                   tokens=family.jobs_by_name[job_name].tokens,
+                                   warm_python=bool(family.jobs_by_name[job_name].warm_python),
+                                   inputs=family.jobs_by_name[job_name].inputs,
+                                   outputs=family.jobs_by_name[job_name].outputs,
+                                   limits=limits.for_job(family, family.jobs_by_name[job_name]) or None,
+                                   base_name=family.jobs_by_name[job_name].base_name or None)
         # noinspection PyTypeChecker
         job_result_dict = asdict(the_job_result, value_serializer=serializer)
 
     result['status']['flat_list'].append(job_result_dict)
     result['status']['family'][family_name].append(job_result_dict)
+    tick_stats.count(tick_stats.COUNTER_JOBS_EVALUATED)
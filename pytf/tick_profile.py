@@ -0,0 +1,328 @@
+"""
+`pytf profile`: where the scheduler's ticks spend their time and memory, on a copy of the root.
+
+The families, the state in today's log dir (not the job logs) and the token leases are copied
+into a scratch root, and the ticks run there with an executor that sends nothing, so nothing
+under the real root is written and no job runs. Pending instructions aren't applied, and webhooks and email are off. A job
+that's dispatched is put back as if it hadn't been sent, so each tick sees the same day.
+
+The ticks run twice: under cProfile, with a sampler recording the scheduler thread's stack every
+SAMPLE_INTERVAL seconds, then under tracemalloc, which would otherwise slow the first run down.
+Samples are tagged with the tick phase they were taken in (see tick_stats.py). The output dir
+gets:
+
+- hotspots.txt: functions by cumulative and by own time, with the phase each mostly ran in
+- stacks.folded: collapsed stacks for flamegraph.pl or speedscope, under a root frame per phase
+- allocations.txt: the lines holding the most memory at the end of a tick, what a tick kept
+  that the one before it didn't, and the peak traced memory in each phase
+- profile.pstats: the cProfile data, for pstats or snakeviz
+"""
+import cProfile
+import collections
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import threading
+import tracemalloc
+
+import attrs
+from attrs import define, field
+
+import pytf.dirs as dirs
+import pytf.events as events
+import pytf.logs as logs
+import pytf.pytf_logging as pytf_logging
+import pytf.tick_stats as tick_stats
+import pytf.token_allocation as token_allocation
+from .config import Config
+from .main import main_function
+from .pytftoken import PyTfToken
+from .runner import prepare_required_dirs
+from .runs import RUNS_SUFFIX
+
+# What a tick reads from the day's log dir. Job logs can be gigabytes, so they aren't copied.
+STATE_SUFFIXES = (".info", RUNS_SUFFIX, ".hold", ".release", ".queued", ".claim")
+
+SAMPLE_INTERVAL = 0.005
+
+# the phase of a sample taken between phases
+NO_PHASE = "other"
+
+TRACEMALLOC_FRAMES = 1
+
+# the main loop's, so end_tick only warns about the ticks it would
+SLEEP_INTERVAL = 10
+
+
+class DryRunExecutor:
+    """
+    Sends nothing. The job's .queued marker and token leases are removed, so the next tick sees
+    it as ready again.
+    """
+    def __init__(self, config: Config):
+        self.config = config
+
+    def apply_async(self, args, queue):
+        logs.remove_queued(args[0], args[3], args[4])
+        PyTfToken.release_job(self.config, args[3], args[4])
+
+
+@define
+class StackSampler:
+    """
+    Samples another thread's stack from a thread of its own, up to the frame running top_code.
+    """
+    thread_id: int
+    top_code: object
+    interval: float = field(default=SAMPLE_INTERVAL)
+    memory: bool = field(default=False)
+    # "phase:name;outer;...;inner" -> samples
+    stacks: collections.Counter = field(factory=collections.Counter)
+    samples_by_phase: collections.Counter = field(factory=collections.Counter)
+    # (filename, first line, function) -> {phase: samples}, for any frame in the stack
+    phases_by_function: dict = field(factory=lambda: collections.defaultdict(collections.Counter))
+    # (filename, line) -> {phase: samples}, when memory is True
+    phases_by_line: dict = field(factory=lambda: collections.defaultdict(collections.Counter))
+    peak_by_phase: dict = field(factory=dict)
+    _stop: threading.Event = field(factory=threading.Event)
+    _thread: threading.Thread | None = field(default=None)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name="pytf-profile-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        phase = tick_stats.current_phase() or NO_PHASE
+        names = []
+        functions = set()
+        lines = set()
+        while frame is not None:
+            code = frame.f_code
+            if code is self.top_code:
+                break
+            names.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_qualname}")
+            functions.add((code.co_filename, code.co_firstlineno, code.co_name))
+            if self.memory:
+                lines.add((code.co_filename, frame.f_lineno))
+            frame = frame.f_back
+        else:
+            # not in a tick
+            return
+        names.append(f"phase:{phase}")
+        self.stacks[";".join(reversed(names))] += 1
+        self.samples_by_phase[phase] += 1
+        for function in functions:
+            self.phases_by_function[function][phase] += 1
+        if self.memory:
+            for line in lines:
+                self.phases_by_line[line][phase] += 1
+            current, _ = tracemalloc.get_traced_memory()
+            self.peak_by_phase[phase] = max(self.peak_by_phase.get(phase, 0), current)
+
+
+def profile(config: Config, num_ticks: int, out_dir: str, top: int = 40) -> dict:
+    """
+    :param num_ticks: Ticks to run in each of the two runs
+    :param out_dir: Where to write the reports; created if it doesn't exist
+    :param top: Number of functions and lines in each table
+    :return: A summary, with the paths of the reports
+    """
+    dirs.make_dir_if_necessary(out_dir)
+    paths = {name: os.path.join(out_dir, name)
+             for name in ("hotspots.txt", "stacks.folded", "allocations.txt", "profile.pstats")}
+
+    profiler = cProfile.Profile()
+    cpu_run = _run_ticks(config, num_ticks, profiler=profiler)
+    stats = pstats.Stats(profiler)
+    stats.dump_stats(paths["profile.pstats"])
+    with open(paths["stacks.folded"], "w") as f:
+        f.writelines(f"{stack} {count}\n" for stack, count in sorted(cpu_run['sampler'].stacks.items()))
+    with open(paths["hotspots.txt"], "w") as f:
+        f.write(_hotspot_report(stats, cpu_run, top))
+
+    memory_run = _run_ticks(config, num_ticks, trace_memory=True)
+    with open(paths["allocations.txt"], "w") as f:
+        f.write(_allocation_report(memory_run, top))
+
+    return {
+        'ticks': num_ticks,
+        'tick_seconds': [round(tick.duration, 6) for tick in cpu_run['ticks']],
+        'phase_seconds': _mean_phase_seconds(cpu_run['ticks']),
+        'phase_samples': dict(cpu_run['sampler'].samples_by_phase),
+        'phase_peak_bytes': memory_run['sampler'].peak_by_phase,
+        'files': paths,
+    }
+
+
+def _run_ticks(config: Config, num_ticks: int, profiler: cProfile.Profile | None = None,
+               trace_memory: bool = False) -> dict:
+    scratch_root = tempfile.mkdtemp(prefix="pytf_profile_")
+    try:
+        scratch_config = _scratch_config(config, scratch_root)
+        pytf_logging.setup_logging(scratch_config.log_dir, config.json_log_batch)
+        executor = DryRunExecutor(scratch_config)
+        sampler = StackSampler(threading.get_ident(), _tick.__code__, memory=trace_memory)
+        ticks = []
+        result = {'sampler': sampler, 'ticks': ticks}
+        if trace_memory:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        try:
+            with sampler:
+                for _ in range(num_ticks):
+                    ticks.append(_tick(scratch_config, executor, profiler, trace_memory, result))
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+            pytf_logging.stop_logging()
+        return result
+    finally:
+        shutil.rmtree(scratch_root, ignore_errors=True)
+
+
+def _tick(config: Config, executor, profiler, trace_memory: bool, result: dict):
+    tick_stats.start_tick()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        with tick_stats.phase(tick_stats.PHASE_FAMILY_COPY):
+            dirs.copy_files_from_dir_to_dir(config.family_dir, config.todays_family_dir)
+        status = main_function(config, executor)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+    stats = tick_stats.end_tick(SLEEP_INTERVAL)
+    if trace_memory:
+        # while this tick's status is still held
+        snapshot = _snapshot()
+        result.setdefault('first_snapshot', snapshot)
+        result['last_snapshot'] = snapshot
+        result['peak_bytes'] = max(result.get('peak_bytes', 0), tracemalloc.get_traced_memory()[1])
+    del status
+    return stats
+
+
+def _snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ])
+
+
+def _scratch_config(config: Config, scratch_root: str) -> Config:
+    scratch_config = attrs.evolve(config,
+                                  log_dir=os.path.join(scratch_root, "logs"),
+                                  family_dir=os.path.join(scratch_root, "families"),
+                                  instructions_dir=None,
+                                  web_hook=None,
+                                  smtp_server=None,
+                                  run_local=False)
+    scratch_config.d = config.d
+    dirs.make_dir(scratch_config.log_dir)
+    dirs.make_dir(scratch_config.family_dir)
+    dirs.copy_files_from_dir_to_dir(config.family_dir, scratch_config.family_dir)
+    now = prepare_required_dirs(scratch_config)
+
+    todays_log_dir = dirs.dated_subdir(config.log_dir, now)
+    if os.path.isdir(todays_log_dir):
+        state_files = {token_allocation.WAITS_FILE, os.path.basename(events.seen_path(scratch_config))}
+        for file_name in os.listdir(todays_log_dir):
+            if file_name.endswith(STATE_SUFFIXES) or file_name in state_files:
+                shutil.copy2(os.path.join(todays_log_dir, file_name), scratch_config.todays_log_dir)
+    lease_dir = os.path.join(config.log_dir, "tokens")
+    if os.path.isdir(lease_dir):
+        shutil.copytree(lease_dir, os.path.join(scratch_config.log_dir, "tokens"))
+    return scratch_config
+
+
+def _mean_phase_seconds(ticks: [tick_stats.TickStats]) -> dict:
+    totals = collections.Counter()
+    for stats in ticks:
+        totals.update(stats.phases)
+    return {name: round(seconds / len(ticks), 6) for name, seconds in totals.items()} if ticks else {}
+
+
+def _dominant_phase(counts: collections.Counter | None) -> str:
+    if not counts:
+        return ""
+    phase, samples = counts.most_common(1)[0]
+    return f"{phase} {100 * samples / sum(counts.values()):.0f}%"
+
+
+def _function_label(function: (str, int, str)) -> str:
+    file_name, line, name = function
+    if file_name == "~":
+        # a builtin
+        return name
+    return f"{_short_path(file_name)}:{line}({name})"
+
+
+def _short_path(file_name: str) -> str:
+    for prefix in sorted(sys.path, key=len, reverse=True):
+        if prefix and file_name.startswith(prefix + os.sep):
+            return file_name[len(prefix) + 1:]
+    return file_name
+
+
+def _hotspot_report(stats: pstats.Stats, run: dict, top: int) -> str:
+    sampler: StackSampler = run['sampler']
+    ticks = run['ticks']
+    lines = [f"{len(ticks)} ticks, {sum(s.duration for s in ticks):.3f}s under cProfile, "
+             f"{sum(sampler.samples_by_phase.values())} samples every {sampler.interval * 1000:g}ms", ""]
+
+    lines.append("Mean seconds per tick by phase, and share of samples")
+    phase_seconds = _mean_phase_seconds(ticks)
+    total_samples = sum(sampler.samples_by_phase.values()) or 1
+    for phase in sorted(set(phase_seconds) | set(sampler.samples_by_phase),
+                        key=lambda p: -sampler.samples_by_phase.get(p, 0)):
+        share = 100 * sampler.samples_by_phase.get(phase, 0) / total_samples
+        lines.append(f"  {phase:20} {phase_seconds.get(phase, 0.0):10.6f}s {share:6.1f}%")
+
+    # (calls, primitive calls, own time, cumulative time, callers)
+    entries = list(stats.stats.items())
+    for title, sort_key in (("cumulative", lambda e: e[1][3]), ("own time", lambda e: e[1][2])):
+        lines += ["", f"Top {top} functions by {title}",
+                  f"  {'cumulative':>10} {'own':>10} {'calls':>10}  {'phase':18} function"]
+        for function, (_, calls, own, cumulative, _) in sorted(entries, key=sort_key, reverse=True)[:top]:
+            phase = _dominant_phase(sampler.phases_by_function.get(function))
+            lines.append(f"  {cumulative:10.4f} {own:10.4f} {calls:10}  {phase:18} {_function_label(function)}")
+    return "\n".join(lines) + "\n"
+
+
+def _allocation_report(run: dict, top: int) -> str:
+    sampler: StackSampler = run['sampler']
+    lines = [f"Peak traced memory: {run.get('peak_bytes', 0) / 1024:.1f} KiB", "",
+             "Peak traced memory by phase"]
+    for phase, peak in sorted(sampler.peak_by_phase.items(), key=lambda item: -item[1]):
+        lines.append(f"  {phase:20} {peak / 1024:12.1f} KiB")
+
+    def site(frame: tracemalloc.Frame) -> str:
+        phase = _dominant_phase(sampler.phases_by_line.get((frame.filename, frame.lineno)))
+        return f"{phase:18} {_short_path(frame.filename)}:{frame.lineno}"
+
+    last = run.get('last_snapshot')
+    if last is not None:
+        lines += ["", f"Top {top} lines by memory held at the end of the last tick",
+                  f"  {'KiB':>10} {'blocks':>8}  {'phase':18} line"]
+        for statistic in last.statistics('lineno')[:top]:
+            lines.append(f"  {statistic.size / 1024:10.1f} {statistic.count:8}  {site(statistic.traceback[0])}")
+
+        lines += ["", f"Top {top} lines by memory kept since the end of the first tick",
+                  f"  {'KiB':>10} {'blocks':>8}  {'phase':18} line"]
+        for diff in last.compare_to(run['first_snapshot'], 'lineno')[:top]:
+            if diff.size_diff <= 0:
+                break
+            lines.append(f"  {diff.size_diff / 1024:10.1f} {diff.count_diff:8}  {site(diff.traceback[0])}")
+    return "\n".join(lines) + "\n"
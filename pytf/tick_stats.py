@@ -0,0 +1,166 @@
+import collections
+import contextlib
+import json
+import logging
+import os
+import time
+
+from attrs import define, field, asdict
+
+TICK_STATS_FILE = "tick_stats.jsonl"
+RING_BUFFER_SIZE = 360  # an hour of 10-second ticks
+
+PHASE_FAMILY_COPY = "family_copy"
+PHASE_INSTRUCTIONS = "instructions"
+PHASE_FAMILY_PARSE = "family_parse"
+PHASE_LOG_SCAN = "log_scan"
+PHASE_DEPENDENCY_EVAL = "dependency_eval"
+PHASE_TOKEN_ACCOUNTING = "token_accounting"
+PHASE_DISPATCH = "dispatch"
+
+COUNTER_FILES_PARSED = "files_parsed"
+COUNTER_INFO_FILES_READ = "info_files_read"
+COUNTER_JOBS_EVALUATED = "jobs_evaluated"
+COUNTER_JOBS_DISPATCHED = "jobs_dispatched"
+COUNTER_TOKENS_GRANTED = "tokens_granted"
+
+
+@define
+class TickStats:
+    """
+    Timings (in seconds) and counters for one pass of the main loop.
+    overrun is how far the tick ran past the loop's sleep interval.
+    """
+    started: float
+    phases: dict = field(factory=dict)
+    counters: dict = field(factory=dict)
+    duration: float = field(default=0.0)
+    sleep_interval: float = field(default=0.0)
+    overrun: float = field(default=0.0)
+
+
+_ring_buffer: collections.deque = collections.deque(maxlen=RING_BUFFER_SIZE)
+_current: TickStats | None = None
+_current_perf_start: float = 0.0
+_lines_saved: dict[str, int] = {}
+# the phases the current tick is in, innermost last
+_open_phases: list[str] = []
+
+
+def start_tick() -> TickStats:
+    global _current, _current_perf_start
+    _current = TickStats(started=time.time())
+    _current_perf_start = time.perf_counter()
+    return _current
+
+
+def end_tick(sleep_interval: float) -> TickStats | None:
+    global _current
+    stats = _current
+    if stats is None:
+        return None
+    _current = None
+
+    stats.duration = time.perf_counter() - _current_perf_start
+    stats.sleep_interval = sleep_interval
+    stats.overrun = max(0.0, stats.duration - sleep_interval)
+    _ring_buffer.append(stats)
+
+    logger = logging.getLogger('pytf_logger')
+    logger.info(f"Tick took {stats.duration:.3f}s", extra={"tick_stats": asdict(stats)})
+    if stats.overrun:
+        logger.warning(f"Tick overran the {sleep_interval}s sleep interval by {stats.overrun:.3f}s")
+    return stats
+
+
+@contextlib.contextmanager
+def phase(name: str):
+    """
+    Time the enclosed block and add it to the current tick's phase total.
+    Outside of a tick (e.g. a CLI status call) this only costs a None check.
+    """
+    if _current is None:
+        yield
+        return
+    stats = _current
+    start = time.perf_counter()
+    _open_phases.append(name)
+    try:
+        yield
+    finally:
+        _open_phases.pop()
+        stats.phases[name] = stats.phases.get(name, 0.0) + time.perf_counter() - start
+
+
+def current_phase() -> str | None:
+    """
+    The innermost phase the current tick is in. Safe to call from another thread.
+    """
+    open_phases = _open_phases[-1:]
+    return open_phases[0] if open_phases else None
+
+
+def count(name: str, n: int = 1):
+    if _current is not None:
+        _current.counters[name] = _current.counters.get(name, 0) + n
+
+
+def recent(n: int | None = None) -> [dict]:
+    ticks = [asdict(stats) for stats in _ring_buffer]
+    return ticks if n is None else ticks[-n:]
+
+
+def reset():
+    global _current
+    _current = None
+    _open_phases.clear()
+    _ring_buffer.clear()
+    _lines_saved.clear()
+
+
+def stats_path(log_dir: str, shard: str | None = None) -> str:
+    """
+    Schedulers sharing a log dir (see sharding.py) each keep their own file.
+    """
+    if shard is None:
+        return os.path.join(log_dir, TICK_STATS_FILE)
+    return os.path.join(log_dir, f"tick_stats.{shard}.jsonl")
+
+
+def save(log_dir: str, shard: str | None = None):
+    """
+    Publish the ring buffer for the CLI and the web app, which run in other processes.
+    The latest tick is appended as one JSON line. Once the file holds twice the ring buffer,
+    it's rewritten from the ring buffer, so each tick costs one small write on average.
+    """
+    if not _ring_buffer:
+        return
+    path = stats_path(log_dir, shard)
+    lines_saved = _lines_saved.get(path)
+
+    if lines_saved is None or lines_saved >= 2 * RING_BUFFER_SIZE or not os.path.exists(path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.writelines(json.dumps(tick) + "\n" for tick in recent())
+        os.replace(tmp_path, path)
+        _lines_saved[path] = len(_ring_buffer)
+        return
+
+    with open(path, "a") as f:
+        f.write(json.dumps(asdict(_ring_buffer[-1])) + "\n")
+    _lines_saved[path] = lines_saved + 1
+
+
+def load(log_dir: str, shard: str | None = None) -> [dict]:
+    path = stats_path(log_dir, shard)
+    if not os.path.exists(path):
+        return []
+    ticks = []
+    with open(path) as f:
+        for line in f:
+            try:
+                ticks.append(json.loads(line))
+            except json.JSONDecodeError:
+                # the scheduler is in the middle of appending this line
+                break
+    return ticks[-RING_BUFFER_SIZE:]
@@ -0,0 +1,166 @@
+"""
+The order in which a tick hands out tokens and queue slots to the jobs that could be dispatched.
+
+Going through flat_list in order meant the family whose name sorted first always won under
+contention. Instead:
+
+- Families in a higher token_priorities class go first.
+- Within a class, families take turns by weighted fair share: the next job comes from the
+  family holding the fewest tokens per unit of its token_weights weight, counting what it was
+  granted earlier in the same tick.
+- Waiting earns priority: every token_aging seconds a job has waited counts as one token fewer
+  held by its family, so a job from a busy family is never passed over for good.
+- A job that has waited token_reserve_after seconds and still can't get all of its tokens
+  reserves the free ones, so jobs after it can't take them. Otherwise a job that needs several
+  instances of a token could wait forever behind jobs that need one.
+
+When each job started waiting is kept in the day's log dir, so a restarted scheduler doesn't
+reset its aging.
+"""
+import collections
+import heapq
+import json
+import logging
+import os
+
+import tomlkit
+
+from .config import Config
+import pytf.metrics as metrics
+import pytf.tick_stats as tick_stats
+
+WAITS_FILE = "token_waits.json"
+
+
+def allocate(config: Config, flat_list: [dict], token_doc, free_slots: dict, now: float, save: bool = False) -> bool:
+    """
+    Ready and released jobs whose queue is full become Queue Wait. Ready jobs that get a slot
+    but not their tokens become Token Wait and leave the slot to the next job. Granted tokens
+    are added to token_doc.
+
+    :param free_slots: queue name -> jobs it can still take, for queues with a max_outstanding
+    :param now: epoch seconds
+    :param save: Save when each job started waiting. Only the scheduler does, not status calls,
+                 and it holds PyTfToken.lock while it does.
+    :return: True if any tokens were granted
+    """
+    logger = logging.getLogger('pytf_logger')
+    candidates = [(index, job) for index, job in enumerate(flat_list) if job['status'] in ('Ready', 'Released')]
+
+    waits_path = os.path.join(config.todays_log_dir, WAITS_FILE)
+    old_waits = _load_waits(waits_path)
+    waits = {_key(job): old_waits.get(_key(job), now) for _, job in candidates}
+
+    held_tokens = token_doc.get('token', [])
+    in_use = collections.Counter(str(token['token_name']) for token in held_tokens)
+    held_by_family = collections.Counter(str(token['family_name']) for token in held_tokens)
+    reserved = collections.Counter()
+
+    by_family = {}
+    for index, job in candidates:
+        by_family.setdefault(job['family_name'], []).append((waits[_key(job)], index, job))
+    for jobs in by_family.values():
+        # oldest first, then in flat_list order
+        jobs.sort(key=lambda entry: entry[:2], reverse=True)
+
+    def sort_key(family_name):
+        waited_since, index, _ = by_family[family_name][-1]
+        share = held_by_family[family_name] / _weight(config, family_name)
+        return -_priority(config, family_name), share - (now - waited_since) / _aging(config), index
+
+    heap = [(sort_key(family_name), family_name) for family_name in by_family]
+    heapq.heapify(heap)
+
+    granted = False
+    while heap:
+        _, family_name = heapq.heappop(heap)
+        waited_since, _, job = by_family[family_name].pop()
+
+        queue_name = job['queue_name']
+        if free_slots.get(queue_name, 1) <= 0:
+            job['status'] = 'Queue Wait'
+        elif job['status'] == 'Ready' and (tokens := job['tokens']):
+            needed = collections.Counter(tokens)
+            unknown = [name for name in needed if config.tokens_by_name.get(name) is None]
+            if unknown:
+                logger.error(f"Unknown Token: {unknown[0]}")
+                job['status'] = 'Token Wait'
+            elif all(in_use[name] + reserved[name] + n <= config.tokens_by_name[name].num_instances
+                     for name, n in needed.items()):
+                aot = _token_aot(token_doc)
+                for name in tokens:
+                    table = tomlkit.table()
+                    table['token_name'] = name
+                    table['family_name'] = job['family_name']
+                    table['job_name'] = job['job_name']
+                    aot.append(table)
+                    if save:
+                        metrics.observe_token_wait(name, now - waited_since)
+                in_use.update(needed)
+                held_by_family[family_name] += len(tokens)
+                granted = True
+                tick_stats.count(tick_stats.COUNTER_TOKENS_GRANTED, len(tokens))
+            else:
+                job['status'] = 'Token Wait'
+                if now - waited_since >= config.token_reserve_after:
+                    for name, n in needed.items():
+                        free = config.tokens_by_name[name].num_instances - in_use[name] - reserved[name]
+                        reserved[name] += max(0, min(n, free))
+
+        if job['status'] in ('Ready', 'Released'):
+            if queue_name in free_slots:
+                free_slots[queue_name] -= 1
+            # dispatched, so it's no longer waiting
+            del waits[_key(job)]
+
+        if by_family[family_name]:
+            # the family's next job gets back in line with the family's new share
+            heapq.heappush(heap, (sort_key(family_name), family_name))
+
+    if save:
+        # Schedulers sharing a root share the file, and flat_list only has this one's
+        # families, so leave the other schedulers' jobs alone. The caller holds
+        # PyTfToken.lock, so nobody else writes it between the load and the save.
+        ours = {_key(job) for job in flat_list}
+        merged = {key: since for key, since in old_waits.items() if key not in ours}
+        merged.update(waits)
+        if merged != old_waits:
+            _save_waits(waits_path, merged)
+    return granted
+
+
+def _key(job: dict) -> str:
+    return f"{job['family_name']}::{job['job_name']}"
+
+
+def _weight(config: Config, family_name: str) -> float:
+    return float(config.token_weights.get(family_name, 1))
+
+
+def _priority(config: Config, family_name: str) -> int:
+    return int(config.token_priorities.get(family_name, 0))
+
+
+def _aging(config: Config) -> float:
+    return float(config.token_aging) or 1.0
+
+
+def _token_aot(token_doc):
+    if 'token' not in token_doc:
+        token_doc.append('token', tomlkit.aot())
+    return token_doc['token']
+
+
+def _load_waits(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_waits(path: str, waits: dict):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(waits, f)
+    os.replace(tmp_path, path)
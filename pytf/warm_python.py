@@ -0,0 +1,220 @@
+"""
+A forkserver for Python job scripts.
+
+The worker starts one server per worker process with `python -m pytf.warm_python`. The
+server imports the modules in PYTF_WARM_PYTHON_PRELOAD (comma separated, e.g. "pandas,numpy")
+once, then forks a fresh child for each job and runs the script there with runpy, so jobs
+skip interpreter startup and those imports. Nothing a job does survives into the next one.
+
+For each job the worker sends the script path plus three descriptors over a SOCK_SEQPACKET
+socket: the write ends of the job's stdout and stderr pipes, and a reply socket. The server
+forks a waiter, the waiter forks the job, reports the job's pid, waits for it and reports
+its exit status. WarmProcess wraps all that in the parts of Popen that poll_process uses.
+"""
+import importlib
+import json
+import os
+import runpy
+import select
+import signal
+import socket
+import subprocess
+import sys
+import traceback
+
+PRELOAD_ENV = "PYTF_WARM_PYTHON_PRELOAD"
+MAX_MESSAGE = 65536
+
+_server: subprocess.Popen | None = None
+_control: socket.socket | None = None
+
+
+def is_python_script(script_path: str) -> bool:
+    if script_path.endswith(".py"):
+        return True
+    try:
+        with open(script_path, "rb") as f:
+            first_line = f.readline(256)
+    except OSError:
+        return False
+    return first_line.startswith(b"#!") and b"python" in first_line
+
+
+class WarmProcess:
+    """
+    The subset of subprocess.Popen that the worker uses: pid, stdout, stderr, poll() and wait().
+    returncode matches what the shell reports for the same script: the exit code, or 128+N if
+    the job was killed by signal N.
+    """
+    def __init__(self, pid: int, stdout, stderr, reply: socket.socket):
+        self.pid = pid
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+        self._reply = reply
+        self._buffer = b""
+
+    def poll(self):
+        if self.returncode is None and select.select([self._reply], [], [], 0)[0]:
+            self._read_exit()
+        return self.returncode
+
+    def wait(self):
+        while self.returncode is None:
+            self._read_exit()
+        return self.returncode
+
+    def _read_exit(self):
+        chunk = self._reply.recv(64)
+        if not chunk:
+            # the waiter died without reporting, e.g. the server was killed
+            self.returncode = 128 + signal.SIGKILL
+        else:
+            self._buffer += chunk
+            if not self._buffer.endswith(b"\n"):
+                return
+            self.returncode = int(self._buffer.split()[-1])
+        self._reply.close()
+
+
+def start(script_path: str) -> WarmProcess:
+    try:
+        return _start(script_path)
+    except (BrokenPipeError, ConnectionResetError, ConnectionRefusedError):
+        # the server went away; start a new one and try once more
+        shutdown()
+        return _start(script_path)
+
+
+def shutdown():
+    global _server, _control
+    if _control is not None:
+        _control.close()
+    if _server is not None:
+        _server.wait()
+    _server = _control = None
+
+
+def _start(script_path: str) -> WarmProcess:
+    control = _ensure_server()
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    reply, server_reply = socket.socketpair()
+    try:
+        socket.send_fds(control, [json.dumps({"script": script_path}).encode()], [out_w, err_w, server_reply.fileno()])
+    finally:
+        os.close(out_w)
+        os.close(err_w)
+        server_reply.close()
+
+    pid_line = b""
+    while not pid_line.endswith(b"\n"):
+        chunk = reply.recv(64)
+        if not chunk:
+            raise ConnectionResetError("warm python server didn't start the job")
+        pid_line += chunk
+    return WarmProcess(int(pid_line), os.fdopen(out_r, "rb"), os.fdopen(err_r, "rb"), reply)
+
+
+def _ensure_server() -> socket.socket:
+    global _server, _control
+    if _server is not None and _server.poll() is None:
+        return _control
+    shutdown()
+    _control, server_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_parent, env.get('PYTHONPATH')]))
+    _server = subprocess.Popen([sys.executable, "-m", "pytf.warm_python", str(server_end.fileno())],
+                               pass_fds=[server_end.fileno()],
+                               stdin=subprocess.DEVNULL,
+                               env=env)
+    server_end.close()
+    return _control
+
+
+# Server side
+
+def serve(control: socket.socket):
+    for module_name in filter(None, os.environ.get(PRELOAD_ENV, "").split(",")):
+        try:
+            importlib.import_module(module_name.strip())
+        except ImportError as e:
+            print(f"warm python: couldn't preload {module_name}: {e}", file=sys.stderr)
+
+    # waiters are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    while True:
+        try:
+            message, fds, _, _ = socket.recv_fds(control, MAX_MESSAGE, 3)
+        except ConnectionResetError:
+            return
+        if not message:
+            # the worker closed its end
+            return
+        sys.stdout.flush()
+        sys.stderr.flush()
+        if os.fork() == 0:
+            control.close()
+            _wait_for_job(json.loads(message)['script'], *fds)
+        for fd in fds:
+            os.close(fd)
+
+
+def _wait_for_job(script_path: str, out_w: int, err_w: int, reply_fd: int):
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    reply = socket.socket(fileno=reply_fd)
+    pid = os.fork()
+    if pid == 0:
+        reply.close()
+        _run_job(script_path, out_w, err_w)
+    os.close(out_w)
+    os.close(err_w)
+    reply.sendall(f"{pid}\n".encode())
+    _, status = os.waitpid(pid, 0)
+    exit_code = os.waitstatus_to_exitcode(status)
+    if exit_code < 0:
+        # what `sh -c script` reports when the script is killed
+        exit_code = 128 - exit_code
+    reply.sendall(f"exit {exit_code}\n".encode())
+    os._exit(0)
+
+
+def _run_job(script_path: str, out_w: int, err_w: int):
+    # like a job started by the shell, its own process group, so it can be stopped with everything it starts
+    os.setsid()
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(out_w, 1)
+    os.dup2(err_w, 2)
+    for fd in (devnull, out_w, err_w):
+        os.close(fd)
+    sys.stdin = open(0, closefd=False)
+    sys.stdout = open(1, "w", buffering=1, closefd=False)
+    sys.stderr = open(2, "w", buffering=1, closefd=False)
+    sys.argv = [script_path]
+    sys.path[0] = os.path.dirname(os.path.abspath(script_path))
+
+    exit_code = 0
+    try:
+        runpy.run_path(script_path, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code, int):
+            exit_code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+    try:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    finally:
+        os._exit(exit_code & 0xFF)
+
+
+if __name__ == "__main__":
+    serve(socket.socket(fileno=int(sys.argv[1])))
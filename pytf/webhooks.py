@@ -0,0 +1,223 @@
+"""
+Delivery of job events to Config.web_hook.
+
+The scheduler hands events to submit(), which only puts them on a bounded in-memory queue,
+so a slow or unreachable endpoint never holds up a tick. A background thread POSTs them in
+batches as {"events": [...]} over a keep-alive requests.Session, with hook_auth (if set) as
+the Authorization header. Failed batches are retried with exponential backoff.
+
+Events that don't fit in the queue, and anything still undelivered when the scheduler stops,
+are appended to a JSONL spool file in the log dir, one per shard. The spool is sent first the
+next time a sender starts. Delivery is at least once; receivers can use each event's id to drop repeats.
+
+requests is imported when the first sender starts, so a scheduler without a web_hook (and
+every other CLI command) doesn't pay for importing it.
+"""
+import atexit
+import contextlib
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+from .config import Config
+
+SPOOL_FILE = "webhook_spool.jsonl"
+MAX_QUEUE = 10000
+BATCH_SIZE = 100
+FLUSH_INTERVAL = 1.0
+REQUEST_TIMEOUT = 10.0
+INITIAL_BACKOFF = 1.0
+MAX_BACKOFF = 300.0
+
+_sender = None
+
+
+class WebhookSender:
+    def __init__(self,
+                 url: str,
+                 spool_path: str,
+                 auth: str | None = None,
+                 max_queue: int = MAX_QUEUE,
+                 batch_size: int = BATCH_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL,
+                 initial_backoff: float = INITIAL_BACKOFF,
+                 max_backoff: float = MAX_BACKOFF):
+        import requests
+
+        self.url = url
+        self.spool_path = spool_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.queue = queue.Queue(maxsize=max_queue)
+        self._request_exception = requests.RequestException
+        self.session = requests.Session()
+        self.session.headers['Content-Type'] = 'application/json'
+        if auth:
+            self.session.headers['Authorization'] = auth
+        self.delivered = 0
+        self.spooled = 0
+        self._spool_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._in_flight = []
+        self._thread = threading.Thread(target=self._run, name="pytf-webhooks", daemon=True)
+        self._thread.start()
+
+    def submit(self, events: [dict]):
+        """
+        Queue events for delivery without blocking. If the queue is full they go to the spool.
+        """
+        overflow = []
+        for event in events:
+            try:
+                self.queue.put_nowait(event)
+            except queue.Full:
+                overflow.append(event)
+        if overflow:
+            logging.getLogger('pytf_logger').warning(f"Webhook queue is full, spooling {len(overflow)} events")
+            self._spool(overflow)
+
+    def stop(self, timeout: float = 5.0):
+        """
+        Give the thread up to timeout seconds to send what's queued, then spool the rest.
+        """
+        self._stopping.set()
+        self._thread.join(timeout)
+        leftover = list(self._in_flight)
+        while True:
+            try:
+                leftover.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        self._in_flight = []
+        self._spool(leftover)
+        self.session.close()
+
+    def _run(self):
+        self._send_spool()
+        while not self._stopping.is_set() or not self.queue.empty():
+            batch = self._next_batch()
+            if batch and not self._deliver(batch):
+                # stopping with a batch that couldn't be sent; stop() spools it
+                return
+
+    def _next_batch(self) -> [dict]:
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0 or (self._stopping.is_set() and self.queue.empty()):
+                break
+            try:
+                batch.append(self.queue.get(timeout=min(timeout, 0.1)))
+            except queue.Empty:
+                continue
+        return batch
+
+    def _deliver(self, batch: [dict]) -> bool:
+        """
+        POST one batch, retrying until it's accepted or the sender is stopped.
+        A 4xx other than 408 and 429 means retrying won't help, so the batch is dropped.
+
+        :return: False if the sender was stopped before the batch was accepted
+        """
+        logger = logging.getLogger('pytf_logger')
+        self._in_flight = batch
+        backoff = self.initial_backoff
+        while True:
+            try:
+                response = self.session.post(self.url, data=json.dumps({"events": batch}), timeout=REQUEST_TIMEOUT)
+                if response.status_code < 300:
+                    self.delivered += len(batch)
+                    break
+                if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+                    logger.error(f"Webhook rejected {len(batch)} events with {response.status_code}; dropping them")
+                    break
+                problem = f"HTTP {response.status_code}"
+            except self._request_exception as e:
+                problem = str(e)
+            logger.warning(f"Webhook delivery failed ({problem}); retrying in {backoff:.1f}s")
+            if self._stopping.wait(backoff * random.uniform(0.5, 1.0)):
+                return False
+            backoff = min(backoff * 2, self.max_backoff)
+        self._in_flight = []
+        return True
+
+    def _spool(self, events: [dict]):
+        if not events:
+            return
+        with self._spool_lock, open(self.spool_path, "a") as f:
+            f.writelines(json.dumps(event) + "\n" for event in events)
+        self.spooled += len(events)
+
+    def _send_spool(self):
+        """
+        Send what earlier senders spooled. The file is renamed first so that events spooled
+        while it's being sent go to a new file.
+        """
+        sending_path = f"{self.spool_path}.sending"
+        with self._spool_lock:
+            if not os.path.exists(sending_path):
+                try:
+                    os.replace(self.spool_path, sending_path)
+                except FileNotFoundError:
+                    return
+        events = []
+        with open(sending_path) as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # e.g. cut short when the process writing it was killed
+                    logging.getLogger('pytf_logger').warning(
+                        f"Skipping unreadable line {line_number} of {sending_path}")
+        for start in range(0, len(events), self.batch_size):
+            if not self._deliver(events[start:start + self.batch_size]):
+                # stop() spools the batch in flight; keep the ones after it too
+                self._spool(events[start + self.batch_size:])
+                break
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(sending_path)
+
+
+def spool_path_for(log_dir: str, shard: str | None = None) -> str:
+    """
+    Schedulers sharing a log dir (see sharding.py) each keep their own spool.
+    """
+    if shard is None:
+        return os.path.join(log_dir, SPOOL_FILE)
+    return os.path.join(log_dir, f"webhook_spool.{shard}.jsonl")
+
+
+def sender_for(config: Config) -> WebhookSender | None:
+    """
+    The process's sender, started the first time it's needed. None if web_hook isn't set.
+    """
+    global _sender
+    if not config.web_hook:
+        return None
+    if _sender is None:
+        _sender = WebhookSender(url=config.web_hook,
+                                spool_path=spool_path_for(config.log_dir, config.shard),
+                                auth=config.hook_auth)
+        atexit.register(stop)
+    return _sender
+
+
+def submit(config: Config, events: [dict]):
+    if events and (sender := sender_for(config)) is not None:
+        sender.submit(events)
+
+
+def stop(timeout: float = 5.0):
+    global _sender
+    if _sender is not None:
+        _sender.stop(timeout)
+        _sender = None
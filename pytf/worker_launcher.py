@@ -0,0 +1,200 @@
+"""
+`pytf worker`: a Celery worker pool for each queue, sized from the queues table in the config.
+
+    [queues.default]
+    min_concurrency = 1
+    max_concurrency = 4
+    prefetch = 1        # tasks each process reserves ahead
+    acks_late = true    # acknowledge a task when it's done, so a lost worker's job is redelivered
+    max_load = 1.0      # don't grow while the 1-minute load average per CPU is above this
+
+Every queue that's in the config or used by a job in the family dir gets a pool, so jobs sent to
+a queue nobody listed still run. Undefined settings come from DEFAULT_QUEUE.
+
+Each pool is a `celery worker` process with pytf_worker.LoadAwareAutoscaler. Its concurrency
+follows the queue's backlog: the jobs the scheduler has sent to the queue that haven't started
+(their .queued markers in today's log dir) plus the ones the pool is running. It writes its state
+to log_dir/workers, where `pytf workers` shows it.
+"""
+import json
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import pytf.dirs as dirs
+import pytf.exceptions as ex
+from .config import Config
+from .family import get_families_from_dir
+from .mockdatetime import MockDateTime
+
+DEFAULT_QUEUE = {'min_concurrency': 1, 'max_concurrency': 1, 'prefetch': 1, 'acks_late': False, 'max_load': 1.0}
+
+# how the launcher tells a pool which queue it is
+ENV_QUEUE = "PYTF_WORKER_QUEUE"
+
+STATE_DIR = "workers"
+
+# a pool whose state is older than this has probably stopped
+STALE_SECONDS = 60
+
+RESTART_DELAY = 5
+
+
+def queue_settings(config: Config) -> dict:
+    """
+    :return: queue name -> its settings, DEFAULT_QUEUE overlaid with the config's, for every queue
+             in the config or used by a job
+    """
+    names = set(config.queues) | {'default'}
+    if config.family_dir is not None and os.path.isdir(config.family_dir):
+        for family in get_families_from_dir(config.family_dir, config):
+            names.update(job.queue for job in family.jobs_by_name.values() if job.queue)
+
+    settings = {}
+    for name in sorted(names):
+        queue = dict(DEFAULT_QUEUE)
+        for key, value in config.queues.get(name, {}).items():
+            if not _valid_setting(key, value):
+                raise ex.PyTaskforestParseException(f"{ex.MSG_CONFIG_INVALID_VALUE} queues.{name}.{key} = {value}")
+            queue[key] = value.unwrap() if hasattr(value, 'unwrap') else value
+        if not 0 <= queue['min_concurrency'] <= queue['max_concurrency'] or queue['max_concurrency'] < 1 \
+                or queue['prefetch'] < 1:
+            raise ex.PyTaskforestParseException(f"{ex.MSG_CONFIG_INVALID_VALUE} queues.{name} = {queue}")
+        settings[name] = queue
+    return settings
+
+
+def _valid_setting(key, value) -> bool:
+    if key not in DEFAULT_QUEUE:
+        return False
+    if isinstance(DEFAULT_QUEUE[key], bool):
+        return isinstance(value, bool)
+    if isinstance(value, bool):
+        return False
+    if isinstance(DEFAULT_QUEUE[key], float):
+        return isinstance(value, (int, float))
+    return isinstance(value, int)
+
+
+def celery_command(name: str, queue: dict) -> [str]:
+    return [sys.executable, "-m", "celery", "-A", "pytf.pytf_worker", "worker", "--loglevel=INFO",
+            "-Q", name,
+            "-n", f"{name}@%h",
+            f"--autoscale={queue['max_concurrency']},{queue['min_concurrency']}",
+            f"--prefetch-multiplier={queue['prefetch']}"]
+
+
+def launch(config: Config):
+    """
+    Start a pool per queue and keep them running until SIGTERM or SIGINT, which are passed on.
+    """
+    logger = logging.getLogger('pytf_logger')
+    settings = queue_settings(config)
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    pools = {}
+
+    def start(name):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_parent, env.get('PYTHONPATH')]))
+        env[ENV_QUEUE] = json.dumps(dict(settings[name], name=name, log_dir=config.log_dir,
+                                         primary_tz=config.primary_tz))
+        logger.info(f"Starting the {name} pool: {settings[name]}")
+        pools[name] = subprocess.Popen(celery_command(name, settings[name]), env=env)
+
+    stopping = []
+
+    def stop(signal_number, _):
+        stopping.append(signal_number)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for name in settings:
+        start(name)
+
+    while not stopping:
+        for name, process in list(pools.items()):
+            if (err := process.poll()) is not None and not stopping:
+                logger.error(f"The {name} pool exited with {err}; restarting it in {RESTART_DELAY}s")
+                time.sleep(RESTART_DELAY)
+                start(name)
+        time.sleep(1)
+
+    for process in pools.values():
+        process.send_signal(signal.SIGTERM)
+    for process in pools.values():
+        # Celery's warm shutdown waits for running jobs
+        process.wait()
+
+
+def waiting_jobs(log_dir: str, primary_tz: str, queue_name: str) -> int:
+    """
+    :return: How many jobs the scheduler has sent to queue_name that no worker has started
+    """
+    todays_log_dir = dirs.dated_subdir(log_dir, MockDateTime.now(primary_tz))
+    try:
+        file_names = [f for f in os.listdir(todays_log_dir) if f.endswith(".queued")]
+    except FileNotFoundError:
+        return 0
+    count = 0
+    for file_name in file_names:
+        try:
+            with open(os.path.join(todays_log_dir, file_name)) as f:
+                count += f.readline().strip() == queue_name
+        except FileNotFoundError:
+            # started while we were looking
+            continue
+    return count
+
+
+def target_concurrency(queue: dict, backlog: int, processes: int, load_per_cpu: float) -> int:
+    """
+    How many processes a pool should have: enough for its backlog, within its min and max, and
+    no more than it has now while the host is busier than max_load.
+    """
+    target = min(max(backlog, queue['min_concurrency']), queue['max_concurrency'])
+    if load_per_cpu > queue['max_load']:
+        target = min(target, max(processes, queue['min_concurrency']))
+    return target
+
+
+def load_per_cpu() -> float:
+    return os.getloadavg()[0] / (os.cpu_count() or 1)
+
+
+def state_path(log_dir: str, queue_name: str) -> str:
+    return os.path.join(log_dir, STATE_DIR, f"{socket.gethostname()}.{queue_name}.json")
+
+
+def save_state(log_dir: str, queue_name: str, state: dict):
+    path = state_path(log_dir, queue_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def load_states(log_dir: str) -> [dict]:
+    """
+    :return: The state of every pool, on every host, with stale = True if it hasn't reported lately
+    """
+    state_dir = os.path.join(log_dir, STATE_DIR)
+    try:
+        file_names = sorted(f for f in os.listdir(state_dir) if f.endswith(".json"))
+    except FileNotFoundError:
+        return []
+    now = time.time()
+    states = []
+    for file_name in file_names:
+        try:
+            with open(os.path.join(state_dir, file_name)) as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue
+        state['stale'] = now - state.get('updated', 0) > STALE_SECONDS
+        states.append(state)
+    return states
@@ -12,6 +12,8 @@ class Config:
         # do any other initialization here
         app.config['SECRET_KEY'] = os.getenv("PYTF_FLASK_SECRET_KEY")
         app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024
+        pytf_root = os.getenv("PYTF_ROOT", "/pytf_root")
+        app.config['PYTF_LOG_DIR'] = os.getenv("PYTF_LOG_DIR", os.path.join(pytf_root, "logs"))
 
 
 class DevelopmentConfig(Config):
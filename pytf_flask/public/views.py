@@ -0,0 +1,104 @@
+import os
+
+from flask import (
+    Response,
+    current_app,
+    jsonify,
+    request,
+    send_file,
+    stream_with_context,
+)
+
+import pytf.archive as archive
+import pytf.log_tail as log_tail
+import pytf.metrics as metrics
+from pytf.config import Config
+from pytf.exceptions import PyTaskforestParseException
+import pytf.tick_stats as tick_stats
+from . import public
+
+
+@public.route('/api/ticks')
+def ticks():
+    last = request.args.get('last', default=60, type=int)
+    shard = request.args.get('shard')
+    return jsonify(tick_stats.load(current_app.config['PYTF_LOG_DIR'], shard)[-last:])
+
+
+@public.route('/metrics')
+def prometheus_metrics():
+    registry = metrics.collect(metrics.metrics_dir_for(current_app.config['PYTF_LOG_DIR']))
+    return Response(registry.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@public.route('/api/log/<yyyymmdd>/<family>/<job>')
+def job_log(yyyymmdd, family, job):
+    config = Config.from_str("")
+    config.log_dir = current_app.config['PYTF_LOG_DIR']
+    try:
+        return jsonify(archive.job_files(config, yyyymmdd, family, job))
+    except PyTaskforestParseException as e:
+        return jsonify({"error": str(e)}), 400
+
+
+def _live_log_path(yyyymmdd, family, job):
+    path = log_tail.job_log_path(current_app.config['PYTF_LOG_DIR'], yyyymmdd, family, job)
+    return path if os.path.isfile(path) else None
+
+
+@public.route('/api/log/<yyyymmdd>/<family>/<job>/raw')
+def job_log_raw(yyyymmdd, family, job):
+    """
+    The log file itself. Range, If-Range, If-None-Match and If-Modified-Since are handled by
+    send_file, and the server can hand the file to sendfile() instead of copying it through Python.
+    """
+    try:
+        path = _live_log_path(yyyymmdd, family, job)
+    except PyTaskforestParseException as e:
+        return jsonify({"error": str(e)}), 400
+    if path is None:
+        return jsonify({"error": "Log not found"}), 404
+    return send_file(path, mimetype='text/plain', conditional=True, etag=True)
+
+
+@public.route('/api/log/<yyyymmdd>/<family>/<job>/lines')
+def job_log_lines(yyyymmdd, family, job):
+    start = request.args.get('start', default=0, type=int)
+    count = request.args.get('count', default=100, type=int)
+    try:
+        path = _live_log_path(yyyymmdd, family, job)
+    except PyTaskforestParseException as e:
+        return jsonify({"error": str(e)}), 400
+    if path is None:
+        return jsonify({"error": "Log not found"}), 404
+    return jsonify(log_tail.read_lines(path, start, count))
+
+
+@public.route('/api/log/<yyyymmdd>/<family>/<job>/tail')
+def job_log_tail(yyyymmdd, family, job):
+    offset = request.args.get('offset', default=0, type=int)
+    timeout = min(request.args.get('timeout', default=25.0, type=float), 60.0)
+    try:
+        path = _live_log_path(yyyymmdd, family, job)
+    except PyTaskforestParseException as e:
+        return jsonify({"error": str(e)}), 400
+    if path is None:
+        return jsonify({"error": "Log not found"}), 404
+    return jsonify(log_tail.tail(path, offset, timeout))
+
+
+@public.route('/api/log/<yyyymmdd>/<family>/<job>/stream')
+def job_log_stream(yyyymmdd, family, job):
+    offset = request.headers.get('Last-Event-ID', type=int)
+    if offset is None:
+        offset = request.args.get('offset', default=0, type=int)
+    try:
+        path = _live_log_path(yyyymmdd, family, job)
+    except PyTaskforestParseException as e:
+        return jsonify({"error": str(e)}), 400
+    if path is None:
+        return jsonify({"error": "Log not found"}), 404
+    # EventSource reconnects on its own, so each connection is kept short
+    events = log_tail.sse_events(path, offset, max_duration=300)
+    return Response(stream_with_context(events), mimetype='text/event-stream',
+                    headers={'X-Accel-Buffering': 'no'})
@@ -0,0 +1,22 @@
+import pytest
+
+
+class RecordingExecutor:
+    """
+    Stands in for the Celery task: records (family_name, job_name), the queue and the full
+    args of each job sent.
+    """
+    def __init__(self):
+        self.calls = []
+        self.queues = []
+        self.args = []
+
+    def apply_async(self, args, queue):
+        self.calls.append((args[3], args[4]))
+        self.queues.append(queue)
+        self.args.append(args)
+
+
+@pytest.fixture
+def executor():
+    return RecordingExecutor()
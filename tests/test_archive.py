@@ -0,0 +1,101 @@
+import os
+import zipfile
+
+import pytest
+
+import pytf.archive as archive
+import pytf.dirs as dirs
+import pytf.exceptions as ex
+from pytf.config import Config
+from pytf.mockdatetime import MockDateTime
+
+
+@pytest.fixture(autouse=True)
+def close_archives():
+    yield
+    for path in list(archive._open_archives):
+        archive._forget(path)
+
+
+@pytest.fixture
+def archive_config(tmp_path):
+    config = Config.from_str("""
+    primary_tz = "America/Denver"
+    """)
+    config.log_dir = os.path.join(tmp_path, 'log_dir')
+    config.family_dir = os.path.join(tmp_path, 'family_dir')
+    for day in ("20240212", "20240213", "20240214"):
+        dirs.make_dir(os.path.join(config.log_dir, day))
+        dirs.make_dir(os.path.join(config.family_dir, day))
+        with open(os.path.join(config.log_dir, day, "F1.J1.q.w.20240213010000.info"), "w") as f:
+            f.write(f'family_name = "F1"\njob_name = "J1"\nday = "{day}"\n')
+        with open(os.path.join(config.log_dir, day, "F1.J1.log"), "w") as f:
+            f.write(f"J1 ran on {day}\n")
+        with open(os.path.join(config.log_dir, day, "F1.J10.log"), "w") as f:
+            f.write("J10\n")
+        with open(os.path.join(config.family_dir, day, "F1"), "w") as f:
+            f.write('start="0100"\nJ1() J10()\n')
+    MockDateTime.set_mock(2024, 2, 14, 2, 14, 0, 'America/Denver')
+    return config
+
+
+def test_finished_days(archive_config):
+    assert archive.finished_days(archive_config) == ["20240212", "20240213"]
+    assert archive.finished_days(archive_config, keep_days=2) == ["20240212"]
+
+
+def test_archive_finished_days(archive_config):
+    paths = archive.archive_finished_days(archive_config)
+    assert paths == [archive.archive_path(archive_config.log_dir, "20240212"),
+                     archive.archive_path(archive_config.log_dir, "20240213")]
+    assert sorted(os.listdir(archive_config.log_dir)) == ["20240214", "archive"]
+    assert os.listdir(archive_config.family_dir) == ["20240214"]
+
+    with zipfile.ZipFile(paths[0]) as z:
+        assert sorted(z.namelist()) == ["families/F1",
+                                        "index.json",
+                                        "logs/F1.J1.log",
+                                        "logs/F1.J1.q.w.20240213010000.info",
+                                        "logs/F1.J10.log"]
+
+
+def test_job_files_same_from_dir_and_archive(archive_config):
+    before = archive.job_files(archive_config, "20240213", "F1", "J1")
+    archive.archive_day(archive_config, "20240213")
+    after = archive.job_files(archive_config, "20240213", "F1", "J1")
+    assert before == after == {
+        "info": {"F1.J1.q.w.20240213010000.info": 'family_name = "F1"\njob_name = "J1"\nday = "20240213"\n'},
+        "log": "J1 ran on 20240213\n",
+    }
+    assert archive.job_files(archive_config, "20240213", "F1", "J10") == {"info": {}, "log": "J10\n"}
+    assert archive.job_files(archive_config, "20240213", "F1", "J2") == {"info": {}, "log": None}
+    assert archive.job_files(archive_config, "20230101", "F1", "J1") == {"info": {}, "log": None}
+
+
+def test_list_and_read_archived_day(archive_config):
+    archive.archive_day(archive_config, "20240212")
+    assert archive.list_day_files(archive_config, "20240212") == ["F1.J1.log",
+                                                                  "F1.J1.q.w.20240213010000.info",
+                                                                  "F1.J10.log"]
+    assert archive.read_day_file(archive_config, "20240212", "F1.J10.log") == "J10\n"
+    assert archive.read_day_file(archive_config, "20240212", "nope") is None
+
+
+def test_archiving_twice_merges(archive_config):
+    archive.archive_day(archive_config, "20240213")
+    dirs.make_dir(os.path.join(archive_config.log_dir, "20240213"))
+    with open(os.path.join(archive_config.log_dir, "20240213", "F1.J2.log"), "w") as f:
+        f.write("late\n")
+    archive.archive_day(archive_config, "20240213")
+    assert archive.job_files(archive_config, "20240213", "F1", "J2")['log'] == "late\n"
+    assert archive.job_files(archive_config, "20240213", "F1", "J1")['log'] == "J1 ran on 20240213\n"
+
+
+def test_nothing_to_archive(archive_config):
+    assert archive.archive_day(archive_config, "20230101") is None
+
+
+def test_invalid_date(archive_config):
+    with pytest.raises(ex.PyTaskforestParseException) as exc_info:
+        archive.archive_day(archive_config, "2024-02-13")
+    assert str(exc_info.value) == f"{ex.MSG_ARCHIVE_INVALID_DATE} 2024-02-13"
@@ -0,0 +1,144 @@
+import os
+import signal
+
+import pytest
+
+import pytf.dirs as dirs
+import pytf.exceptions as ex
+import pytf.tick_stats as tick_stats
+import pytf.webhooks as webhooks
+from pytf.config import Config
+from pytf.config_reload import ConfigWatcher, reload
+from pytf.family import clear_family_cache, get_families_from_dir
+from pytf.mockdatetime import MockDateTime
+from pytf.runner import prepare_required_dirs
+
+CONFIG = """
+primary_tz = "America/Denver"
+num_retries = 1
+tokens.T1 = 2
+
+[calendars]
+weekdays = ["every Mon */*", "every Tue */*", "every Wed */*"]
+weekends = ["every Sat */*"]
+"""
+
+
+@pytest.fixture
+def reload_config(tmp_path):
+    config_path = os.path.join(tmp_path, "config")
+    with open(config_path, "w") as f:
+        f.write(CONFIG)
+    config = Config.from_str(CONFIG)
+    config.config_file = config_path
+    config.log_dir = os.path.join(tmp_path, 'log_dir')
+    config.family_dir = os.path.join(tmp_path, 'family_dir')
+    dirs.make_dir(config.log_dir)
+    dirs.make_dir(config.family_dir)
+    MockDateTime.set_mock(2024, 2, 14, 2, 14, 0, 'America/Denver')
+    for name, calendar in (("F1", "weekdays"), ("F2", "weekends")):
+        with open(os.path.join(config.family_dir, name), "w") as f:
+            f.write(f'start="0100", calendar="{calendar}"\nJ1()\n')
+    with open(os.path.join(config.family_dir, "F3"), "w") as f:
+        f.write('start="0100", days=["Wed"]\nJ1()\n')
+    prepare_required_dirs(config)
+    dirs.copy_files_from_dir_to_dir(config.family_dir, config.todays_family_dir)
+    clear_family_cache()
+    yield config
+    clear_family_cache()
+
+
+def parse_count(config):
+    tick_stats.start_tick()
+    families = get_families_from_dir(config.todays_family_dir, config)
+    stats = tick_stats.end_tick(10)
+    return stats.counters.get(tick_stats.COUNTER_FILES_PARSED, 0), families
+
+
+def test_unchanged_families_are_not_reparsed(reload_config):
+    assert parse_count(reload_config)[0] == 3
+    count, families = parse_count(reload_config)
+    assert count == 0
+    assert [f.name for f in families] == ["F1", "F2", "F3"]
+
+    with open(os.path.join(reload_config.todays_family_dir, "F3"), "a") as f:
+        f.write("J2()\n")
+    count, families = parse_count(reload_config)
+    assert count == 1
+    assert sorted(families[2].jobs_by_name) == ["J1", "J2"]
+
+    # a new day re-expands everything
+    MockDateTime.set_mock(2024, 2, 15, 2, 14, 0, 'America/Denver')
+    assert parse_count(reload_config)[0] == 3
+
+
+def test_reload_changes_only_what_changed(reload_config):
+    parse_count(reload_config)
+    families_before = parse_count(reload_config)[1]
+    new_config = CONFIG.replace('tokens.T1 = 2', 'tokens.T1 = 5').replace('"every Sat */*"', '"every Sun */*"')
+
+    diff = reload(reload_config, new_config)
+
+    assert diff == {"changed": ["tokens", "calendars"], "calendars": ["weekends"], "families": ["F2"]}
+    assert reload_config.tokens_by_name['T1'].num_instances == 5
+    count, families_after = parse_count(reload_config)
+    assert count == 1
+    assert families_after[0] is families_before[0]
+    assert families_after[1] is not families_before[1]
+    assert families_after[2] is families_before[2]
+
+
+def test_web_hook_change_restarts_the_sender(reload_config):
+    reload_config.web_hook = "http://old.example/hook"
+    old_sender = webhooks.sender_for(reload_config)
+    try:
+        reload(reload_config, 'web_hook = "http://new.example/hook"\nhook_auth = "Bearer t"\n' + CONFIG)
+        new_sender = webhooks.sender_for(reload_config)
+        assert new_sender is not old_sender
+        assert new_sender.url == "http://new.example/hook"
+        assert new_sender.session.headers['Authorization'] == "Bearer t"
+    finally:
+        webhooks.stop()
+
+
+def test_primary_tz_change_reparses_everything(reload_config):
+    parse_count(reload_config)
+    diff = reload(reload_config, CONFIG.replace("America/Denver", "America/Chicago"))
+    assert diff['changed'] == ["primary_tz"]
+    assert parse_count(reload_config)[0] == 3
+
+
+@pytest.mark.parametrize("toml_str, message", [
+    ('primary_tz = "Mars/Olympus"', f"{ex.MSG_CONFIG_INVALID_VALUE} primary_tz = Mars/Olympus"),
+    ('ignore_regex = ["("]', f"{ex.MSG_CONFIG_INVALID_VALUE} ignore_regex = ("),
+    ('tokens.T1 = -1', f"{ex.MSG_CONFIG_INVALID_VALUE} tokens.T1 = -1"),
+    ('[calendars]\nbad = ["first"]', f"{ex.MSG_CALENDAR_DANGLING_OFFSET} first"),
+    ('tokens.T1 = [', ex.MSG_CONFIG_PARSING_FAILED),
+])
+def test_invalid_config_is_rejected_whole(reload_config, toml_str, message):
+    before = (reload_config.toml_str, reload_config.num_retries, dict(reload_config.tokens_by_name))
+    with pytest.raises(ex.PyTaskforestParseException) as exc_info:
+        reload(reload_config, 'num_retries = 7\ntokens.T2 = 1\n' + toml_str)
+    assert str(exc_info.value) == message
+    assert (reload_config.toml_str, reload_config.num_retries, dict(reload_config.tokens_by_name)) == before
+
+
+def test_watcher(reload_config):
+    watcher = ConfigWatcher(reload_config, reload_config.config_file)
+    assert watcher.check() is None
+
+    # a bad file is ignored
+    with open(reload_config.config_file, "w") as f:
+        f.write('primary_tz = "Mars/Olympus"\n')
+    assert watcher.check() is None
+    assert reload_config.primary_tz == "America/Denver"
+
+    # SIGHUP re-reads even if the mtime didn't change
+    with open(reload_config.config_file, "w") as f:
+        f.write(CONFIG.replace("num_retries = 1", "num_retries = 3"))
+    watcher.mtime = watcher._mtime()
+    os.kill(os.getpid(), signal.SIGHUP)
+    assert watcher.check()['changed'] == ["num_retries"]
+    assert reload_config.num_retries == 3
+    assert watcher.check() is None
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
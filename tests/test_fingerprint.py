@@ -0,0 +1,94 @@
+import os
+
+import pytest
+
+import pytf.dirs as dirs
+import pytf.fingerprint as fingerprint
+from pytf.config import Config
+from pytf.dependency import JobDependency
+from pytf.logs import get_logged_job_results
+from pytf.mockdatetime import MockDateTime
+from pytf.pytf_worker import run
+from pytf.runner import prepare_required_dirs
+from pytf.status import status
+
+
+@pytest.fixture
+def fp_config(tmp_path):
+    config = Config.from_str('primary_tz = "America/Denver"\n')
+    config.log_dir = os.path.join(tmp_path, 'log_dir')
+    config.family_dir = os.path.join(tmp_path, 'family_dir')
+    config.job_dir = os.path.join(tmp_path, 'job_dir')
+    for d in (config.log_dir, config.family_dir, config.job_dir, os.path.join(config.job_dir, "data")):
+        dirs.make_dir(d)
+    MockDateTime.set_mock(2024, 2, 14, 2, 14, 0, 'America/Denver')
+    prepare_required_dirs(config)
+    with open(os.path.join(config.job_dir, "data", "a.csv"), "w") as f:
+        f.write("1,2\n")
+    script_path = os.path.join(config.job_dir, "J1")
+    with open(script_path, "w") as f:
+        f.write("#!/bin/bash\necho ran >> runs.txt\ncat data/*.csv > out.txt\n")
+    os.chmod(script_path, 0o755)
+    return config
+
+
+def run_j1(config, stamp):
+    info_path = os.path.join(config.todays_log_dir, f"F1.J1.default.w.{stamp}.info")
+    cwd = os.getcwd()
+    os.chdir(config.job_dir)
+    try:
+        run(config.todays_log_dir, config.job_dir, config.primary_tz, "F1", "J1", "America/Denver", "default",
+            0, 0, os.path.join(config.todays_log_dir, "F1.J1.log"), info_path,
+            False, ["data/*.csv"], ["out.txt"])
+    finally:
+        os.chdir(cwd)
+    for file_name in os.listdir(config.todays_log_dir):
+        if file_name.endswith(".info") and not file_name.endswith(f"{stamp}.info"):
+            # only the latest run counts, as after a rerun
+            os.remove(os.path.join(config.todays_log_dir, file_name))
+    with open(os.path.join(config.job_dir, "runs.txt")) as f:
+        return len(f.readlines())
+
+
+def test_unchanged_inputs_skip_the_job(fp_config):
+    assert run_j1(fp_config, "20240214021400") == 1
+    assert run_j1(fp_config, "20240214021500") == 1
+
+    _, job_dict = get_logged_job_results(fp_config.todays_log_dir)
+    assert job_dict["F1"]["J1"].status.value == "Up To Date"
+    assert JobDependency(fp_config, family_name="F1", job_name="J1").met(job_dict)
+
+    # touched but not changed
+    os.utime(os.path.join(fp_config.job_dir, "data", "a.csv"))
+    assert run_j1(fp_config, "20240214021600") == 1
+
+    with open(os.path.join(fp_config.job_dir, "data", "b.csv"), "w") as f:
+        f.write("3,4\n")
+    assert run_j1(fp_config, "20240214021700") == 2
+
+    os.remove(os.path.join(fp_config.job_dir, "out.txt"))
+    assert run_j1(fp_config, "20240214021800") == 3
+
+    with open(os.path.join(fp_config.job_dir, "J1"), "a") as f:
+        f.write("# changed\n")
+    assert run_j1(fp_config, "20240214021900") == 4
+
+
+def test_unchanged_files_are_not_read_again(fp_config, monkeypatch):
+    log_dir = fp_config.log_dir
+    _, state = fingerprint.check(log_dir, "F1", "J1", fp_config.job_dir, ["data/*.csv"], [])
+    fingerprint.record(log_dir, "F1", "J1", fp_config.job_dir, state, [])
+
+    hashed = []
+    original = fingerprint._hash_file
+    monkeypatch.setattr(fingerprint, "_hash_file", lambda path: hashed.append(os.path.basename(path)) or original(path))
+    up_to_date, _ = fingerprint.check(log_dir, "F1", "J1", fp_config.job_dir, ["data/*.csv"], [])
+    assert up_to_date
+    assert hashed == []
+
+
+def test_inputs_are_parsed_and_shown(fp_config):
+    with open(os.path.join(fp_config.todays_family_dir, "F1"), "w") as f:
+        f.write('start="0100"\nJ1(inputs=["data/*.csv"], outputs=["out.txt"])\n')
+    job = status(fp_config)['status']['flat_list'][0]
+    assert (job['inputs'], job['outputs']) == (["data/*.csv"], ["out.txt"])
@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+import pytf.archive as archive
+import pytf.dirs as dirs
+import pytf.history as history
+from pytf.config import Config
+from pytf.mockdatetime import MockDateTime
+
+
+@pytest.fixture(autouse=True)
+def clean_history():
+    history.reset()
+    yield
+    history.reset()
+
+
+@pytest.fixture
+def history_config(tmp_path):
+    config = Config.from_str("""
+    primary_tz = "America/Denver"
+    """)
+    config.log_dir = os.path.join(tmp_path, 'log_dir')
+    config.family_dir = os.path.join(tmp_path, 'family_dir')
+    dirs.make_dir(config.log_dir)
+    dirs.make_dir(config.family_dir)
+    MockDateTime.set_mock(2024, 2, 14, 2, 14, 0, 'America/Denver')
+    return config
+
+
+def write_info(config, day, job_name, start, end, error_code):
+    log_dir = os.path.join(config.log_dir, day)
+    dirs.make_dir_if_necessary(log_dir)
+    with open(os.path.join(log_dir, f"F1.{job_name}.default.w.{day}{start.replace(':', '')}.info"), "w") as f:
+        f.write('family_name = "F1"\n')
+        f.write(f'job_name = "{job_name}"\n')
+        f.write('queue_name = "default"\n')
+        f.write('num_retries = "0"\n')
+        f.write('retry_sleep = "1"\n')
+        f.write('tz = "America/Denver"\n')
+        f.write('worker_name = "w"\n')
+        f.write(f'start_time = "{day[:4]}/{day[4:6]}/{day[6:]} {start}"\n')
+        if end is not None:
+            f.write(f'end_time = "{day[:4]}/{day[4:6]}/{day[6:]} {end}"\n')
+        if error_code is not None:
+            f.write(f'error_code = {error_code}\n')
+
+
+def test_index_day(history_config):
+    write_info(history_config, "20240212", "J1", "01:00:00", "01:01:40", 0)
+    write_info(history_config, "20240212", "J1-Orig-1", "00:30:00", "00:30:10", 1)
+    write_info(history_config, "20240212", "J2", "01:00:00", None, None)
+    assert history.index_day(history_config, "20240212") == 2
+    rows = history.runs(history_config, "F1", "J1")
+    assert [(r['job_name'], r['duration'], r['error_code']) for r in rows] == [("J1-Orig-1", 10.0, 1),
+                                                                                ("J1", 100.0, 0)]
+
+
+def test_index_day_is_idempotent(history_config):
+    write_info(history_config, "20240212", "J1", "01:00:00", "01:01:40", 0)
+    history.index_day(history_config, "20240212")
+    history.index_day(history_config, "20240212")
+    assert len(history.runs(history_config)) == 1
+
+
+def test_index_missing_days_reads_archives(history_config):
+    write_info(history_config, "20240212", "J1", "01:00:00", "01:01:40", 0)
+    write_info(history_config, "20240213", "J1", "01:00:00", "01:03:20", 2)
+    write_info(history_config, "20240214", "J1", "01:00:00", "01:00:01", 0)
+    archive.archive_day(history_config, "20240212")
+
+    assert history.index_missing_days(history_config, before="20240214") == ["20240212", "20240213"]
+    assert history.index_missing_days(history_config, before="20240214") == []
+    assert [r['day'] for r in history.runs(history_config, job_name="J1")] == ["20240212", "20240213"]
+    assert [r['day'] for r in history.runs(history_config, since="20240213")] == ["20240213"]
+    assert [r['day'] for r in history.runs(history_config, failed_only=True)] == ["20240213"]
+
+
+def test_record_completed(history_config):
+    history_config.todays_log_dir = os.path.join(history_config.log_dir, "20240214")
+    flat_list = [
+        {"family_name": "F1", "job_name": "J1", "status": "Success", "queue_name": "default", "tz": "America/Denver",
+         "worker_name": "w", "start_time": "2024/02/14 01:00:00", "end_time": "2024/02/14 01:00:30", "error_code": 0},
+        {"family_name": "F1", "job_name": "J2", "status": "Running", "queue_name": "default", "tz": "America/Denver",
+         "worker_name": "w", "start_time": "2024/02/14 01:00:00", "end_time": None, "error_code": None},
+    ]
+    history.record_completed(history_config, flat_list)
+    history.record_completed(history_config, flat_list)
+    rows = history.runs(history_config)
+    assert [(r['day'], r['job_name'], r['duration']) for r in rows] == [("20240214", "J1", 30.0)]
+
+
+def test_summarize():
+    rows = [{"day": f"202402{d:02}", "duration": float(d), "error_code": 1 if d in (3, 5) else 0}
+            for d in range(1, 21)]
+    summary = history.summarize(rows)
+    assert summary == {"runs": 20,
+                       "failures": 2,
+                       "failed_days": ["20240203", "20240205"],
+                       "mean_seconds": 10.5,
+                       "p50_seconds": 10.0,
+                       "p95_seconds": 19.0,
+                       "max_seconds": 20.0}
+    assert history.summarize([])['p95_seconds'] is None
+
+
+def test_base_job_name():
+    assert history.base_job_name("J1-0930") == "J1"
+    assert history.base_job_name("J1-Orig-2") == "J1"
@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# About twice what these commands take; importing the worker stack as well roughly doubles it.
+# The checks of which modules get imported are the real test; this only catches gross regressions.
+STARTUP_BUDGET_US = 500_000
+
+HEAVY_MODULES = ("celery", "kombu", "requests", "flask", "pytf.main", "pytf.pytf_worker", "http.server")
+
+
+def import_times(root, *args) -> dict:
+    """
+    Run pytf.py with -X importtime and return {top-level module: cumulative microseconds}.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "pytf.py", "--root", str(root), *args],
+                            cwd=REPO_DIR, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            times[name.rstrip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize("module", ["pytf.main", "pytf.status", "pytf.instructions", "pytf.history"])
+def test_modules_do_not_import_celery(module):
+    # in a fresh interpreter, since this one may have imported Celery for other tests
+    result = subprocess.run([sys.executable, "-c", f"import sys, {module}; "
+                             f"print(sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules and m != 'pytf.main'))"],
+                            cwd=REPO_DIR, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "[]"
+
+
+@pytest.mark.parametrize("args", [("status", "--json"), ("bulk", "hold", "--family", "F1"), ("history", "--json")])
+def test_cli_commands_skip_the_scheduler_stack(tmp_path, args):
+    for sub_dir in ("logs", "families", "jobs", "instructions"):
+        os.makedirs(os.path.join(tmp_path, sub_dir))
+
+    times = import_times(tmp_path, *args)
+
+    imported = {name.strip() for name in times}
+    assert not imported & set(HEAVY_MODULES)
+    top_level = sum(t for name, t in times.items() if not name.startswith("  "))
+    assert top_level < STARTUP_BUDGET_US
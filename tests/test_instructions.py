@@ -0,0 +1,146 @@
+import os
+
+import pytest
+
+import pytf.dirs as dirs
+import pytf.exceptions as ex
+import pytf.instructions as instructions
+import pytf.tick_stats as tick_stats
+from pytf.config import Config
+from pytf.family import clear_family_cache
+from pytf.main import main_function
+from pytf.mockdatetime import MockDateTime
+from pytf.runner import prepare_required_dirs
+
+
+@pytest.fixture
+def instr_config(tmp_path):
+    config = Config.from_str("""
+    primary_tz = "America/Denver"
+    """)
+    config.log_dir = os.path.join(tmp_path, 'log_dir')
+    config.family_dir = os.path.join(tmp_path, 'family_dir')
+    config.instructions_dir = os.path.join(tmp_path, 'instructions')
+    for d in (config.log_dir, config.family_dir, config.instructions_dir):
+        dirs.make_dir(d)
+    MockDateTime.set_mock(2024, 2, 14, 2, 14, 0, 'America/Denver')
+    families = {
+        "F1": 'start="0100"\nJ1()\nJ2()\nJ3()\n',
+        "F2": 'start="0100"\nF1::J2()\nJ4()\n',
+        "G1": 'start="0100"\nJ1()\n',
+    }
+    for name, text in families.items():
+        with open(os.path.join(config.family_dir, name), "w") as f:
+            f.write(text)
+    prepare_required_dirs(config)
+    dirs.copy_files_from_dir_to_dir(config.family_dir, config.todays_family_dir)
+    return config
+
+
+def finish(config, family_name, job_name, error_code=0):
+    with open(os.path.join(config.todays_log_dir, f"{family_name}.{job_name}.default.w.20240214010000.info"), "w") as f:
+        f.write(f'family_name = "{family_name}"\njob_name = "{job_name}"\ntz = "America/Denver"\n'
+                'queue_name = "default"\nnum_retries = 0\nretry_sleep = 0\nworker_name = "w"\n'
+                f'start_time = "2024/02/14 01:00:00"\nerror_code = {error_code}\n')
+
+
+def log_files(config, suffix):
+    return sorted(f for f in os.listdir(config.todays_log_dir) if f.endswith(suffix))
+
+
+def test_parse_instructions():
+    parsed = instructions.parse_instructions("""
+    [[instruction]]
+    action = "hold"
+    family = "F*"
+
+    [[instruction]]
+    action = "mark"
+    job = "J1"
+    error_code = 0
+    """)
+    assert parsed == [
+        {"action": "hold", "family": "F*", "job": "*", "downstream": False, "error_code": None},
+        {"action": "mark", "family": "*", "job": "J1", "downstream": False, "error_code": 0},
+    ]
+
+
+@pytest.mark.parametrize("toml_str, message", [
+    ('[[instruction]]\naction = "explode"\n', f"{ex.MSG_INSTRUCTIONS_UNKNOWN_ACTION} explode"),
+    ('[[instruction]]\naction = "mark"\n', ex.MSG_INSTRUCTIONS_MARK_NEEDS_ERROR_CODE),
+    ('[[instruction]]\naction = \n', ex.MSG_INSTRUCTIONS_PARSING_FAILED),
+])
+def test_parse_instructions_errors(toml_str, message):
+    with pytest.raises(ex.PyTaskforestParseException) as exc_info:
+        instructions.parse_instructions(toml_str)
+    assert str(exc_info.value) == message
+
+
+def test_hold_by_pattern(instr_config):
+    applied = instructions.apply(instr_config, [instructions.make_instruction("hold", family="F*", job="J[12]")])
+    assert applied == 2
+    assert log_files(instr_config, ".hold") == ["F1.J1.hold", "F1.J2.hold"]
+
+
+def test_remove_hold_and_release(instr_config):
+    instructions.apply(instr_config, [instructions.make_instruction("hold")])
+    instructions.apply(instr_config, [instructions.make_instruction("remove_hold", family="F1")])
+    assert log_files(instr_config, ".hold") == ["F2.J4.hold", "G1.J1.hold"]
+    instructions.apply(instr_config, [instructions.make_instruction("release_dependencies", family="G1")])
+    assert log_files(instr_config, ".hold") == ["F2.J4.hold"]
+    assert log_files(instr_config, ".release") == ["G1.J1.release"]
+
+
+def test_mark_only_jobs_that_ran(instr_config):
+    finish(instr_config, "F1", "J1", 1)
+    assert instructions.apply(instr_config, [instructions.make_instruction("mark", job="J1", error_code=0)]) == 1
+    with open(os.path.join(instr_config.todays_log_dir, "F1.J1.default.w.20240214010000.info")) as f:
+        assert "error_code = 0\n" in f.read()
+
+
+def test_rerun_downstream(instr_config):
+    for family_name, job_name in (("F1", "J1"), ("F1", "J2"), ("F1", "J3"), ("F2", "J4"), ("G1", "J1")):
+        finish(instr_config, family_name, job_name)
+    applied = instructions.apply(instr_config,
+                                 [instructions.make_instruction("rerun", family="F1", job="J2", downstream=True)])
+    # F1::J3 follows J2 in its family, F2::J4 depends on F1::J2
+    assert applied == 3
+    assert log_files(instr_config, ".info") == ["F1.J1.default.w.20240214010000.info",
+                                                "F1.J2-Orig-1.default.w.20240214010000.info",
+                                                "F1.J3-Orig-1.default.w.20240214010000.info",
+                                                "F2.J4-Orig-1.default.w.20240214010000.info",
+                                                "G1.J1.default.w.20240214010000.info"]
+    # the job itself is released, the downstream job waits for it
+    assert log_files(instr_config, ".release") == ["F1.J2.release"]
+
+
+def test_scheduler_applies_instruction_files(instr_config, executor):
+    path = instructions.write_instruction_file(instr_config, [instructions.make_instruction("hold", family="F1")])
+    with open(os.path.join(instr_config.instructions_dir, "bad.toml"), "w") as f:
+        f.write("[[instruction]]\naction = 1\n")
+    main_function(instr_config, executor)
+
+    assert sorted(executor.calls) == [("G1", "J1")]
+    assert instructions.pending_instruction_files(instr_config) == []
+    assert os.listdir(os.path.join(instr_config.instructions_dir, instructions.PROCESSED_SUBDIR)) == \
+        [os.path.basename(path)]
+    assert os.listdir(os.path.join(instr_config.instructions_dir, instructions.FAILED_SUBDIR)) == ["bad.toml"]
+
+
+def test_sharded_instructions_reuse_parsed_families(instr_config, executor):
+    instr_config.shards = ["a", "b"]
+    instr_config.shard = "a"
+    clear_family_cache()
+
+    def files_parsed(run):
+        tick_stats.start_tick()
+        try:
+            run()
+        finally:
+            stats = tick_stats.end_tick(10)
+        return stats.counters.get(tick_stats.COUNTER_FILES_PARSED, 0)
+
+    hold = [instructions.make_instruction("hold", family="G1")]
+    assert files_parsed(lambda: instructions.apply(instr_config, hold)) == 3
+    assert files_parsed(lambda: main_function(instr_config, executor)) == 0
+    assert files_parsed(lambda: instructions.apply(instr_config, hold)) == 0
@@ -8,6 +8,7 @@ from pytf.exceptions import (
     MSG_UNTIL_TIME_PARSING_FAILED,
     MSG_UNRECOGNIZED_PARAM,
     MSG_INVALID_TYPE,
+    MSG_INVALID_VALUE,
 )
 
 job_name_parameters = [
@@ -121,6 +122,8 @@ job_invalid_type_parameters = [
     ('no_retry_email int', ('J_Job(no_retry_email=1)', "J_Job/no_retry_email (1) is type int")),
     ('tokens bool', ('J_Job(queue = "a", tokens=True)', "J_Job/tokens (True) is not iterable")),
     ('tokens bool', ('J_Job(queue = "a", tokens=[1, 2])', "J_Job/tokens ([1, 2] :: 1)")),
+    ('max_rss str', ('J_Job(max_rss="1G")', "J_Job/max_rss (1G) is type str")),
+    ('cpu_affinity strs', ('J_Job(cpu_affinity=["0"])', "J_Job/cpu_affinity (['0'] :: 0)")),
 ]
 
 
@@ -133,3 +136,22 @@ def test_job_invalid_type(job_str, message_end):
         _ = Job.parse(job_str, "family_name")
     assert e.value.message.startswith(MSG_INVALID_TYPE)
     assert e.value.message.endswith(message_end)
+
+
+job_invalid_limit_parameters = [
+    ('max_rss zero', ('J_Job(max_rss=0)', "J_Job/max_rss (0)")),
+    ('nice negative', ('J_Job(nice=-5)', "J_Job/nice (-5)")),
+    ('ionice too big', ('J_Job(ionice=8)', "J_Job/ionice (8)")),
+    ('cpu_affinity empty', ('J_Job(cpu_affinity=[])', "J_Job/cpu_affinity ([])")),
+]
+
+
+@pytest.mark.parametrize(["job_str", "message_end"],
+                         [i[1] for i in job_invalid_limit_parameters],
+                         ids=[v[0] for v in job_invalid_limit_parameters]
+                         )
+def test_job_invalid_limit(job_str, message_end):
+    with pytest.raises(PyTaskforestParseException) as e:
+        _ = Job.parse(job_str, "family_name")
+    assert e.value.message.startswith(MSG_INVALID_VALUE)
+    assert e.value.message.endswith(message_end)
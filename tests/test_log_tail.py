@@ -0,0 +1,138 @@
+import os
+
+import pytest
+
+import pytf.exceptions as ex
+import pytf.log_tail as log_tail
+
+
+@pytest.fixture
+def day_dir(tmp_path):
+    d = os.path.join(tmp_path, "20240214")
+    os.makedirs(d)
+    return d
+
+
+@pytest.fixture
+def log_path(day_dir):
+    path = os.path.join(day_dir, "F1.J1.log")
+    with open(path, "w") as f:
+        f.writelines(f"line {i}\n" for i in range(5000))
+    return path
+
+
+def write_info(day_dir, finished):
+    with open(os.path.join(day_dir, "F1.J1.default.w.20240214010000.info"), "w") as f:
+        f.write('family_name = "F1"\njob_name = "J1"\n' + ("error_code = 0\n" if finished else ""))
+
+
+def test_job_log_path(tmp_path):
+    assert log_tail.job_log_path(str(tmp_path), "20240214", "F1", "J1") == \
+        os.path.join(tmp_path, "20240214", "F1.J1.log")
+    with pytest.raises(ex.PyTaskforestParseException) as exc_info:
+        log_tail.job_log_path(str(tmp_path), "20240214", "..", "J1")
+    assert str(exc_info.value) == f"{ex.MSG_LOG_INVALID_NAME} .."
+    with pytest.raises(ex.PyTaskforestParseException):
+        log_tail.job_log_path(str(tmp_path), "../x", "F1", "J1")
+
+
+@pytest.mark.parametrize("start, count, expected", [
+    (0, 3, ["line 0", "line 1", "line 2"]),
+    (1023, 3, ["line 1023", "line 1024", "line 1025"]),
+    (4998, 10, ["line 4998", "line 4999"]),
+    (5000, 10, []),
+    (9000, 10, []),
+])
+def test_read_lines(log_path, start, count, expected):
+    result = log_tail.read_lines(log_path, start, count)
+    assert result['lines'] == expected
+    assert result['total_lines'] == 5000
+
+
+def test_index_grows_with_the_file(log_path, monkeypatch):
+    monkeypatch.setattr(log_tail, "SCAN_CHUNK", 100)
+    index = log_tail.LineIndex(log_path)
+    assert index.read_lines(4999, 1)['lines'] == ["line 4999"]
+    assert list(index.checkpoints) == [0] + [sum(len(f"line {i}\n") for i in range(n * 1024))
+                                             for n in range(1, 5)]
+    with open(log_path, "a") as f:
+        f.write("line 5000\npartial")
+    result = index.read_lines(5000, 5)
+    assert result['lines'] == ["line 5000", "partial"]
+    assert result['total_lines'] == 5002
+    assert result['offset'] == os.path.getsize(log_path)
+
+    # the log was replaced
+    with open(log_path + ".new", "w") as f:
+        f.write("new 0\nnew 1\n")
+    os.replace(log_path + ".new", log_path)
+    assert index.read_lines(1, 5)['lines'] == ["new 1"]
+
+
+def test_read_from(log_path):
+    size = os.path.getsize(log_path)
+    data, offset = log_tail.read_from(log_path, 0, max_bytes=15)
+    assert data == b"line 0\nline 1\n"
+    assert offset == 14
+    assert log_tail.read_from(log_path, size) == (b"", size)
+    # truncated: start over
+    with open(log_path, "w") as f:
+        f.write("again\n")
+    assert log_tail.read_from(log_path, size) == (b"again\n", 6)
+
+
+def test_tail(day_dir, log_path):
+    write_info(day_dir, finished=False)
+    size = os.path.getsize(log_path)
+    result = log_tail.tail(log_path, size, timeout=0.05, poll_interval=0.01)
+    assert result == {"offset": size, "data": "", "running": True}
+
+    with open(log_path, "a") as f:
+        f.write("more\n")
+    write_info(day_dir, finished=True)
+    result = log_tail.tail(log_path, size, timeout=10)
+    assert result == {"offset": size + 5, "data": "more\n", "running": False}
+    # finished jobs don't wait
+    assert log_tail.tail(log_path, size + 5, timeout=10)['data'] == ""
+
+
+def test_tail_sees_output_written_just_before_exit(log_path):
+    size = os.path.getsize(log_path)
+
+    def finishes_after_check(path):
+        # the job writes its last line and exits right after it's checked
+        with open(path, "a") as f:
+            f.write("last\n")
+        return False
+
+    result = log_tail.tail(log_path, size, timeout=10, is_running=finishes_after_check)
+    assert result == {"offset": size + 5, "data": "last\n", "running": False}
+
+
+def test_sse_events(day_dir, log_path):
+    write_info(day_dir, finished=True)
+    size = os.path.getsize(log_path)
+    events = list(log_tail.sse_events(log_path, size - 20, max_duration=10))
+    assert events == [f"id: {size}\ndata: line 4998\ndata: line 4999\n\n",
+                      f"id: {size}\nevent: end\ndata: \n\n"]
+
+
+def test_flask_routes(tmp_path, day_dir, log_path, monkeypatch):
+    from pytf_flask import create_app
+    monkeypatch.setenv("PYTF_LOG_DIR", str(tmp_path))
+    write_info(day_dir, finished=True)
+    client = create_app('testing').test_client()
+
+    response = client.get('/api/log/20240214/F1/J1/raw', headers={"Range": "bytes=7-13"})
+    assert response.status_code == 206
+    assert response.data == b"line 1\n"
+    etag = response.headers['ETag']
+    assert client.get('/api/log/20240214/F1/J1/raw', headers={"If-None-Match": etag}).status_code == 304
+
+    assert client.get('/api/log/20240214/F1/J1/lines?start=2&count=1').json['lines'] == ["line 2"]
+    assert client.get('/api/log/20240214/F1/J1/tail?offset=0&timeout=0').json['running'] is False
+    response = client.get('/api/log/20240214/F1/J1/stream', headers={"Last-Event-ID": str(os.path.getsize(log_path))})
+    assert response.mimetype == "text/event-stream"
+    assert b"event: end" in response.data
+    assert client.get('/api/log/20240214/F1/J9/lines').status_code == 404
+    assert client.get('/api/log/2024/F1/J1/lines').status_code == 400
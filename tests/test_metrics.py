@@ -0,0 +1,156 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+import urllib.request
+
+import attrs
+import pytest
+
+import pytf.metrics as metrics
+from pytf.config import Config
+
+
+@pytest.fixture(autouse=True)
+def clean_registries():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+@pytest.fixture
+def token_config():
+    return Config.from_str("""
+    tokens.T1 = 4
+    """)
+
+
+def test_counter_render():
+    registry = metrics.Registry()
+    registry.counter("runs_total", "Runs").inc(queue="q1")
+    registry.counter("runs_total", "Runs").inc(2, queue="q1")
+    assert registry.render() == ('# HELP runs_total Runs\n'
+                                 '# TYPE runs_total counter\n'
+                                 'runs_total{queue="q1"} 3\n')
+
+
+def test_gauge_label_escaping():
+    registry = metrics.Registry()
+    registry.gauge("g", "G").set(1.5, name='a"b\\c')
+    assert 'g{name="a\\"b\\\\c"} 1.5' in registry.render()
+
+
+def test_histogram_render():
+    registry = metrics.Registry()
+    h = registry.histogram("d", "D", (1.0, 10.0))
+    h.observe(0.5)
+    h.observe(5)
+    h.observe(50)
+    assert registry.render().splitlines()[2:] == [
+        'd_bucket{le="1.0"} 1',
+        'd_bucket{le="10.0"} 2',
+        'd_bucket{le="+Inf"} 3',
+        'd_sum 55.5',
+        'd_count 3',
+    ]
+
+
+def test_collect_merges_processes(tmp_path):
+    for pid, exit_code in ((1, 0), (2, 0), (3, 1)):
+        registry = metrics.Registry()
+        registry.counter("runs_total", "Runs").inc(exit_code=exit_code)
+        registry.histogram("d", "D", (1.0,)).observe(pid)
+        registry.save(str(tmp_path), f"worker-{pid}")
+    (tmp_path / "garbage.json").write_text("{")
+
+    merged = metrics.collect(str(tmp_path))
+    rendered = merged.render()
+    assert 'runs_total{exit_code="0"} 2' in rendered
+    assert 'runs_total{exit_code="1"} 1' in rendered
+    assert 'd_bucket{le="1.0"} 1' in rendered
+    assert 'd_count 3' in rendered
+
+
+def test_collect_missing_dir(tmp_path):
+    assert metrics.collect(str(tmp_path / "nope")).render() == "\n"
+
+
+def test_scheduler_observations(token_config, tmp_path):
+    status = {"status": {"flat_list": [
+        {"family_name": "F1", "job_name": "J1", "status": "Running", "queue_name": "q1"},
+        {"family_name": "F1", "job_name": "J2", "status": "Ready", "queue_name": "q1"},
+        {"family_name": "F1", "job_name": "J3", "status": "Token Wait", "queue_name": "q2"},
+    ]}}
+    token_doc = {"token": [{"token_name": "T1", "family_name": "F1", "job_name": "J1"}]}
+    metrics.observe_scheduler_status(token_config, status, token_doc)
+    metrics.observe_scheduler_dispatch(status['status']['flat_list'][1])
+    metrics.observe_scheduler_tick(str(tmp_path), None)
+
+    rendered = metrics.collect(metrics.metrics_dir_for(str(tmp_path))).render().splitlines()
+    assert 'pytf_jobs{status="Running"} 1' in rendered
+    assert 'pytf_queue_running{queue="q1"} 1' in rendered
+    assert 'pytf_queue_dispatched_total{queue="q1"} 1' in rendered
+    assert 'pytf_token_utilization{token="T1"} 0.25' in rendered
+    assert 'pytf_ready_to_dispatch_seconds_count 1' in rendered
+
+
+def test_shards_save_their_own_snapshots(token_config, tmp_path):
+    token_doc = {"token": [{"token_name": "T1", "family_name": "F1", "job_name": "J1"},
+                           {"token_name": "T1", "family_name": "F2", "job_name": "J1"}]}
+    for shard, family_name in (("s1", "F1"), ("s2", "F2")):
+        metrics.reset()
+        status = {"status": {"flat_list": [
+            {"family_name": family_name, "job_name": "J1", "status": "Running", "queue_name": "q1"},
+        ]}}
+        metrics.observe_scheduler_status(attrs.evolve(token_config, shard=shard), status, token_doc)
+        metrics.observe_scheduler_tick(str(tmp_path), None, shard)
+
+    assert sorted(os.listdir(metrics.metrics_dir_for(str(tmp_path)))) == ["scheduler.s1.json", "scheduler.s2.json"]
+    rendered = metrics.collect(metrics.metrics_dir_for(str(tmp_path))).render().splitlines()
+    assert 'pytf_jobs{shard="s1",status="Running"} 1' in rendered
+    assert 'pytf_jobs{shard="s2",status="Running"} 1' in rendered
+    assert 'pytf_queue_running{queue="q1",shard="s2"} 1' in rendered
+    # every shard sees the same tokens; they aren't added up
+    assert 'pytf_token_in_use{token="T1"} 2' in rendered
+    assert 'pytf_token_capacity{token="T1"} 4' in rendered
+    assert 'pytf_token_utilization{token="T1"} 0.5' in rendered
+
+
+def test_worker_observation(tmp_path):
+    metrics.observe_worker_run(str(tmp_path), "q1", 0, 2.0)
+    rendered = metrics.collect(metrics.metrics_dir_for(str(tmp_path))).render().splitlines()
+    assert 'pytf_worker_runs_total{exit_code="0",queue="q1"} 1' in rendered
+    assert 'pytf_worker_run_duration_seconds_sum{queue="q1"} 2.0' in rendered
+
+
+def test_exited_workers_are_folded_into_one_snapshot(tmp_path):
+    metrics_dir = metrics.metrics_dir_for(str(tmp_path))
+    for _ in range(3):
+        child = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+        dead_pid = int(child.stdout)
+        registry = metrics.Registry()
+        registry.counter("pytf_worker_runs_total", "Job runs completed by workers").inc(queue="q1", exit_code="0")
+        registry.save(metrics_dir, f"worker-{socket.gethostname()}-{dead_pid}")
+
+    metrics.observe_worker_run(str(tmp_path), "q1", 0, 2.0)
+
+    assert sorted(os.listdir(metrics_dir)) == sorted([f"worker-{socket.gethostname()}-{os.getpid()}.json",
+                                                      f"worker-{socket.gethostname()}-retired.json",
+                                                      f"worker-{socket.gethostname()}-retired.lock"])
+    rendered = metrics.collect(metrics_dir).render().splitlines()
+    assert 'pytf_worker_runs_total{exit_code="0",queue="q1"} 4' in rendered
+
+
+def test_make_server(tmp_path):
+    registry = metrics.Registry()
+    registry.counter("runs_total", "Runs").inc()
+    registry.save(str(tmp_path), "scheduler")
+    server = metrics.make_server(str(tmp_path), 0, "127.0.0.1")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+            assert response.headers['Content-Type'] == metrics.CONTENT_TYPE
+            assert 'runs_total 1' in response.read().decode()
+    finally:
+        server.shutdown()
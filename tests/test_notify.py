@@ -0,0 +1,177 @@
+import email
+import os
+import socketserver
+import threading
+import time
+
+import pytest
+
+import pytf.dirs as dirs
+import pytf.events as events
+import pytf.notify as notify
+from pytf.config import Config
+from pytf.family import Family
+from pytf.main import main_function
+from pytf.mockdatetime import MockDateTime
+from pytf.runner import prepare_required_dirs
+
+
+class SmtpSink:
+    """
+    Just enough SMTP to take messages: records each one and each connection.
+    """
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(f"{line}\r\n".encode())
+
+            def handle(self):
+                sink.connections += 1
+                self.reply("220 sink")
+                recipients = []
+                while line := self.rfile.readline():
+                    command = line.decode().strip().upper()
+                    if command.startswith(("EHLO", "HELO")):
+                        self.reply("250 sink")
+                    elif command.startswith("RCPT"):
+                        recipients.append(line.decode().split(":", 1)[1].strip().strip("<>"))
+                        self.reply("250 OK")
+                    elif command == "DATA":
+                        self.reply("354 go ahead")
+                        data = b""
+                        while (chunk := self.rfile.readline()) != b".\r\n":
+                            data += chunk
+                        sink.messages.append((recipients, email.message_from_bytes(data)))
+                        recipients = []
+                        self.reply("250 OK")
+                    elif command == "QUIT":
+                        self.reply("221 bye")
+                        return
+                    else:
+                        # MAIL, RSET, NOOP
+                        self.reply("250 OK")
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+@pytest.fixture
+def sink():
+    server = SmtpSink()
+    yield server
+    server.server.shutdown()
+    server.server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def clean_up():
+    yield
+    notify.stop(timeout=5)
+    events.reset()
+
+
+def make_config(sink, extra=""):
+    return Config.from_str(f"""
+    primary_tz = "America/Denver"
+    smtp_server = "127.0.0.1"
+    smtp_port = {sink.port if sink else 1}
+    email_window = 0
+    email_from = "pytf@example.com"
+    {extra}
+    """)
+
+
+def event(kind, job_name="J1", retried=False):
+    return {"id": f"20240214.F1.{job_name}.x.{kind}", "event": kind, "family_name": "F1", "job_name": job_name,
+            "queue_name": "default", "start_time": "2024/02/14 01:00:00", "end_time": None, "error_code": 1,
+            "retried": retried}
+
+
+@pytest.mark.parametrize("family_str, kind, retried, expected", [
+    ('start="0100", email="fam@x"\nJ1()\n', "failure", False, ["fam@x"]),
+    ('start="0100", email="fam@x"\nJ1(email="job@x, two@x")\n', "failure", False, ["job@x", "two@x"]),
+    ('start="0100"\nJ1()\n', "failure", False, ["config@x"]),
+    ('start="0100", email="fam@x", retry_email="retry@x"\nJ1()\n', "retry", False, ["retry@x"]),
+    ('start="0100", email="fam@x"\nJ1()\n', "retry", False, ["fam@x"]),
+    ('start="0100", email="fam@x", no_retry_email=true\nJ1()\n', "retry", False, []),
+    ('start="0100", email="fam@x", no_retry_email=true\nJ1(no_retry_email=false)\n', "retry", False, ["fam@x"]),
+    ('start="0100", email="fam@x"\nJ1()\n', "success", False, []),
+    ('start="0100", email="fam@x"\nJ1()\n', "success", True, ["fam@x"]),
+    ('start="0100", email="fam@x", no_retry_success_email=true\nJ1()\n', "success", True, []),
+    ('start="0100", email="fam@x"\nJ1()\n', "start", False, []),
+])
+def test_recipients(family_str, kind, retried, expected):
+    config = make_config(None, 'email = "config@x"')
+    family = Family.parse("F1", family_str, config)
+    assert notify.recipients_for(config, family, event(kind, retried=retried)) == expected
+
+
+def test_digest_per_recipient_over_one_connection(sink):
+    config = make_config(sink, 'email = "ops@x"')
+    config.email_window = 0.5
+    family = Family.parse("F1", 'start="0100"\nJ1()\nJ2()\nJ3(email="j3@x")\n', config)
+    notify.notify(config, [family], [event("failure", "J1"), event("failure", "J2")])
+    notify.notify(config, [family], [event("retry", "J3"), event("start", "J1")])
+    deadline = time.monotonic() + 5
+    while len(sink.messages) < 2:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    by_recipient = {tuple(to): message for to, message in sink.messages}
+    assert sorted(by_recipient) == [("j3@x",), ("ops@x",)]
+    assert by_recipient[("ops@x",)]['Subject'] == "[pytf] 2 job notifications: 2 failed"
+    assert "F1::J1" in by_recipient[("ops@x",)].get_payload()
+    assert by_recipient[("j3@x",)]['Subject'] == "[pytf] F1::J3 failed, will retry"
+    assert by_recipient[("j3@x",)]['From'] == "pytf@example.com"
+    assert sink.connections == 1
+
+
+def test_stop_sends_pending(sink):
+    config = make_config(sink, 'email = "ops@x"')
+    config.email_window = 3600
+    notify.notify(config, [], [event("failure")])
+    notify.stop()
+    assert len(sink.messages) == 1
+
+
+def test_email_is_off_without_smtp_server():
+    config = Config.from_str('primary_tz = "America/Denver"\nemail = "config@x"\n')
+    notify.notify(config, [], [event("failure")])
+    assert notify._notifier is None
+
+
+def test_unreachable_server_does_not_block():
+    config = make_config(None, 'email = "ops@x"')
+    start = time.monotonic()
+    notify.notify(config, [], [event("failure")])
+    assert time.monotonic() - start < 1
+    notify.stop()
+
+
+def test_scheduler_emails_failures(tmp_path, sink):
+    config = make_config(sink)
+    config.log_dir = os.path.join(tmp_path, 'log_dir')
+    config.family_dir = os.path.join(tmp_path, 'family_dir')
+    dirs.make_dir(config.log_dir)
+    dirs.make_dir(config.family_dir)
+    MockDateTime.set_mock(2024, 2, 14, 2, 14, 0, 'America/Denver')
+    with open(os.path.join(config.family_dir, "F1"), "w") as f:
+        f.write('start="0100", email="ops@x"\nJ1()\n')
+    prepare_required_dirs(config)
+    dirs.copy_files_from_dir_to_dir(config.family_dir, config.todays_family_dir)
+    with open(os.path.join(config.todays_log_dir, "F1.J1.default.w.20240214010000.info"), "w") as f:
+        f.write('family_name = "F1"\njob_name = "J1"\ntz = "America/Denver"\nqueue_name = "default"\n'
+                'num_retries = 0\nretry_sleep = 0\nworker_name = "w"\nstart_time = "2024/02/14 01:00:00"\n'
+                'error_code = 3\n')
+
+    main_function(config)
+    main_function(config)
+    notify.stop()
+    assert len(sink.messages) == 1
+    assert sink.messages[0][1]['Subject'] == "[pytf] F1::J1 failed"
@@ -0,0 +1,131 @@
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import pathlib
+import queue
+import sys
+import threading
+import time
+
+import pytest
+
+import pytf.pytf_logging as pytf_logging
+from pytf.pytf_json_formatter import PytfJSONFormatter
+
+
+@pytest.fixture
+def queued_logging(tmp_path):
+    pytf_logging.setup_logging(str(tmp_path))
+    yield tmp_path
+    pytf_logging.stop_logging()
+    for handler in list(logging.getLogger().handlers):
+        logging.getLogger().removeHandler(handler)
+
+
+def queue_and_file_handlers():
+    return [h for h in logging.getLogger().handlers
+            if isinstance(h, (pytf_logging.DroppingQueueHandler, logging.FileHandler))]
+
+
+def test_root_only_has_queue_handler(queued_logging):
+    [handler] = queue_and_file_handlers()
+    assert isinstance(handler, pytf_logging.DroppingQueueHandler)
+
+
+def test_records_reach_files_after_stop(queued_logging):
+    logging.getLogger('pytf_logger').info("hello %s", "world")
+    logging.getLogger('pytf_logger').debug("below the file handler's level")
+    pytf_logging.stop_logging()
+    with open(os.path.join(queued_logging, "pytf.log")) as f:
+        lines = f.readlines()
+    assert len(lines) == 1
+    assert lines[0].endswith("INFO hello world\n")
+    with open(os.path.join(queued_logging, "pytf.jlog")) as f:
+        assert '"message": "hello world"' in f.read()
+
+
+def test_batched_records_are_flushed_when_the_queue_goes_quiet(tmp_path, monkeypatch):
+    monkeypatch.setattr(pytf_logging, "LOG_FLUSH_INTERVAL", 0.1)
+    pytf_logging.setup_logging(str(tmp_path), json_batch_size=100)
+    try:
+        logging.getLogger('pytf_logger').info("last words")
+        path = os.path.join(tmp_path, "pytf.jlog")
+        deadline = time.monotonic() + 2
+        while '"message": "last words"' not in pathlib.Path(path).read_text():
+            assert time.monotonic() < deadline
+            time.sleep(0.02)
+    finally:
+        pytf_logging.stop_logging()
+        for handler in list(logging.getLogger().handlers):
+            logging.getLogger().removeHandler(handler)
+
+
+def test_setup_twice_replaces_pipeline(queued_logging):
+    pytf_logging.setup_logging(str(queued_logging))
+    assert len(queue_and_file_handlers()) == 1
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = pytf_logging.DroppingQueueHandler(queue.Queue(maxsize=1))
+    record = logging.LogRecord("pytf_logger", logging.INFO, __file__, 1, "msg %d", (1,), None)
+    handler.handle(record)
+    handler.handle(record)
+    assert handler.dropped == 1
+    assert handler.queue.get_nowait().msg == "msg 1"
+
+
+def make_record(created, msg="Job %s done", args=("F1::J1",), exc_info=None, **extra):
+    record = logging.LogRecord("pytf_logger", logging.INFO, __file__, 7, msg, args, exc_info, func="tick")
+    record.__dict__.update(extra)
+    record.created = created
+    return record
+
+
+@pytest.mark.parametrize("created", [1707902040.0, 1707902040.5, 1707902040.9999996, 1707902041.000123])
+def test_json_formatter_output(created):
+    fmt_keys = pytf_logging.get_logging_config("")['formatters']['json']['fmt_keys']
+    formatter = PytfJSONFormatter(fmt_keys=fmt_keys)
+    line = formatter.format(make_record(created, tick=3))
+    expected = {"level": "INFO", "message": "Job F1::J1 done",
+                "timestamp": datetime.datetime.fromtimestamp(created, tz=datetime.timezone.utc).isoformat(),
+                "logger": "pytf_logger", "module": "test_pytf_logging", "function": "tick", "line": 7,
+                "thread_name": threading.current_thread().name, "tick": 3}
+    assert line == json.dumps(expected)
+
+
+def test_json_formatter_exceptions_and_clashing_extras():
+    formatter = PytfJSONFormatter(fmt_keys={"level": "levelname"})
+    try:
+        raise ValueError("bad")
+    except ValueError:
+        record = make_record(1707902040.25, exc_info=sys.exc_info(), level="mine")
+    doc = json.loads(formatter.format(record))
+    assert list(doc) == ["level", "message", "timestamp", "exc_info"]
+    assert doc["level"] == "mine"
+    assert doc["exc_info"].endswith("ValueError: bad")
+
+
+def test_batching_handler(tmp_path):
+    path = os.path.join(tmp_path, "pytf.jlog")
+    handler = pytf_logging.BatchingRotatingFileHandler(path, batch_size=3)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+
+    def lines():
+        with open(path) as f:
+            return f.read().splitlines()
+
+    handler.handle(make_record(1.0, msg="a", args=()))
+    handler.handle(make_record(1.0, msg="b", args=()))
+    assert lines() == []
+    handler.handle(make_record(1.0, msg="c", args=()))
+    assert lines() == ["a", "b", "c"]
+    handler.handle(make_record(1.0, msg="d", args=()))
+    warning = make_record(1.0, msg="e", args=())
+    warning.levelno = logging.WARNING
+    handler.handle(warning)
+    assert lines() == ["a", "b", "c", "d", "e"]
+    handler.handle(make_record(1.0, msg="f", args=()))
+    handler.close()
+    assert lines() == ["a", "b", "c", "d", "e", "f"]
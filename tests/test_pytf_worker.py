@@ -1,6 +1,18 @@
 import os
+import pathlib
+import sys
+import time
 
-from pytf.pytf_worker import start_process, poll_process
+import tomlkit
+
+import pytf.job_info as job_info
+import pytf.limits as limits
+
+from pytf.config import Config
+from pytf.family import Family
+from pytf.limits import LimitWatcher, for_job
+from pytf.logs import job_result_from_info
+from pytf.pytf_worker import run, start_process, poll_process
 
 
 def test_start_process(tmp_path):
@@ -30,3 +42,115 @@ def test_start_process(tmp_path):
     assert error_code == 0
 
 
+
+
+def write_script(tmp_path, name, body):
+    script_path = os.path.join(tmp_path, name)
+    with open(script_path, "w") as f:
+        f.write(f"#!/bin/bash\n{body}\n")
+    os.chmod(script_path, 0o755)
+    return script_path
+
+
+def test_limits_are_set_before_exec(tmp_path):
+    script_path = write_script(tmp_path, "limits.sh",
+                               f"ulimit -n > {tmp_path}/out; nice >> {tmp_path}/out; "
+                               f"grep Cpus_allowed_list /proc/self/status | cut -f2 >> {tmp_path}/out")
+    watcher = LimitWatcher({'open_files': 64, 'nice': 5, 'ionice': 7, 'cpu_affinity': [0]})
+    assert poll_process(start_process(script_path, watcher=watcher), watcher) == 0
+    assert pathlib.Path(tmp_path, "out").read_text().split() == ["64", str(os.nice(0) + 5), "0"]
+
+
+def test_going_over_a_limit_is_recorded(tmp_path):
+    log_dir = os.path.join(tmp_path, "20240214")
+    os.makedirs(log_dir)
+    write_script(tmp_path, "J1", "while :; do :; done")
+    info_path = os.path.join(log_dir, "F1.J1.default.w.20240214021400.info")
+    run(log_dir, str(tmp_path), "America/Denver", "F1", "J1", "America/Denver", "default", 0, 0,
+        os.path.join(log_dir, "F1.J1.log"), info_path, False, None, None, {'cpu_seconds': 1})
+    doc = tomlkit.loads(pathlib.Path(info_path).read_text())
+    assert doc['error_code'] != 0
+    assert doc['limit_exceeded'] == "cpu_seconds"
+
+
+def test_max_rss_counts_what_the_script_started(tmp_path):
+    log_dir = os.path.join(tmp_path, "20240214")
+    os.makedirs(log_dir)
+    # the shell stays small; its child holds the memory
+    write_script(tmp_path, "J1", f'{sys.executable} -c "b = b\'x\' * (200 * 1024 * 1024); import time; time.sleep(60)" &\nwait')
+    info_path = os.path.join(log_dir, "F1.J1.default.w.20240214021400.info")
+
+    started = time.monotonic()
+    run(log_dir, str(tmp_path), "America/Denver", "F1", "J1", "America/Denver", "default", 0, 0,
+        os.path.join(log_dir, "F1.J1.log"), info_path, False, None, None, {'max_rss': 100})
+    assert time.monotonic() - started < 30
+
+    doc = tomlkit.loads(pathlib.Path(info_path).read_text())
+    assert doc['limit_exceeded'] == "max_rss"
+
+
+def test_job_limits_override_the_family(tmp_path):
+    family_str = 'start="0100", nice=10, max_rss=512\nJ1(nice=2, max_runtime=60) J2()\n'
+    family = Family.parse("F1", family_str, Config.from_str('primary_tz = "America/Denver"\nmax_runtime = 3600\n'))
+    assert for_job(family, family.jobs_by_name["J1"]) == {'max_rss': 512, 'nice': 2, 'max_runtime': 60}
+    assert for_job(family, family.jobs_by_name["J2"]) == {'max_rss': 512, 'nice': 10, 'max_runtime': 3600}
+
+
+def test_timeout_stops_the_whole_process_group(tmp_path, monkeypatch):
+    monkeypatch.setattr(limits, "TERM_GRACE_SECONDS", 0.5)
+    log_dir = os.path.join(tmp_path, "20240214")
+    os.makedirs(log_dir)
+    # ignores SIGTERM, prints nothing, and leaves a grandchild behind
+    write_script(tmp_path, "J1", f"trap '' TERM\n(sleep 600 & echo $! > {tmp_path}/grandchild; wait)\nsleep 600")
+    info_path = os.path.join(log_dir, "F1.J1.default.w.20240214021400.info")
+
+    started = time.monotonic()
+    run(log_dir, str(tmp_path), "America/Denver", "F1", "J1", "America/Denver", "default", 0, 0,
+        os.path.join(log_dir, "F1.J1.log"), info_path, False, None, None, {'max_runtime': 1})
+    assert time.monotonic() - started < 10
+
+    doc = tomlkit.loads(pathlib.Path(info_path).read_text())
+    assert doc['limit_exceeded'] == "max_runtime"
+    assert job_result_from_info(doc).status.value == "Timed Out"
+
+    grandchild = int(pathlib.Path(tmp_path, "grandchild").read_text())
+    time.sleep(0.2)
+    try:
+        os.kill(grandchild, 0)
+        with open(f"/proc/{grandchild}/stat") as f:
+            # only a zombie until its parent (init) reaps it
+            assert f.read().split()[2] == "Z"
+    except (ProcessLookupError, FileNotFoundError):
+        pass
+
+
+def test_info_is_replaced_whole_at_each_state_change(tmp_path, monkeypatch):
+    log_dir = os.path.join(tmp_path, "20240214")
+    os.makedirs(log_dir)
+    write_script(tmp_path, "J1", "exit 3")
+    info_path = os.path.join(log_dir, "F1.J1.default.w.20240214021400.info")
+    writes = []
+    original_replace = os.replace
+
+    def replace(src, dst):
+        if dst == info_path:
+            writes.append(pathlib.Path(src).read_text())
+        original_replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", replace)
+    fsyncs = []
+    original_fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: fsyncs.append(fd) or original_fsync(fd))
+
+    run(log_dir, str(tmp_path), "America/Denver", "F1", "J1", "America/Denver", "default", 1, 0,
+        os.path.join(log_dir, "F1.J1.log"), info_path, info_fsync="final")
+
+    # started, waiting to retry, started again, failed
+    records = [tomlkit.loads(text) for text in writes]
+    assert [r.get('error_code') for r in records] == [None, 3, None, 3]
+    assert 'retry_wait_until' in records[1] and 'retry_wait_until' not in records[3]
+    assert all(r['schema_version'] == job_info.SCHEMA_VERSION for r in records)
+    # the file and the directory, for the last record only
+    assert len(fsyncs) == 2
+    assert not [f for f in os.listdir(log_dir) if f.endswith(".tmp")]
+    assert job_result_from_info(tomlkit.loads(pathlib.Path(info_path).read_text())).error_code == 3
@@ -1,7 +1,12 @@
+import datetime
+import json
 import os
 import pathlib
+import subprocess
+import sys
 
 import pytest
+import pytz
 import tomlkit
 
 import pytf.dirs as dirs
@@ -21,3 +26,113 @@ from pytf.holdAndRelease import (hold, remove_hold, release_dependencies)
 from pytf.rerun import rerun
 from pytf.pytftoken import PyTfToken
 
+import multiprocessing
+
+from pytf.runner import prepare_required_dirs
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIG = """
+primary_tz = "America/Denver"
+tokens.T1 = 2
+tokens.T2 = 1
+token_lease = 300
+"""
+
+
+@pytest.fixture
+def token_config(tmp_path):
+    config = Config.from_str(CONFIG)
+    config.log_dir = os.path.join(tmp_path, 'log_dir')
+    config.family_dir = os.path.join(tmp_path, 'family_dir')
+    dirs.make_dir(config.log_dir)
+    dirs.make_dir(config.family_dir)
+    MockDateTime.set_mock(2024, 2, 14, 2, 14, 0, 'America/Denver')
+    prepare_required_dirs(config)
+    return config
+
+
+def holders(config):
+    return [(str(t['token_name']), str(t['family_name']), str(t['job_name']))
+            for t in PyTfToken.current_token_document(config).get('token', [])]
+
+
+def wanted(*holdings):
+    doc = tomlkit.document()
+    aot = tomlkit.aot()
+    for token_name, family_name, job_name in holdings:
+        aot.append({'token_name': token_name, 'family_name': family_name, 'job_name': job_name})
+    doc.append('token', aot)
+    return doc
+
+
+def grab(config, job_name):
+    with PyTfToken.lock(config):
+        return PyTfToken._acquire(config, "F1", job_name, ["T1"])
+
+
+def test_processes_never_oversubscribe(token_config):
+    with multiprocessing.get_context("fork").Pool(4) as pool:
+        results = pool.starmap(grab, [(token_config, f"J{i}") for i in range(8)])
+    assert results.count(True) == 2
+    assert len(holders(token_config)) == 2
+
+
+def test_save_only_writes_the_difference(token_config):
+    assert PyTfToken.save_token_document(token_config, wanted(("T1", "F1", "J1"))) == set()
+    lease_dir = os.path.join(token_config.log_dir, "tokens")
+    first = {name: os.stat(os.path.join(lease_dir, name)).st_ino for name in os.listdir(lease_dir)}
+
+    doc = wanted(("T1", "F1", "J1"), ("T1", "F1", "J2"), ("T2", "F1", "J2"), ("T1", "F2", "J1"), ("T2", "F2", "J1"))
+    # F2::J1 can't get T2, so it doesn't keep its T1 either
+    assert PyTfToken.save_token_document(token_config, doc) == {("F2", "J1")}
+    assert sorted(holders(token_config)) == [("T1", "F1", "J1"), ("T1", "F1", "J2"), ("T2", "F1", "J2")]
+    assert all(os.stat(os.path.join(lease_dir, name)).st_ino == ino for name, ino in first.items())
+
+    PyTfToken.save_token_document(token_config, wanted(("T1", "F1", "J2"), ("T2", "F1", "J2")))
+    assert sorted(holders(token_config)) == [("T1", "F1", "J2"), ("T2", "F1", "J2")]
+
+
+def test_finished_and_lost_holders_are_reclaimed(token_config):
+    PyTfToken.save_token_document(token_config, wanted(("T1", "F1", "DONE"), ("T1", "F1", "LOST"),
+                                                       ("T2", "F1", "QUEUED")))
+    with open(os.path.join(token_config.todays_log_dir, "F1.DONE.q.w.20240214021400.info"), "w") as f:
+        f.write('family_name = "F1"\njob_name = "DONE"\nerror_code = 0\n')
+    with open(os.path.join(token_config.todays_log_dir, "F1.QUEUED.queued"), "w") as f:
+        f.write("default\n")
+
+    PyTfToken.update_token_usage(token_config)
+    assert sorted(holders(token_config)) == [("T1", "F1", "LOST"), ("T2", "F1", "QUEUED")]
+
+    MockDateTime.set_mock(2024, 2, 14, 2, 20, 0, 'America/Denver')
+    PyTfToken.update_token_usage(token_config)
+    assert holders(token_config) == [("T2", "F1", "QUEUED")]
+
+
+def test_token_usage_file_is_imported(token_config):
+    with open(os.path.join(token_config.log_dir, "token_usage.toml"), "w") as f:
+        f.write('[[token]]\ntoken_name = "T1"\nfamily_name = "F1"\njob_name = "J1"\n')
+    PyTfToken.update_token_usage(token_config)
+    assert not os.path.exists(os.path.join(token_config.log_dir, "token_usage.toml"))
+    assert holders(token_config) == [("T1", "F1", "J1")]
+
+
+@pytest.mark.parametrize("day_dir_exists", [False, True])
+def test_cli_starts_with_a_lease_held(tmp_path, day_dir_exists):
+    # the CLI reclaims leases before it has set up today's dirs
+    for sub_dir in ("logs", "families", "jobs", "instructions", "logs/tokens"):
+        os.makedirs(os.path.join(tmp_path, sub_dir))
+    with open(os.path.join(tmp_path, "config"), "w") as f:
+        f.write('primary_tz = "UTC"\ntokens.T1 = 1\n')
+    with open(os.path.join(tmp_path, "logs", "tokens", "T1.0.lease"), "w") as f:
+        json.dump({'token_name': "T1", 'family_name': "F1", 'job_name': "J1", 'holder': "h-1",
+                   'granted': 0, 'lease_expires': 0}, f)
+    if day_dir_exists:
+        os.makedirs(dirs.dated_subdir(os.path.join(tmp_path, "logs"), datetime.datetime.now(pytz.UTC)))
+
+    result = subprocess.run([sys.executable, "pytf.py", "--root", str(tmp_path), "status", "--json"],
+                            cwd=REPO_DIR, capture_output=True, text=True)
+
+    assert result.returncode == 0, result.stderr
+    # lost holders are reclaimed once there's a day dir to look in
+    assert os.path.exists(os.path.join(tmp_path, "logs", "tokens", "T1.0.lease")) != day_dir_exists
@@ -0,0 +1,158 @@
+import os
+
+import pytest
+
+import pytf.dirs as dirs
+import pytf.exceptions as ex
+import pytf.logs as logs
+import pytf.sharding as sharding
+from pytf.config import Config
+from pytf.config_reload import reload
+from pytf.main import main_function
+from pytf.mockdatetime import MockDateTime
+from pytf.rerun import rerun
+from pytf.runner import prepare_required_dirs
+from pytf.status import status
+
+CONFIG = """
+primary_tz = "America/Denver"
+max_outstanding.slow = 1
+tokens.T1 = 1
+"""
+
+
+@pytest.fixture
+def queue_config(tmp_path):
+    config = Config.from_str(CONFIG)
+    config.log_dir = os.path.join(tmp_path, 'log_dir')
+    config.family_dir = os.path.join(tmp_path, 'family_dir')
+    dirs.make_dir(config.log_dir)
+    dirs.make_dir(config.family_dir)
+    MockDateTime.set_mock(2024, 2, 14, 2, 14, 0, 'America/Denver')
+    return config
+
+
+def write_families(config, families):
+    for name, text in families.items():
+        with open(os.path.join(config.family_dir, name), "w") as f:
+            f.write(text)
+    prepare_required_dirs(config)
+    dirs.copy_files_from_dir_to_dir(config.family_dir, config.todays_family_dir)
+
+
+def start_job(config, family_name, job_name, error_code=None):
+    """
+    What the worker does: write the .info file, then remove the .queued file.
+    """
+    with open(os.path.join(config.todays_log_dir, f"{family_name}.{job_name}.slow.w.20240214010000.info"), "w") as f:
+        f.write(f'family_name = "{family_name}"\njob_name = "{job_name}"\ntz = "America/Denver"\n'
+                f'queue_name = "slow"\nnum_retries = 0\nretry_sleep = 0\nworker_name = "w"\n'
+                f'start_time = "2024/02/14 01:00:00"\n')
+        if error_code is not None:
+            f.write(f"error_code = {error_code}\n")
+    logs.remove_queued(config.todays_log_dir, family_name, job_name)
+
+
+def statuses(config):
+    return {f"{j['family_name']}::{j['job_name']}": j['status'] for j in status(config)['status']['flat_list']}
+
+
+def test_queue_is_limited_to_max_outstanding(queue_config, executor):
+    write_families(queue_config, {"F1": 'start="0100"\nJ1(queue="slow") J2(queue="slow") J3(queue="slow")\n',
+                                  "F2": 'start="0100"\nJ1() J2()\n'})
+
+    main_function(queue_config, executor)
+    assert executor.calls == [("F1", "J1"), ("F2", "J1"), ("F2", "J2")]
+    assert statuses(queue_config) == {"F1::J1": "Queued", "F1::J2": "Queue Wait", "F1::J3": "Queue Wait",
+                                      "F2::J1": "Queued", "F2::J2": "Queued"}
+
+    # nothing is sent twice while it waits in the broker
+    main_function(queue_config, executor)
+    assert len(executor.calls) == 3
+
+    start_job(queue_config, "F1", "J1")
+    main_function(queue_config, executor)
+    assert len(executor.calls) == 3
+    assert statuses(queue_config)["F1::J1"] == "Running"
+
+    start_job(queue_config, "F1", "J1", error_code=0)
+    main_function(queue_config, executor)
+    assert executor.calls[3:] == [("F1", "J2")]
+
+
+def test_token_wait_leaves_the_slot_to_the_next_job(queue_config, executor):
+    write_families(queue_config, {"F0": 'start="0100"\nJ1(tokens=["T1"])\n',
+                                  "F1": 'start="0100"\nJ1(tokens=["T1"], queue="slow") J2(queue="slow")\n'})
+    tick_status = main_function(queue_config, executor)
+    # F0::J1 is evaluated first and gets the token, so F1::J2 gets the slot
+    assert [j['status'] for j in tick_status['status']['flat_list']] == ["Ready", "Token Wait", "Ready"]
+    assert executor.calls == [("F0", "J1"), ("F1", "J2")]
+    assert statuses(queue_config) == {"F0::J1": "Queued", "F1::J1": "Queue Wait", "F1::J2": "Queued"}
+
+
+def test_zero_pauses_the_queue(queue_config, executor):
+    write_families(queue_config, {"F1": 'start="0100"\nJ1(queue="slow")\n'})
+    reload(queue_config, CONFIG.replace("max_outstanding.slow = 1", "max_outstanding.slow = 0"))
+    main_function(queue_config, executor)
+    assert executor.calls == []
+    assert statuses(queue_config) == {"F1::J1": "Queue Wait"}
+
+
+def test_rerun_sends_a_lost_job_again(queue_config, executor):
+    write_families(queue_config, {"F1": 'start="0100"\nJ1(queue="slow")\n'})
+    main_function(queue_config, executor)
+    assert statuses(queue_config) == {"F1::J1": "Queued"}
+
+    rerun(queue_config, "F1", "J1")
+    assert statuses(queue_config) == {"F1::J1": "Ready"}
+    main_function(queue_config, executor)
+    assert executor.calls == [("F1", "J1"), ("F1", "J1")]
+
+
+def test_a_job_no_worker_started_is_sent_again(queue_config, executor):
+    queue_config.queued_timeout = 600
+    write_families(queue_config, {"F1": 'start="0100"\nJ1(queue="slow")\n', "F2": 'start="0100"\nJ1(queue="slow")\n'})
+    main_function(queue_config, executor)
+    assert executor.calls == [("F1", "J1")]
+
+    # the broker lost it; it holds the queue's only slot until it times out
+    MockDateTime.set_mock(2024, 2, 14, 2, 23, 0, 'America/Denver')
+    main_function(queue_config, executor)
+    assert statuses(queue_config) == {"F1::J1": "Queued", "F2::J1": "Queue Wait"}
+
+    MockDateTime.set_mock(2024, 2, 14, 2, 25, 0, 'America/Denver')
+    main_function(queue_config, executor)
+    assert len(executor.calls) == 2
+    assert sorted(statuses(queue_config).values()) == ["Queue Wait", "Queued"]
+
+
+@pytest.mark.parametrize("shard", [None, "s1"])
+def test_failed_send_is_not_counted(queue_config, shard, executor):
+    class FailingExecutor:
+        def apply_async(self, args, queue):
+            raise ConnectionError("broker is down")
+
+    if shard is not None:
+        queue_config.shards = [shard]
+        queue_config.shard = shard
+    write_families(queue_config, {"F1": 'start="0100"\nJ1(queue="slow")\n'})
+    with pytest.raises(ConnectionError):
+        main_function(queue_config, FailingExecutor())
+    assert statuses(queue_config) == {"F1::J1": "Ready"}
+    assert not os.path.exists(sharding.claim_file(queue_config.todays_log_dir, "F1", "J1"))
+
+    # the next tick sends it
+    main_function(queue_config, executor)
+    assert executor.calls == [("F1", "J1")]
+
+
+def test_invalid_queued_timeout_is_rejected(queue_config):
+    with pytest.raises(ex.PyTaskforestParseException) as exc_info:
+        reload(queue_config, CONFIG + "queued_timeout = 0\n")
+    assert str(exc_info.value) == f"{ex.MSG_CONFIG_INVALID_VALUE} queued_timeout = 0"
+
+
+def test_invalid_limit_is_rejected(queue_config):
+    with pytest.raises(ex.PyTaskforestParseException) as exc_info:
+        reload(queue_config, CONFIG.replace("max_outstanding.slow = 1", "max_outstanding.slow = -1"))
+    assert str(exc_info.value) == f"{ex.MSG_CONFIG_INVALID_VALUE} max_outstanding.slow = -1"
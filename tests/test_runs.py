@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+import pytf.archive as archive
+import pytf.dirs as dirs
+import pytf.history as history
+import pytf.runs as runs
+from pytf.config import Config
+from pytf.logs import get_logged_job_results
+from pytf.main import main_function
+from pytf.mark import mark
+from pytf.mockdatetime import MockDateTime
+from pytf.pytf_worker import run
+from pytf.rerun import rerun
+from pytf.runner import prepare_required_dirs
+
+
+@pytest.fixture
+def runs_config(tmp_path):
+    config = Config.from_str('primary_tz = "America/Denver"\n')
+    config.log_dir = os.path.join(tmp_path, 'log_dir')
+    config.family_dir = os.path.join(tmp_path, 'family_dir')
+    config.job_dir = os.path.join(tmp_path, 'job_dir')
+    for d in (config.log_dir, config.family_dir, config.job_dir):
+        dirs.make_dir(d)
+    MockDateTime.set_mock(2024, 2, 14, 2, 14, 0, 'America/Denver')
+    prepare_required_dirs(config)
+    return config
+
+
+def run_instance(config, job_name, exit_code):
+    script_path = os.path.join(config.job_dir, job_name)
+    with open(script_path, "w") as f:
+        f.write(f"#!/bin/bash\necho output of {job_name}\nexit {exit_code}\n")
+    os.chmod(script_path, 0o755)
+    run(config.todays_log_dir, config.job_dir, config.primary_tz, "F1", job_name, "America/Denver", "default",
+        0, 0, os.path.join(config.todays_log_dir, "F1.J1.log"), runs.runs_path(config.todays_log_dir, "F1", "J1"))
+
+
+def logged(config):
+    _, job_dict = get_logged_job_results(config.todays_log_dir)
+    return {name: result.status.value for name, result in job_dict.get("F1", {}).items()}
+
+
+def test_instances_share_one_record_and_log(runs_config):
+    run_instance(runs_config, "J1-0100", 0)
+    run_instance(runs_config, "J1-0115", 3)
+
+    assert sorted(os.listdir(runs_config.todays_log_dir)) == ["F1.J1.log", "F1.J1.runs"]
+    assert logged(runs_config) == {"J1-0100": "Success", "J1-0115": "Failure"}
+
+    day = os.path.basename(runs_config.todays_log_dir)
+    files = archive.job_files(runs_config, day, "F1", "J1-0115")
+    assert list(files['info']) == ["F1.J1.runs:J1-0115"]
+    assert "error_code = 3" in files['info']["F1.J1.runs:J1-0115"]
+    assert "output of J1-0115" in files['log']
+    assert "J1-0100" not in files['log']
+    assert "output of J1-0100" in archive.job_files(runs_config, day, "F1", "J1")['log']
+
+    assert history.index_day(runs_config, day) == 2
+
+
+def test_mark_and_rerun_an_instance(runs_config):
+    run_instance(runs_config, "J1-0100", 0)
+    mark(runs_config, "F1", "J1-0100", 1)
+    assert logged(runs_config) == {"J1-0100": "Failure"}
+
+    rerun(runs_config, "F1", "J1-0100")
+    assert logged(runs_config) == {"J1-0100-Orig-1": "Failure"}
+    assert os.path.exists(os.path.join(runs_config.todays_log_dir, "F1.J1-0100.release"))
+
+    run_instance(runs_config, "J1-0100", 0)
+    rerun(runs_config, "F1", "J1-0100")
+    assert logged(runs_config) == {"J1-0100-Orig-1": "Failure", "J1-0100-Orig-2": "Success"}
+
+    # the rerun's log is still the lines that instance wrote
+    day = os.path.basename(runs_config.todays_log_dir)
+    assert "output of J1-0100" in archive.job_files(runs_config, day, "F1", "J1-0100-Orig-2")['log']
+
+
+def test_instances_reads_only_what_was_appended(tmp_path):
+    path = os.path.join(tmp_path, "F1.J1.runs")
+    runs.append(path, {"job_name": "J1-0100", "start_time": "a"})
+    assert list(runs.instances(path)) == ["J1-0100"]
+
+    with open(path, "a") as f:
+        f.write('{"job_name": "J1-0115"')
+    assert list(runs.instances(path)) == ["J1-0100"]
+    with open(path, "a") as f:
+        f.write(', "start_time": "b"}\n')
+    assert list(runs.instances(path)) == ["J1-0100", "J1-0115"]
+
+    runs.append(path, {"job_name": "J1-0100", "removed": True})
+    assert list(runs.instances(path)) == ["J1-0115"]
+
+    # replaced, e.g. by a restore from an archive
+    os.remove(path)
+    runs.append(path, {"job_name": "J1-0130"})
+    assert list(runs.instances(path)) == ["J1-0130"]
+
+
+def test_scheduler_sends_instances_to_the_runs_file(runs_config, executor):
+    with open(os.path.join(runs_config.family_dir, "F1"), "w") as f:
+        f.write('start="0100"\nJ1(start="0100", every=3600, until="0300")\n')
+    dirs.copy_files_from_dir_to_dir(runs_config.family_dir, runs_config.todays_family_dir)
+    main_function(runs_config, executor)
+    assert executor.calls == [("F1", "J1-0100"), ("F1", "J1-0200")]
+    assert [(os.path.basename(args[9]), os.path.basename(args[10])) for args in executor.args] == \
+        [("F1.J1.log", "F1.J1.runs"), ("F1.J1.log", "F1.J1.runs")]
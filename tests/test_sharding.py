@@ -0,0 +1,144 @@
+import os
+
+import attrs
+import pytest
+
+import pytf.dirs as dirs
+import pytf.exceptions as ex
+import pytf.sharding as sharding
+from pytf.config import Config
+from pytf.family import get_families_from_dir
+from pytf.main import main_function
+from pytf.mockdatetime import MockDateTime
+from pytf.rerun import rerun
+from pytf.runner import prepare_required_dirs
+
+
+@pytest.fixture
+def shard_config(tmp_path):
+    config = Config.from_str("""
+    primary_tz = "America/Denver"
+    shards = ["a", "b"]
+    tokens.T1 = 1
+    """)
+    config.log_dir = os.path.join(tmp_path, 'log_dir')
+    config.family_dir = os.path.join(tmp_path, 'family_dir')
+    dirs.make_dir(config.log_dir)
+    dirs.make_dir(config.family_dir)
+    MockDateTime.set_mock(2024, 2, 14, 2, 14, 0, 'America/Denver')
+    return config
+
+
+def family_owned_by(config, shard, exclude=()):
+    ring = sharding.ring_for(config)
+    return next(f"F{i}" for i in range(1000) if ring.owner(f"F{i}") == shard and f"F{i}" not in exclude)
+
+
+def write_families(config, families):
+    for name, text in families.items():
+        with open(os.path.join(config.family_dir, name), "w") as f:
+            f.write(text)
+    prepare_required_dirs(config)
+    dirs.copy_files_from_dir_to_dir(config.family_dir, config.todays_family_dir)
+
+
+def as_shard(config, shard):
+    return attrs.evolve(config, shard=shard)
+
+
+def test_ring_is_deterministic_and_balanced():
+    ring = sharding.HashRing(shards=("a", "b", "c"))
+    owners = [ring.owner(f"F{i}") for i in range(3000)]
+    assert owners == [sharding.HashRing(shards=("a", "b", "c")).owner(f"F{i}") for i in range(3000)]
+    for shard in ("a", "b", "c"):
+        assert 700 < owners.count(shard) < 1300
+
+
+def test_adding_a_shard_only_moves_families_to_it():
+    before = sharding.HashRing(shards=("a", "b", "c"))
+    after = sharding.HashRing(shards=("a", "b", "c", "d"))
+    moved = [f"F{i}" for i in range(3000) if before.owner(f"F{i}") != after.owner(f"F{i}")]
+    assert all(after.owner(name) == "d" for name in moved)
+    assert 500 < len(moved) < 1000
+
+
+def test_owns_family(shard_config):
+    assert sharding.owns_family(shard_config, "anything")
+    shard_config.shard = "z"
+    with pytest.raises(ex.PyTaskforestParseException) as exc_info:
+        sharding.owns_family(shard_config, "anything")
+    assert str(exc_info.value) == f"{ex.MSG_CONFIG_UNKNOWN_SHARD} z"
+
+
+def test_families_are_split(shard_config):
+    fa = family_owned_by(shard_config, "a")
+    fb = family_owned_by(shard_config, "b")
+    write_families(shard_config, {fa: 'start="0100"\nJ1()\n', fb: 'start="0100"\nJ1()\n'})
+    assert [f.name for f in get_families_from_dir(shard_config.todays_family_dir, as_shard(shard_config, "a"))] == [fa]
+    assert [f.name for f in get_families_from_dir(shard_config.todays_family_dir, as_shard(shard_config, "b"))] == [fb]
+    assert len(get_families_from_dir(shard_config.todays_family_dir, shard_config)) == 2
+
+
+def test_claims(shard_config):
+    prepare_required_dirs(shard_config)
+    shard_config.shard = "a"
+    assert sharding.claim(shard_config, "F1", "J1")
+    assert not sharding.claim(as_shard(shard_config, "b"), "F1", "J1")
+    sharding.release_claim(shard_config.todays_log_dir, "F1", "J1")
+    assert sharding.claim(shard_config, "F1", "J1")
+
+
+def test_two_shards_dispatch_each_job_once(shard_config, executor):
+    fa = family_owned_by(shard_config, "a")
+    fb = family_owned_by(shard_config, "b")
+    write_families(shard_config, {fa: 'start="0100"\nJ1()\n', fb: 'start="0100"\nJ2()\n'})
+    for shard in ("a", "b", "a", "b"):
+        main_function(as_shard(shard_config, shard), executor)
+    assert sorted(executor.calls) == sorted([(fa, "J1"), (fb, "J2")])
+
+
+def test_stale_ring_does_not_double_dispatch(shard_config, executor):
+    # a scheduler that still thinks it owns fa (e.g. before it's restarted with the new shard list)
+    fa = family_owned_by(shard_config, "a")
+    write_families(shard_config, {fa: 'start="0100"\nJ1()\n'})
+    main_function(as_shard(shard_config, "a"), executor)
+    main_function(attrs.evolve(shard_config, shards=["a"], shard="a"), executor)
+    assert executor.calls == [(fa, "J1")]
+
+
+def test_shared_token_across_shards(shard_config, executor):
+    fa = family_owned_by(shard_config, "a")
+    fb = family_owned_by(shard_config, "b")
+    write_families(shard_config, {fa: 'start="0100"\nJ1(tokens=["T1"])\n', fb: 'start="0100"\nJ2(tokens=["T1"])\n'})
+    main_function(as_shard(shard_config, "a"), executor)
+    main_function(as_shard(shard_config, "b"), executor)
+    assert executor.calls == [(fa, "J1")]
+
+
+def test_cross_shard_external_dependency(shard_config, executor):
+    fa = family_owned_by(shard_config, "a")
+    fb = family_owned_by(shard_config, "b")
+    write_families(shard_config, {fa: 'start="0100"\nJ1()\n', fb: f'start="0100"\n{fa}::J1()\nJ2()\n'})
+    main_function(as_shard(shard_config, "b"), executor)
+    assert executor.calls == []
+
+    with open(os.path.join(shard_config.todays_log_dir, f"{fa}.J1.default.w.20240214011000.info"), "w") as f:
+        f.write(f'family_name = "{fa}"\njob_name = "J1"\ntz = "America/Denver"\nqueue_name = "default"\n'
+                'num_retries = 0\nretry_sleep = 0\nworker_name = "w"\nstart_time = "2024/02/14 01:10:00"\n'
+                'error_code = 0\n')
+    main_function(as_shard(shard_config, "b"), executor)
+    assert executor.calls == [(fb, "J2")]
+
+
+def test_rerun_releases_claim(shard_config, executor):
+    fa = family_owned_by(shard_config, "a")
+    write_families(shard_config, {fa: 'start="0100"\nJ1()\n'})
+    config = as_shard(shard_config, "a")
+    main_function(config, executor)
+    with open(os.path.join(config.todays_log_dir, f"{fa}.J1.default.w.20240214011000.info"), "w") as f:
+        f.write(f'family_name = "{fa}"\njob_name = "J1"\ntz = "America/Denver"\nqueue_name = "default"\n'
+                'num_retries = 0\nretry_sleep = 0\nworker_name = "w"\nstart_time = "2024/02/14 01:10:00"\n'
+                'error_code = 1\n')
+    rerun(config, fa, "J1")
+    main_function(config, executor)
+    assert executor.calls == [(fa, "J1"), (fa, "J1")]
@@ -0,0 +1,122 @@
+import datetime
+import os
+
+import pytest
+
+import pytf.dirs as dirs
+import pytf.exceptions as ex
+from pytf.config import Config
+from pytf.mockdatetime import MockDateTime
+from pytf.simulate import simulate, load_historical_runs, _base_job_name
+
+
+@pytest.fixture
+def sim_config():
+    return Config.from_str("""
+    primary_tz = "America/Denver"
+    end_time_hr = 3
+    end_time_min = 0
+    tokens.T1 = 1
+
+    [simulation]
+    default_duration = 60
+    seed = 1
+    queue_concurrency = { default = 2 }
+
+    [simulation.durations]
+    "F1::J1" = 600
+    "F1::J2" = [300, 300]
+    """)
+
+
+def prep_sim_root(tmp_path, config, families):
+    config.log_dir = os.path.join(tmp_path, 'log_dir')
+    config.family_dir = os.path.join(tmp_path, 'family_dir')
+    dirs.make_dir(config.log_dir)
+    dirs.make_dir(config.family_dir)
+    for name, family_str in families.items():
+        with open(os.path.join(config.family_dir, name), "w") as f:
+            f.write(family_str)
+
+
+def test_simulate_runs_whole_day(sim_config, tmp_path):
+    prep_sim_root(tmp_path, sim_config, {
+        "F1": """start="0100"
+        J1(tokens=["T1"]) J2(tokens=["T1"])
+        J3()
+        """,
+        "F2": """start="0200"
+        J4()
+        """,
+    })
+    report = simulate(sim_config, "20240214")
+    assert report['jobs_completed'] == 4
+    assert report['never_ran'] == []
+    assert report['unfinished'] == []
+    # first dispatch at 01:00:00, J4 starts on the 02:00:10 tick and runs for 60s
+    assert report['makespan_seconds'] == 3670
+    assert report['duplicate_dispatches'] == 0
+    # J2 waits on T1 for J1's 600s plus a tick for each hand-off
+    assert report['token_contention']['T1']['jobs'] == ['F1::J2']
+    assert report['token_contention']['T1']['wait_seconds'] == 610
+    assert report['scheduler_cpu_per_tick']['ticks'] == 3 * 360 + 1
+
+
+def test_simulate_reports_jobs_that_never_ran(sim_config, tmp_path):
+    prep_sim_root(tmp_path, sim_config, {
+        "F1": """start="0100"
+        J1()
+        J5(start="0400")
+        """,
+    })
+    report = simulate(sim_config, "20240214")
+    assert report['jobs_completed'] == 1
+    assert report['never_ran'] == ['F1::J5 (Waiting)']
+
+
+def test_simulate_writes_nothing_to_real_root(sim_config, tmp_path):
+    prep_sim_root(tmp_path, sim_config, {"F1": """start="0100"
+        J1()
+        """})
+    simulate(sim_config, "20240214")
+    assert os.listdir(sim_config.log_dir) == []
+    assert os.listdir(sim_config.family_dir) == ['F1']
+    assert MockDateTime._mock_now is None
+
+
+def test_simulate_queue_waits(sim_config, tmp_path):
+    prep_sim_root(tmp_path, sim_config, {"F1": """start="0100"
+        J6() J7() J8()
+        """})
+    report = simulate(sim_config, "20240214")
+    assert report['queue_waits']['default']['jobs'] == 3
+    # J8 waits a tick for the broker, then 60s for a slot
+    assert report['queue_waits']['default']['max_seconds'] == 70
+
+
+def test_simulate_invalid_date(sim_config, tmp_path):
+    prep_sim_root(tmp_path, sim_config, {})
+    with pytest.raises(ex.PyTaskforestParseException) as exc_info:
+        simulate(sim_config, "2024-02-14")
+    assert str(exc_info.value) == f"{ex.MSG_SIMULATE_INVALID_DATE} 2024-02-14"
+
+
+def test_load_historical_runs(sim_config, tmp_path):
+    prep_sim_root(tmp_path, sim_config, {})
+    log_dir = os.path.join(sim_config.log_dir, "20240213")
+    dirs.make_dir(log_dir)
+    with open(os.path.join(log_dir, "F1.J1-0100.default.x.20240213010000.info"), "w") as f:
+        f.write('family_name = "F1"\n')
+        f.write('job_name = "J1-0100"\n')
+        f.write('tz = "America/Denver"\n')
+        f.write('start_time = "2024/02/13 01:00:00"\n')
+        f.write('end_time = "2024/02/13 01:02:30"\n')
+        f.write('error_code = 3\n')
+    history = load_historical_runs(sim_config, datetime.datetime(2024, 2, 14), 5)
+    assert history == {"F1::J1": [(150, 3)]}
+
+
+def test_base_job_name():
+    assert _base_job_name("J1-0930") == "J1"
+    assert _base_job_name("J1-Orig-2") == "J1"
+    assert _base_job_name("J1_2") == "J1_2"
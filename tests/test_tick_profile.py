@@ -0,0 +1,89 @@
+import logging
+import os
+import threading
+
+import pytest
+
+import pytf.dirs as dirs
+import pytf.logs as logs
+import pytf.tick_profile as tick_profile
+import pytf.tick_stats as tick_stats
+from pytf.config import Config
+from pytf.mockdatetime import MockDateTime
+from pytf.pytftoken import PyTfToken
+from pytf.runner import prepare_required_dirs
+
+
+@pytest.fixture
+def profile_config(tmp_path):
+    config = Config.from_str('primary_tz = "America/Denver"\ntokens.T1 = 1\n')
+    config.log_dir = os.path.join(tmp_path, 'log_dir')
+    config.family_dir = os.path.join(tmp_path, 'family_dir')
+    config.job_dir = os.path.join(tmp_path, 'job_dir')
+    for d in (config.log_dir, config.family_dir, config.job_dir):
+        dirs.make_dir(d)
+    with open(os.path.join(config.family_dir, "F1"), "w") as f:
+        f.write('start="0000"\nJ1(tokens=["T1"]) J2()\nJ3()\n')
+    MockDateTime.set_mock(2024, 2, 14, 2, 14, 0, 'America/Denver')
+    prepare_required_dirs(config)
+    yield config
+    MockDateTime.reset_mock_now()
+    tick_stats.reset()
+    for handler in list(logging.getLogger().handlers):
+        logging.getLogger().removeHandler(handler)
+
+
+def test_profile_writes_reports_and_leaves_the_root_alone(profile_config, tmp_path):
+    out_dir = os.path.join(tmp_path, "profile")
+    before = sorted(os.walk(profile_config.log_dir))
+
+    summary = tick_profile.profile(profile_config, 3, out_dir, top=5)
+
+    assert sorted(os.walk(profile_config.log_dir)) == before
+    assert summary['ticks'] == 3 and len(summary['tick_seconds']) == 3
+    assert {tick_stats.PHASE_FAMILY_PARSE, tick_stats.PHASE_LOG_SCAN, tick_stats.PHASE_DEPENDENCY_EVAL,
+            tick_stats.PHASE_TOKEN_ACCOUNTING, tick_stats.PHASE_DISPATCH} <= set(summary['phase_seconds'])
+    for path in summary['files'].values():
+        assert os.path.getsize(path) > 0 or path.endswith("stacks.folded")
+    with open(summary['files']['hotspots.txt']) as f:
+        assert "status_and_families_and_token_doc" in f.read()
+    with open(summary['files']['allocations.txt']) as f:
+        assert "Top 5 lines by memory held at the end of the last tick" in f.read()
+
+
+def test_samples_are_tagged_with_the_phase():
+    sampler = tick_profile.StackSampler(threading.get_ident(), test_samples_are_tagged_with_the_phase.__code__)
+    tick_stats.start_tick()
+    try:
+        with tick_stats.phase(tick_stats.PHASE_LOG_SCAN):
+            sampler.sample()
+        sampler.sample()
+    finally:
+        tick_stats.end_tick(10)
+        tick_stats.reset()
+    assert sampler.stacks == {"phase:log_scan;pytf.tick_profile:StackSampler.sample": 1,
+                              "phase:other;pytf.tick_profile:StackSampler.sample": 1}
+    assert tick_stats.current_phase() is None
+
+
+def test_scratch_copy_leaves_out_job_logs(profile_config, tmp_path):
+    for file_name in ("F1.J1.default.w.20240214010000.info", "F1.J2.hold", "token_waits.json", "F1.J1.log"):
+        with open(os.path.join(profile_config.todays_log_dir, file_name), "w") as f:
+            f.write("{}")
+
+    scratch_config = tick_profile._scratch_config(profile_config, str(tmp_path / "scratch"))
+
+    assert sorted(os.listdir(scratch_config.todays_log_dir)) == \
+        ["F1.J1.default.w.20240214010000.info", "F1.J2.hold", "token_waits.json"]
+
+
+def test_dry_run_undoes_the_dispatch(profile_config):
+    with PyTfToken.lock(profile_config):
+        assert PyTfToken._acquire(profile_config, "F1", "J1", ["T1"])
+    logs.mark_queued(profile_config.todays_log_dir, "F1", "J1", "default", 0)
+
+    args = [profile_config.todays_log_dir, None, None, "F1", "J1"]
+    tick_profile.DryRunExecutor(profile_config).apply_async(args=args, queue="default")
+
+    assert logs.get_queued_jobs(profile_config.todays_log_dir) == {}
+    assert PyTfToken.current_token_document(profile_config).get('token') is None
@@ -0,0 +1,129 @@
+import os
+
+import pytest
+
+import pytf.dirs as dirs
+import pytf.tick_stats as tick_stats
+from pytf.config import Config
+from pytf.main import run_main_loop_until_end, main_function
+from pytf.mockdatetime import MockDateTime
+from pytf.runner import prepare_required_dirs
+
+
+@pytest.fixture(autouse=True)
+def clean_ring_buffer():
+    tick_stats.reset()
+    yield
+    tick_stats.reset()
+
+
+@pytest.fixture
+def once_config():
+    return Config.from_str("""
+    primary_tz = "America/Denver"
+    once_only = true
+    tokens.T1 = 1
+    """)
+
+
+def test_phase_and_count_outside_tick_are_noops():
+    with tick_stats.phase(tick_stats.PHASE_LOG_SCAN):
+        tick_stats.count(tick_stats.COUNTER_INFO_FILES_READ)
+    assert tick_stats.end_tick(10) is None
+    assert tick_stats.recent() == []
+
+
+def test_phases_accumulate():
+    tick_stats.start_tick()
+    with tick_stats.phase(tick_stats.PHASE_LOG_SCAN):
+        pass
+    with tick_stats.phase(tick_stats.PHASE_LOG_SCAN):
+        pass
+    tick_stats.count(tick_stats.COUNTER_INFO_FILES_READ, 3)
+    tick_stats.count(tick_stats.COUNTER_INFO_FILES_READ, 2)
+    stats = tick_stats.end_tick(10)
+    assert list(stats.phases.keys()) == [tick_stats.PHASE_LOG_SCAN]
+    assert stats.counters == {tick_stats.COUNTER_INFO_FILES_READ: 5}
+    assert stats.overrun == 0.0
+
+
+def test_overrun():
+    tick_stats.start_tick()
+    stats = tick_stats.end_tick(0)
+    assert stats.overrun == stats.duration
+
+
+def test_ring_buffer_is_bounded():
+    for _ in range(tick_stats.RING_BUFFER_SIZE + 5):
+        tick_stats.start_tick()
+        tick_stats.end_tick(10)
+    assert len(tick_stats.recent()) == tick_stats.RING_BUFFER_SIZE
+    assert len(tick_stats.recent(3)) == 3
+
+
+def test_save_and_load(tmp_path):
+    assert tick_stats.load(str(tmp_path)) == []
+    tick_stats.start_tick()
+    tick_stats.count(tick_stats.COUNTER_JOBS_DISPATCHED)
+    tick_stats.end_tick(10)
+    tick_stats.save(str(tmp_path))
+    loaded = tick_stats.load(str(tmp_path))
+    assert len(loaded) == 1
+    assert loaded[0]['counters'] == {tick_stats.COUNTER_JOBS_DISPATCHED: 1}
+
+
+def test_shards_save_their_own_ticks(tmp_path):
+    tick_stats.start_tick()
+    tick_stats.end_tick(10)
+    tick_stats.save(str(tmp_path), "s1")
+    assert len(tick_stats.load(str(tmp_path), "s1")) == 1
+    assert tick_stats.load(str(tmp_path), "s2") == []
+    assert tick_stats.load(str(tmp_path)) == []
+
+
+def test_save_rewrites_file_when_full(tmp_path):
+    for i in range(2 * tick_stats.RING_BUFFER_SIZE + 1):
+        tick_stats.start_tick()
+        tick_stats.count(tick_stats.COUNTER_JOBS_DISPATCHED, i)
+        tick_stats.end_tick(10)
+        tick_stats.save(str(tmp_path))
+    with open(os.path.join(tmp_path, tick_stats.TICK_STATS_FILE)) as f:
+        assert len(f.readlines()) == tick_stats.RING_BUFFER_SIZE
+    loaded = tick_stats.load(str(tmp_path))
+    assert loaded[-1]['counters'] == {tick_stats.COUNTER_JOBS_DISPATCHED: 2 * tick_stats.RING_BUFFER_SIZE}
+
+
+def test_main_loop_records_tick(once_config, tmp_path, executor):
+    MockDateTime.set_mock(2024, 2, 14, 2, 14, 0, 'America/Denver')
+    once_config.log_dir = os.path.join(tmp_path, 'log_dir')
+    once_config.family_dir = os.path.join(tmp_path, 'family_dir')
+    dirs.make_dir(once_config.log_dir)
+    dirs.make_dir(once_config.family_dir)
+    with open(os.path.join(once_config.family_dir, "F1"), "w") as f:
+        f.write("""start="0000"
+        J1(tokens=["T1"]) J2(tokens=["T1"])
+        J3()
+        """)
+    prepare_required_dirs(once_config)
+
+    run_main_loop_until_end(once_config, MockDateTime.now(), lambda cfg: main_function(cfg, executor))
+
+    assert executor.calls == [('F1', 'J1')]
+    assert executor.queues == ['default']
+    [tick] = tick_stats.load(once_config.log_dir)
+    assert tick['counters'] == {
+        tick_stats.COUNTER_FILES_PARSED: 1,
+        tick_stats.COUNTER_INFO_FILES_READ: 0,
+        tick_stats.COUNTER_JOBS_EVALUATED: 3,
+        tick_stats.COUNTER_TOKENS_GRANTED: 1,
+        tick_stats.COUNTER_JOBS_DISPATCHED: 1,
+    }
+    assert set(tick['phases'].keys()) == {
+        tick_stats.PHASE_FAMILY_COPY,
+        tick_stats.PHASE_FAMILY_PARSE,
+        tick_stats.PHASE_LOG_SCAN,
+        tick_stats.PHASE_DEPENDENCY_EVAL,
+        tick_stats.PHASE_TOKEN_ACCOUNTING,
+        tick_stats.PHASE_DISPATCH,
+    }
+    assert tick['sleep_interval'] == 10
@@ -0,0 +1,137 @@
+import json
+import os
+
+import pytest
+import tomlkit
+
+import pytf.dirs as dirs
+import pytf.exceptions as ex
+import pytf.token_allocation as token_allocation
+from pytf.config import Config
+from pytf.config_reload import reload
+from pytf.mockdatetime import MockDateTime
+from pytf.runner import prepare_required_dirs
+
+CONFIG = """
+primary_tz = "America/Denver"
+tokens.T1 = 2
+tokens.T2 = 2
+token_aging = 300
+token_reserve_after = 1800
+"""
+
+NOW = 1_700_000_000
+
+
+@pytest.fixture
+def token_config(tmp_path):
+    config = Config.from_str(CONFIG)
+    config.log_dir = os.path.join(tmp_path, 'log_dir')
+    config.family_dir = os.path.join(tmp_path, 'family_dir')
+    dirs.make_dir(config.log_dir)
+    dirs.make_dir(config.family_dir)
+    MockDateTime.set_mock(2024, 2, 14, 2, 14, 0, 'America/Denver')
+    prepare_required_dirs(config)
+    return config
+
+
+def job(family_name, job_name, tokens=("T1",)):
+    return {'family_name': family_name, 'job_name': job_name, 'status': 'Ready', 'queue_name': 'default',
+            'tokens': list(tokens)}
+
+
+def held(*holders):
+    doc = tomlkit.document()
+    aot = tomlkit.aot()
+    for family_name, job_name, token_name in holders:
+        aot.append({'token_name': token_name, 'family_name': family_name, 'job_name': job_name})
+    doc.append('token', aot)
+    return doc
+
+
+def granted_jobs(flat_list):
+    return [f"{j['family_name']}::{j['job_name']}" for j in flat_list if j['status'] == 'Ready']
+
+
+def test_families_take_turns(token_config):
+    # A sorts first, but already holds a T2; B gets the first free T1
+    flat_list = [job("A", "J1"), job("A", "J2"), job("B", "J1"), job("B", "J2")]
+    token_doc = held(("A", "J0", "T2"))
+    assert token_allocation.allocate(token_config, flat_list, token_doc, {}, NOW)
+    assert granted_jobs(flat_list) == ["A::J1", "B::J1"]
+    assert [j['status'] for j in flat_list] == ["Ready", "Token Wait", "Ready", "Token Wait"]
+    assert [str(t['family_name']) for t in token_doc['token']] == ["A", "B", "A"]
+
+
+def test_weights_and_priorities(token_config):
+    flat_list = [job("A", "J1"), job("B", "J1")]
+    token_doc = held(("A", "J0", "T2"), ("B", "J0", "T2"))
+    token_config.token_weights = {"A": 2}
+    token_allocation.allocate(token_config, flat_list, token_doc, {}, NOW)
+    assert granted_jobs(flat_list) == ["A::J1", "B::J1"]
+
+    flat_list = [job("A", "J1", ["T1", "T1"]), job("B", "J1", ["T1", "T1"])]
+    token_config.token_priorities = {"B": 1}
+    token_allocation.allocate(token_config, flat_list, held(), {}, NOW)
+    assert granted_jobs(flat_list) == ["B::J1"]
+
+
+def test_waiting_jobs_age_ahead_and_waits_are_kept(token_config):
+    token_config.tokens_by_name["T1"].num_instances = 1
+    waits_path = os.path.join(token_config.todays_log_dir, token_allocation.WAITS_FILE)
+
+    # B holds two tokens, so A wins until B's job has waited long enough
+    flat_list = [job("A", "J1"), job("B", "J1")]
+    token_allocation.allocate(token_config, flat_list, held(("B", "J0", "T2"), ("B", "J9", "T2")), {}, NOW, save=True)
+    assert granted_jobs(flat_list) == ["A::J1"]
+    with open(waits_path) as f:
+        assert json.load(f) == {"B::J1": NOW}
+
+    flat_list = [job("A", "J2"), job("B", "J1")]
+    token_allocation.allocate(token_config, flat_list, held(("B", "J0", "T2"), ("B", "J9", "T2")), {}, NOW + 900,
+                              save=True)
+    assert granted_jobs(flat_list) == ["B::J1"]
+    with open(waits_path) as f:
+        assert json.load(f) == {"A::J2": NOW + 900}
+
+
+def test_long_wait_reserves_tokens(token_config):
+    big = job("A", "BIG", ["T1", "T1"])
+    token_doc = held(("C", "J0", "T1"))
+    flat_list = [big, job("B", "J1")]
+
+    token_allocation.allocate(token_config, flat_list, token_doc, {}, NOW, save=True)
+    assert granted_jobs(flat_list) == ["B::J1"]
+
+    # once BIG has waited token_reserve_after, the T1 that frees up is held for it
+    flat_list = [job("A", "BIG", ["T1", "T1"]), job("B", "J2")]
+    token_allocation.allocate(token_config, flat_list, held(("B", "J1", "T1")), {}, NOW + 1800, save=True)
+    assert granted_jobs(flat_list) == []
+
+    flat_list = [job("A", "BIG", ["T1", "T1"]), job("B", "J2")]
+    token_allocation.allocate(token_config, flat_list, held(), {}, NOW + 1900, save=True)
+    assert granted_jobs(flat_list) == ["A::BIG"]
+
+
+def test_invalid_weight_is_rejected(token_config):
+    with pytest.raises(ex.PyTaskforestParseException) as exc_info:
+        reload(token_config, CONFIG + "token_weights.A = 0\n")
+    assert str(exc_info.value) == f"{ex.MSG_CONFIG_INVALID_VALUE} token_weights.A = 0"
+
+
+def test_shards_keep_each_others_waits(token_config):
+    token_config.tokens_by_name["T1"].num_instances = 0
+    waits_path = os.path.join(token_config.todays_log_dir, token_allocation.WAITS_FILE)
+
+    # each shard only sees its own families; neither resets the other's wait times
+    for offset in (0, 60, 120):
+        token_allocation.allocate(token_config, [job("A", "J")], held(), {}, NOW + offset, save=True)
+        token_allocation.allocate(token_config, [job("B", "J")], held(), {}, NOW + offset + 30, save=True)
+    with open(waits_path) as f:
+        assert json.load(f) == {"A::J": NOW, "B::J": NOW + 30}
+
+    # a job that's dispatched is dropped only by the shard that owns it
+    token_config.tokens_by_name["T1"].num_instances = 1
+    token_allocation.allocate(token_config, [job("A", "J")], held(), {}, NOW + 180, save=True)
+    with open(waits_path) as f:
+        assert json.load(f) == {"B::J": NOW + 30}
@@ -0,0 +1,101 @@
+import logging
+import os
+import subprocess
+
+import pytest
+
+import pytf.warm_python as warm
+from pytf.job import Job
+from pytf.pytf_worker import start_process, poll_process
+
+
+@pytest.fixture(autouse=True)
+def stop_server():
+    yield
+    warm.shutdown()
+
+
+def write_script(tmp_path, name, body, shebang="#!/usr/bin/env python3\n"):
+    script_path = os.path.join(tmp_path, name)
+    with open(script_path, "w") as f:
+        f.write(shebang + body)
+    os.chmod(script_path, 0o755)
+    return script_path
+
+
+@pytest.fixture
+def run_log(caplog):
+    caplog.set_level(logging.INFO, logger='run_logger')
+    logging.getLogger('run_logger').propagate = True
+    yield caplog
+    logging.getLogger('run_logger').propagate = False
+
+
+def test_is_python_script(tmp_path):
+    assert warm.is_python_script(write_script(tmp_path, "a", "print(1)\n"))
+    assert warm.is_python_script(write_script(tmp_path, "b.py", "print(1)\n", shebang=""))
+    assert not warm.is_python_script(write_script(tmp_path, "c", "echo 1\n", shebang="#!/bin/bash\n"))
+    assert not warm.is_python_script(os.path.join(tmp_path, "missing"))
+
+
+def test_success_and_output(tmp_path, run_log):
+    script_path = write_script(tmp_path, "job", """
+import sys
+print("to stdout")
+print("to stderr", file=sys.stderr)
+""")
+    process = start_process(script_path, warm_python=True)
+    assert isinstance(process, warm.WarmProcess)
+    assert poll_process(process) == 0
+    messages = [(r.levelname, r.getMessage()) for r in run_log.records]
+    assert ("INFO", "to stdout") in messages
+    assert ("ERROR", "to stderr") in messages
+
+
+@pytest.mark.parametrize("body, expected", [
+    ("import sys\nsys.exit(3)\n", 3),
+    ("raise ValueError('boom')\n", 1),
+    ("import sys\nsys.exit('message')\n", 1),
+    ("import os, signal\nos.kill(os.getpid(), signal.SIGTERM)\n", 143),
+])
+def test_exit_codes_match_popen(tmp_path, body, expected):
+    script_path = write_script(tmp_path, "job", body)
+    assert poll_process(start_process(script_path, warm_python=True)) == expected
+    assert poll_process(start_process(script_path)) == expected
+
+
+def test_jobs_run_in_fresh_children(tmp_path):
+    script_path = write_script(tmp_path, "job", """
+import sys, os
+assert __name__ == "__main__"
+assert sys.argv == [__file__]
+if getattr(sys, "pytf_test_state", None):
+    sys.exit(9)
+sys.pytf_test_state = True
+print(os.getpid())
+""")
+    first = start_process(script_path, warm_python=True)
+    second = start_process(script_path, warm_python=True)
+    assert poll_process(first) == 0
+    assert poll_process(second) == 0
+    assert first.pid != second.pid
+
+
+def test_server_restarts(tmp_path):
+    script_path = write_script(tmp_path, "job", "pass\n")
+    assert poll_process(start_process(script_path, warm_python=True)) == 0
+    warm._server.kill()
+    warm._server.wait()
+    assert poll_process(start_process(script_path, warm_python=True)) == 0
+
+
+def test_non_python_scripts_use_the_shell(tmp_path):
+    script_path = write_script(tmp_path, "job", "exit 4\n", shebang="#!/bin/bash\n")
+    process = start_process(script_path, warm_python=True)
+    assert isinstance(process, subprocess.Popen)
+    assert poll_process(process) == 4
+
+
+def test_job_param():
+    assert Job.parse('J1(warm_python=true)', 'F1').warm_python is True
+    assert Job.parse('J1()', 'F1').warm_python is None
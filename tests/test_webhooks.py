@@ -0,0 +1,243 @@
+import http.server
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import pytf.dirs as dirs
+import pytf.events as events
+import pytf.webhooks as webhooks
+from pytf.config import Config
+from pytf.main import main_function
+from pytf.mockdatetime import MockDateTime
+from pytf.runner import prepare_required_dirs
+
+
+class StubServer:
+    """
+    Records every POST. Answers with the codes in `responses` in order, then 200.
+    """
+    def __init__(self):
+        self.batches = []
+        self.headers = []
+        self.responses = []
+        self.connections = set()
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                stub.connections.add(self.client_address)
+                stub.headers.append(dict(self.headers))
+                code = stub.responses.pop(0) if stub.responses else 200
+                if code == 200:
+                    stub.batches.append(json.loads(body)['events'])
+                self.send_response(code)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/hook"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def events(self):
+        return [e for batch in self.batches for e in batch]
+
+
+@pytest.fixture
+def stub():
+    server = StubServer()
+    yield server
+    server.server.shutdown()
+    server.server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def clean_up():
+    yield
+    webhooks.stop(timeout=0)
+    events.reset()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def make_sender(stub, tmp_path, **kwargs):
+    return webhooks.WebhookSender(url=stub.url, spool_path=os.path.join(tmp_path, webhooks.SPOOL_FILE),
+                                  auth="Bearer secret", flush_interval=0.05, initial_backoff=0.01, **kwargs)
+
+
+def test_batches_over_one_connection(stub, tmp_path):
+    sender = make_sender(stub, tmp_path, batch_size=10)
+    sender.submit([{"id": str(i)} for i in range(25)])
+    wait_for(lambda: len(stub.events) == 25)
+    sender.stop()
+    assert [e['id'] for e in stub.events] == [str(i) for i in range(25)]
+    assert [len(b) for b in stub.batches] == [10, 10, 5]
+    assert len(stub.connections) == 1
+    assert stub.headers[0]['Authorization'] == "Bearer secret"
+    assert stub.headers[0]['Content-Type'] == "application/json"
+
+
+def test_retries_with_backoff(stub, tmp_path):
+    stub.responses = [500, 503]
+    sender = make_sender(stub, tmp_path)
+    sender.submit([{"id": "1"}])
+    wait_for(lambda: stub.events)
+    sender.stop()
+    assert len(stub.headers) == 3
+    assert stub.events == [{"id": "1"}]
+
+
+def test_client_errors_are_dropped(stub, tmp_path):
+    stub.responses = [400]
+    sender = make_sender(stub, tmp_path)
+    sender.submit([{"id": "1"}])
+    wait_for(lambda: stub.headers)
+    sender.submit([{"id": "2"}])
+    wait_for(lambda: stub.events)
+    sender.stop()
+    assert stub.events == [{"id": "2"}]
+
+
+def test_overflow_and_undelivered_events_are_spooled(tmp_path, stub):
+    spool_path = os.path.join(tmp_path, webhooks.SPOOL_FILE)
+    sender = webhooks.WebhookSender(url="http://127.0.0.1:1/unreachable", spool_path=spool_path,
+                                    max_queue=2, initial_backoff=10)
+    sender.submit([{"id": str(i)} for i in range(5)])
+    sender.stop(timeout=1)
+    with open(spool_path) as f:
+        assert sorted(json.loads(line)['id'] for line in f) == [str(i) for i in range(5)]
+
+    # the next sender delivers the spool before anything new
+    sender = make_sender(stub, tmp_path)
+    sender.submit([{"id": "new"}])
+    wait_for(lambda: len(stub.events) == 6)
+    sender.stop()
+    assert sorted(e['id'] for e in stub.events[:5]) == [str(i) for i in range(5)]
+    assert stub.events[5] == {"id": "new"}
+    assert not os.path.exists(spool_path)
+
+
+def test_unreadable_spool_lines_are_skipped(tmp_path, stub):
+    spool_path = webhooks.spool_path_for(str(tmp_path), "s1")
+    assert spool_path == os.path.join(tmp_path, "webhook_spool.s1.jsonl")
+    with open(spool_path, "w") as f:
+        f.write('{"id": "1"}\n{"id": \n{"id": "2"}\n')
+
+    sender = webhooks.WebhookSender(url=stub.url, spool_path=spool_path, flush_interval=0.05)
+    wait_for(lambda: len(stub.events) == 2)
+    sender.submit([{"id": "new"}])
+    wait_for(lambda: len(stub.events) == 3)
+    sender.stop()
+    assert [e['id'] for e in stub.events] == ["1", "2", "new"]
+    assert not os.path.exists(spool_path)
+
+
+def test_submit_does_not_block(tmp_path):
+    sender = webhooks.WebhookSender(url="http://127.0.0.1:1/unreachable",
+                                    spool_path=os.path.join(tmp_path, webhooks.SPOOL_FILE),
+                                    max_queue=10, initial_backoff=10)
+    start = time.monotonic()
+    for _ in range(100):
+        sender.submit([{"id": "x"}] * 10)
+    assert time.monotonic() - start < 1
+    sender.stop(timeout=1)
+    assert sender.spooled == 1000
+
+
+def finish(config, family_name, job_name, error_code=None, retry=False):
+    with open(os.path.join(config.todays_log_dir, f"{family_name}.{job_name}.default.w.20240214010000.info"), "w") as f:
+        f.write(f'family_name = "{family_name}"\njob_name = "{job_name}"\ntz = "America/Denver"\n'
+                'queue_name = "default"\nnum_retries = 1\nretry_sleep = 0\nworker_name = "w"\n'
+                'start_time = "2024/02/14 01:00:00"\n')
+        if error_code is not None:
+            f.write(f'error_code = {error_code}\n')
+        if retry:
+            f.write('retry_wait_until = 1707900000\n')
+
+
+class NullExecutor:
+    def apply_async(self, args, queue):
+        pass
+
+
+def test_scheduler_sends_job_events(tmp_path, stub):
+    config = Config.from_str(f"""
+    primary_tz = "America/Denver"
+    web_hook = "{stub.url}"
+    hook_auth = "Bearer secret"
+    """)
+    config.log_dir = os.path.join(tmp_path, 'log_dir')
+    config.family_dir = os.path.join(tmp_path, 'family_dir')
+    dirs.make_dir(config.log_dir)
+    dirs.make_dir(config.family_dir)
+    MockDateTime.set_mock(2024, 2, 14, 2, 14, 0, 'America/Denver')
+    with open(os.path.join(config.family_dir, "F1"), "w") as f:
+        f.write('start="0100"\nJ1()\nJ2()\n')
+    prepare_required_dirs(config)
+    dirs.copy_files_from_dir_to_dir(config.family_dir, config.todays_family_dir)
+
+    finish(config, "F1", "J1")
+    main_function(config, NullExecutor())
+    finish(config, "F1", "J1", error_code=1, retry=True)
+    main_function(config, NullExecutor())
+    main_function(config, NullExecutor())
+    finish(config, "F1", "J1", error_code=0)
+    main_function(config, NullExecutor())
+
+    # a restarted scheduler doesn't send them again
+    webhooks.stop()
+    events.reset()
+    main_function(config, NullExecutor())
+
+    assert [(e['job_name'], e['event']) for e in stub.events] == \
+        [("J1", "start"), ("J1", "retry"), ("J1", "success")]
+    assert stub.events[-1]['error_code'] == 0
+    assert stub.events[0]['id'] == "20240214.F1.J1.2024/02/14 01:00:00.start"
+
+
+def test_shards_keep_their_own_seen_events(tmp_path):
+    def shard_config(shard):
+        config = Config.from_str('primary_tz = "America/Denver"\nshards = ["s1", "s2"]\n')
+        config.todays_log_dir = os.path.join(tmp_path, '20240214')
+        config.shard = shard
+        return config
+
+    def in_process(process_seen, config, flat_list):
+        # each shard is its own scheduler process, with its own in-memory seen events
+        events._seen.clear()
+        events._seen.update(process_seen)
+        found = events.detect(config, flat_list)
+        process_seen.clear()
+        process_seen.update(events._seen)
+        return found
+
+    MockDateTime.set_mock(2024, 2, 14, 2, 14, 0, 'America/Denver')
+    s1, s2 = shard_config("s1"), shard_config("s2")
+    dirs.make_dir(s1.todays_log_dir)
+    job = {'status': 'Running', 'start_time': "2024/02/14 01:00:00"}
+    f1 = [dict(job, family_name="F1", job_name="J1")]
+    f2 = [dict(job, family_name="F2", job_name="J1")]
+
+    p1, p2 = {}, {}
+    in_process(p1, s1, [])
+    in_process(p2, s2, [])
+    assert len(in_process(p1, s1, f1)) == 1
+    assert len(in_process(p2, s2, f2)) == 1
+
+    # restarted shards don't announce their own jobs again
+    assert in_process({}, s1, f1) == []
+    assert in_process({}, s2, f2) == []
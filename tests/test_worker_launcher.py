@@ -0,0 +1,85 @@
+import os
+import time
+
+import pytest
+
+import pytf.dirs as dirs
+import pytf.exceptions as ex
+import pytf.logs as logs
+import pytf.worker_launcher as worker_launcher
+from pytf.config import Config
+from pytf.mockdatetime import MockDateTime
+from pytf.runner import prepare_required_dirs
+
+CONFIG = """
+primary_tz = "America/Denver"
+
+[queues.default]
+max_concurrency = 4
+acks_late = true
+
+[queues.big]
+min_concurrency = 0
+max_concurrency = 2
+prefetch = 1
+max_load = 2
+"""
+
+
+@pytest.fixture
+def queue_config(tmp_path):
+    config = Config.from_str(CONFIG)
+    config.log_dir = os.path.join(tmp_path, 'log_dir')
+    config.family_dir = os.path.join(tmp_path, 'family_dir')
+    dirs.make_dir(config.log_dir)
+    dirs.make_dir(config.family_dir)
+    MockDateTime.set_mock(2024, 2, 14, 2, 14, 0, 'America/Denver')
+    prepare_required_dirs(config)
+    return config
+
+
+def test_every_queue_gets_settings(queue_config):
+    with open(os.path.join(queue_config.family_dir, "F1"), "w") as f:
+        f.write('start="0100"\nJ1(queue="reports") J2()\n')
+    settings = worker_launcher.queue_settings(queue_config)
+    assert list(settings) == ["big", "default", "reports"]
+    assert settings["default"] == dict(worker_launcher.DEFAULT_QUEUE, max_concurrency=4, acks_late=True)
+    assert settings["big"]["max_load"] == 2
+    assert settings["reports"] == worker_launcher.DEFAULT_QUEUE
+
+    command = worker_launcher.celery_command("big", settings["big"])
+    assert command[command.index("-Q") + 1] == "big"
+    assert "--autoscale=2,0" in command
+
+
+@pytest.mark.parametrize("line", ["max_concurrency = 0", "min_concurrency = 5", "acks_late = 1", "threads = 2"])
+def test_invalid_queue_settings_are_rejected(queue_config, line):
+    config = Config.from_str(f"{CONFIG}\n[queues.bad]\n{line}\n")
+    with pytest.raises(ex.PyTaskforestParseException) as exc_info:
+        worker_launcher.queue_settings(config)
+    assert str(exc_info.value).startswith(f"{ex.MSG_CONFIG_INVALID_VALUE} queues.bad")
+
+
+def test_target_concurrency():
+    queue = dict(worker_launcher.DEFAULT_QUEUE, min_concurrency=1, max_concurrency=4, max_load=1.0)
+    assert worker_launcher.target_concurrency(queue, 0, 3, 0.5) == 1
+    assert worker_launcher.target_concurrency(queue, 3, 1, 0.5) == 3
+    assert worker_launcher.target_concurrency(queue, 10, 1, 0.5) == 4
+    # a busy host doesn't get more processes, but can still lose them
+    assert worker_launcher.target_concurrency(queue, 10, 2, 1.5) == 2
+    assert worker_launcher.target_concurrency(queue, 0, 3, 1.5) == 1
+
+
+def test_waiting_jobs_and_states(queue_config):
+    log_dir = queue_config.todays_log_dir
+    logs.mark_queued(log_dir, "F1", "J1", "default", 0)
+    logs.mark_queued(log_dir, "F1", "J2", "default", 0)
+    logs.mark_queued(log_dir, "F2", "J1", "big", 0)
+    assert worker_launcher.waiting_jobs(queue_config.log_dir, queue_config.primary_tz, "default") == 2
+    assert worker_launcher.waiting_jobs(queue_config.log_dir, queue_config.primary_tz, "reports") == 0
+
+    assert worker_launcher.load_states(queue_config.log_dir) == []
+    worker_launcher.save_state(queue_config.log_dir, "default", {'queue': "default", 'updated': time.time()})
+    worker_launcher.save_state(queue_config.log_dir, "big", {'queue': "big", 'updated': time.time() - 3600})
+    states = worker_launcher.load_states(queue_config.log_dir)
+    assert [(s['queue'], s['stale']) for s in states] == [("big", True), ("default", False)]